@@ -0,0 +1,244 @@
+import logging
+import re
+import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from src.core.drone_constants import STARTING_FLIGHT_PLAN_NUM
+from src.core.drone_plan import DronePlan, DronePlanManager
+from src.core.drone_variables import DroneVariables
+from src.core.plan_generator import PlanGenerator
+from src.llms.llm_models import OpenAIModel
+from src.llms.rate_limiter import RequestPriority
+from utils.metrics import CACHE_HITS, CACHE_MISSES, METRICS
+
+ALPHA_CELL_PATTERN = re.compile(r"\b([A-Z])(\d{1,3})\b")
+NUMERIC_CELL_PATTERN = re.compile(r"\((\d+),\s*(\d+)\)")
+CELL_PLACEHOLDER = "{cell}"
+PERSON_FOUND_EVENT = "The missing person has been found at location {}."
+WEATHER_EVENT = "The weather has changed to {}."
+DEFAULT_WEATHER_CHANGES = ["rain", "high winds", "fog"]
+ASSISTANT_ROLE = "assistant"
+
+Locations = Tuple[Tuple[str, Tuple], ...]
+
+
+@dataclass
+class _Speculation:
+    """
+    :param cells: The cells mentioned in the event.
+    :param locations: The drone locations the adaptation assumed.
+    :param base_plan_manager: The plan of the mission that was adapted.
+    :param generator: The fork of the plan generator containing the adapted mission.
+    """
+    cells: Tuple[Tuple[int, int], ...]
+    locations: Locations
+    base_plan_manager: Optional[DronePlanManager]
+    generator: PlanGenerator
+
+
+class AdaptationSpeculator:
+    """
+    Generates adapted plans for likely events in the background so a matching event can be served without waiting on the model.
+    Events are matched on their text with the mentioned cells removed and, if cells are mentioned, on the nearest cells.
+    Speculated plans are only served for the drone locations and the plan they were generated from.
+    """
+
+    def __init__(self, plan_generator: PlanGenerator, token_budget: int, max_cell_distance: int = 1, max_workers: int = 1):
+        """
+        Creates the speculator for the mission of the plan generator.
+        :param plan_generator: The generator of the mission (used for its configuration and current plan).
+        :param token_budget: The maximum number of tokens spent on speculation.
+        :param max_cell_distance: The maximum (manhattan) distance between the cells of an event and a speculated event.
+        :param max_workers: The number of speculations generated concurrently.
+        """
+        self.plan_generator = plan_generator
+        self.token_budget = token_budget
+        self.max_cell_distance = max_cell_distance
+        self.max_workers = max_workers
+        self.tokens_spent = 0
+        self.tokens_reserved = 0
+        self._max_cost: Optional[int] = None
+        self._speculations: Dict[Tuple[str, int], List[_Speculation]] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @staticmethod
+    def get_likely_events(variables: DroneVariables, weather_changes: List[str] = None) -> List[str]:
+        """
+        Creates the default likely events: the person being found in each terrain region and changes in the weather.
+        :param variables: The configuration of the mission.
+        :param weather_changes: The weather changes to speculate on.
+        :return: The events.
+        """
+        weather_changes = DEFAULT_WEATHER_CHANGES if weather_changes is None else weather_changes
+        events = []
+        for terrain in variables.terrains:
+            blocks = terrain["blocks"]
+            if blocks:
+                events.append(PERSON_FOUND_EVENT.format(blocks[len(blocks) // 2]))
+        events.extend(WEATHER_EVENT.format(w) for w in weather_changes if w != variables.weather_status)
+        return events
+
+    def start(self, events: List[str], current_location_of_drones: Dict, current_round: int = STARTING_FLIGHT_PLAN_NUM,
+              **params) -> None:
+        """
+        Starts generating adaptations for the events in the background (with background priority).
+        :param events: The likely events.
+        :param current_location_of_drones: Maps the id of the drone to the cell it is assumed to be at.
+        :param current_round: The round the drones are assumed to be flying.
+        :param params: Any additional parameters to the generation (e.g. mock_response).
+        :return: None
+        """
+        self._stopped.clear()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="speculation")
+        params.setdefault("priority", RequestPriority.BACKGROUND)
+        for event in events:
+            self._executor.submit(self._speculate, event, current_location_of_drones, current_round, params)
+
+    def stop(self) -> None:
+        """
+        Stops starting new speculations (speculations in progress are finished).
+        :return: None
+        """
+        self._stopped.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get(self, event: str, current_location_of_drones: Dict,
+            current_round: int = STARTING_FLIGHT_PLAN_NUM) -> Optional[List[DronePlan]]:
+        """
+        Serves the speculated adaptation of the closest matching event, updating the plan generator to the adapted mission.
+        :param event: The event that occurred.
+        :param current_location_of_drones: Maps the id of the drone to its current cell location.
+        :param current_round: The round the drones are flying.
+        :return: The adapted plans or None if no speculated event matches.
+        """
+        template, cells = self.normalize_event(event)
+        locations = self._normalize_locations(current_location_of_drones)
+        with self._lock:
+            candidates = list(self._speculations.get((template, current_round), []))
+        best, best_distance = None, None
+        for speculation in candidates:
+            if len(speculation.cells) != len(cells) or speculation.locations != locations \
+                    or speculation.base_plan_manager is not self.plan_generator.plan_manager:
+                continue
+            distance = max([abs(a[0] - b[0]) + abs(a[1] - b[1]) for a, b in zip(cells, speculation.cells)], default=0)
+            if distance <= self.max_cell_distance and (best_distance is None or distance < best_distance):
+                best, best_distance = speculation, distance
+        METRICS.increment(CACHE_HITS if best else CACHE_MISSES, cache="speculation")
+        if best is None:
+            return None
+        self.plan_generator.adopt(best.generator)
+        with self._lock:
+            self._speculations.clear()
+        return self.plan_generator.plan_manager.get_plans()
+
+    def generate_adaption(self, plan_adaptation: str, current_location_of_drones: Dict,
+                          current_round: int = STARTING_FLIGHT_PLAN_NUM, **params) -> List[DronePlan]:
+        """
+        Serves the speculated plans for the event if one matches, else generates the adaptation.
+        Either way, the plan generator continues from the adapted mission.
+        :param plan_adaptation: Contains the updated information for adapting the plan.
+        :param current_location_of_drones: Maps the id of the drone to its current cell location.
+        :param current_round: The round the drones are currently flying.
+        :param params: Any additional parameters to the generation.
+        :return: A plan for each drone.
+        """
+        speculated_plans = self.get(plan_adaptation, current_location_of_drones, current_round)
+        if speculated_plans is not None:
+            logging.info(f"Serving speculated adaptation for: {plan_adaptation}")
+            return speculated_plans
+        return self.plan_generator.generate_adaption(plan_adaptation, current_location_of_drones,
+                                                     current_round=current_round, **params)
+
+    @staticmethod
+    def normalize_event(event: str) -> Tuple[str, Tuple[Tuple[int, int], ...]]:
+        """
+        Separates the cells mentioned in the event from its (case, punctuation and whitespace insensitive) text.
+        :param event: The event.
+        :return: The normalized text with cells replaced by a placeholder and the numeric coordinates of the cells.
+        """
+        cells = [(int(x), string.ascii_uppercase.index(y) + 1) for y, x in ALPHA_CELL_PATTERN.findall(event)]
+        template = ALPHA_CELL_PATTERN.sub(CELL_PLACEHOLDER, event)
+        cells.extend((int(x), int(y)) for x, y in NUMERIC_CELL_PATTERN.findall(template))
+        template = NUMERIC_CELL_PATTERN.sub(CELL_PLACEHOLDER, template).lower()
+        template = re.sub(r"[^\w{}\s]", " ", template)
+        return " ".join(template.split()), tuple(cells)
+
+    @staticmethod
+    def get_cost(conversation_history: List[Dict], model: OpenAIModel = OpenAIModel.GPT4) -> int:
+        """
+        Estimates the tokens spent on a conversation: each completion is charged its prompt (the messages before it) and
+        its response.
+        :param conversation_history: The messages of the conversation.
+        :param model: The model the messages were sent to.
+        :return: The estimated number of tokens.
+        """
+        cost, n_context_tokens = 0, 0
+        for message in conversation_history:
+            n_context_tokens += PlanGenerator._count_tokens([message], model)
+            if message["role"] == ASSISTANT_ROLE:
+                cost += n_context_tokens
+        return cost
+
+    @staticmethod
+    def _normalize_locations(current_location_of_drones: Dict) -> Locations:
+        """
+        :param current_location_of_drones: Maps the id of the drone to its cell location.
+        :return: The locations as a comparable tuple.
+        """
+        return tuple(sorted((str(drone_id), tuple(location) if isinstance(location, (list, tuple)) else (location,))
+                            for drone_id, location in current_location_of_drones.items()))
+
+    def _reserve(self) -> Optional[int]:
+        """
+        Reserves the budget of a speculation: the cost of the most expensive speculation so far (initially that of the
+        conversation of the mission).
+        :return: The reserved tokens or None if the budget does not allow another speculation.
+        """
+        with self._lock:
+            if self._max_cost is None:
+                self._max_cost = self.get_cost(self.plan_generator.conversation_history)
+            if self.tokens_spent + self.tokens_reserved + self._max_cost > self.token_budget:
+                return None
+            self.tokens_reserved += self._max_cost
+            return self._max_cost
+
+    def _speculate(self, event: str, current_location_of_drones: Dict, current_round: int, params: Dict) -> None:
+        """
+        Generates and stores the adaptation for a single event if the budget allows. The budget is reserved before
+        generating and settled with the actual cost afterwards, so concurrent speculations do not overshoot it.
+        :param event: The likely event.
+        :param current_location_of_drones: Maps the id of the drone to the cell it is assumed to be at.
+        :param current_round: The round the drones are assumed to be flying.
+        :param params: Any additional parameters to the generation.
+        :return: None
+        """
+        if self._stopped.is_set():
+            return
+        reserved = self._reserve()
+        if reserved is None:
+            return
+        base_plan_manager = self.plan_generator.plan_manager
+        generator = self.plan_generator.fork()
+        try:
+            generator.generate_adaption(event, current_location_of_drones, current_round=current_round, **params)
+        except Exception:
+            logging.exception(f"Failed to speculate on: {event}")
+            return
+        finally:
+            cost = self.get_cost(generator.conversation_history)
+            with self._lock:
+                self.tokens_reserved -= reserved
+                self.tokens_spent += cost
+                self._max_cost = max(self._max_cost, cost)
+        template, cells = self.normalize_event(event)
+        speculation = _Speculation(cells, self._normalize_locations(current_location_of_drones), base_plan_manager, generator)
+        with self._lock:
+            self._speculations.setdefault((template, current_round), []).append(speculation)
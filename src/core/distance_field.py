@@ -0,0 +1,142 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+from core.drone_variables import CoordinateType, DroneVariables
+from core.plan_validator import PlanValidator
+from utils.metrics import CACHE_HITS, CACHE_MISSES, METRICS
+
+UNREACHABLE = -1
+BLOCKED = -2
+MAX_CACHED_FIELDS = 32
+MapKey = Tuple[int, int, Tuple[CoordinateType, ...]]
+
+
+class StationDistanceField:
+    """
+    The number of moves from every cell to its nearest station (charging stations, charging terrain and the launch point),
+    computed once per map with a multi-source breadth-first search.
+    """
+    _fields: Dict[MapKey, "StationDistanceField"] = {}
+
+    def __init__(self, distances: np.ndarray, nearest: np.ndarray, stations: np.ndarray):
+        """
+        Wraps computed fields; use for_variables or compute.
+        :param distances: Array of shape (n_height_blocks, n_width_blocks) with the moves to the nearest station (-1 if unreachable).
+        :param nearest: Array of the same shape with the index of the nearest station (-1 if unreachable).
+        :param stations: Array of shape (n_stations, 2) with the numeric coordinate of each station.
+        """
+        self.distances = distances
+        self.nearest = nearest
+        self.stations = stations
+
+    @staticmethod
+    def for_variables(variables: DroneVariables) -> "StationDistanceField":
+        """
+        Gets the field of the mission's map, computing it only the first time the map is requested.
+        :param variables: The configuration of the mission.
+        :return: The field.
+        """
+        stations = tuple(sorted(PlanValidator(variables).stations))
+        key = (variables.n_width_blocks, variables.n_height_blocks, stations)
+        field = StationDistanceField._fields.get(key)
+        if field is not None:
+            METRICS.increment(CACHE_HITS, cache="distance_field")
+            return field
+        METRICS.increment(CACHE_MISSES, cache="distance_field")
+        field = StationDistanceField.compute(variables.n_width_blocks, variables.n_height_blocks, stations)
+        if len(StationDistanceField._fields) >= MAX_CACHED_FIELDS:
+            StationDistanceField._fields.pop(next(iter(StationDistanceField._fields)))
+        StationDistanceField._fields[key] = field
+        return field
+
+    @staticmethod
+    def compute(n_width_blocks: int, n_height_blocks: int, stations: Iterable[CoordinateType],
+                blocked: Optional[np.ndarray] = None) -> "StationDistanceField":
+        """
+        Runs a breadth-first search from all stations at once, expanding each layer of the frontier with array operations.
+        Drones move to adjacent cells only (no diagonals, no wrapping). Ties between equally distant stations are broken
+        arbitrarily.
+        :param n_width_blocks: The width of the search area in blocks.
+        :param n_height_blocks: The height of the search area in blocks.
+        :param stations: The numeric coordinates of the stations.
+        :param blocked: Optional boolean array of shape (n_height_blocks, n_width_blocks) marking cells drones cannot enter.
+        :return: The field.
+        """
+        stations = np.array(list(stations), dtype=np.int64).reshape(-1, 2)
+        n_cells = n_width_blocks * n_height_blocks
+        distances = np.full(n_cells, UNREACHABLE, dtype=np.int32)
+        nearest = np.full(n_cells, UNREACHABLE, dtype=np.int32)
+        if blocked is not None:
+            distances[blocked.ravel()] = BLOCKED
+        frontier = (stations[:, 1] - 1) * n_width_blocks + stations[:, 0] - 1
+        frontier, first_station = np.unique(frontier, return_index=True)
+        distances[frontier] = 0
+        nearest[frontier] = first_station
+        moves = [(-n_width_blocks, lambda c: c >= n_width_blocks), (n_width_blocks, lambda c: c < n_cells - n_width_blocks),
+                 (-1, lambda c: c % n_width_blocks > 0), (1, lambda c: c % n_width_blocks < n_width_blocks - 1)]
+        distance = 0
+        while len(frontier) > 0:
+            distance += 1
+            sources = np.concatenate([frontier[is_valid(frontier)] for _, is_valid in moves])
+            neighbors = np.concatenate([frontier[is_valid(frontier)] + offset for offset, is_valid in moves])
+            is_new = distances[neighbors] == UNREACHABLE
+            frontier, first = np.unique(neighbors[is_new], return_index=True)
+            distances[frontier] = distance
+            nearest[frontier] = nearest[sources[is_new][first]]
+        distances[distances == BLOCKED] = UNREACHABLE
+        shape = (n_height_blocks, n_width_blocks)
+        return StationDistanceField(distances.reshape(shape), nearest.reshape(shape), stations)
+
+    def get_distance(self, cell: CoordinateType) -> int:
+        """
+        :param cell: The numeric coordinate of a cell.
+        :return: The number of moves from the cell to its nearest station (-1 if unreachable).
+        """
+        x, y = cell
+        return int(self.distances[y - 1, x - 1])
+
+    def get_nearest_station(self, cell: CoordinateType) -> Optional[CoordinateType]:
+        """
+        :param cell: The numeric coordinate of a cell.
+        :return: The numeric coordinate of the station nearest to the cell (None if unreachable).
+        """
+        x, y = cell
+        station = self.nearest[y - 1, x - 1]
+        return None if station == UNREACHABLE else tuple(self.stations[station].tolist())
+
+    def estimate_transit(self, search_cells: Iterable[CoordinateType]) -> int:
+        """
+        Estimates the moves a flight spends outside its search: from a station to its first cell (a) and from its last cell
+        back to the nearest station (c).
+        :param search_cells: The cells searched during the flight in order.
+        :return: The number of transit moves (0 if nothing is searched).
+        """
+        search_cells = list(search_cells)
+        if not search_cells:
+            return 0
+        return self.get_distance(search_cells[0]) + self.get_distance(search_cells[-1])
+
+    def is_feasible(self, search_cells: Iterable[CoordinateType], cells_in_single_battery: int) -> bool:
+        """
+        Checks whether a flight can reach its search, search every cell and return to a station on a single battery, i.e.
+        whether the cells it visits (one more than its moves) fit the limit of PlanValidator.
+        :param search_cells: The cells searched during the flight in order.
+        :param cells_in_single_battery: The number of cells that can be searched in a single battery life.
+        :return: Whether the flight is feasible (True if nothing is searched).
+        """
+        search_cells = list(search_cells)
+        if not search_cells:
+            return True
+        if any(self.get_distance(c) == UNREACHABLE for c in (search_cells[0], search_cells[-1])):
+            return False
+        n_moves = len(search_cells) - 1 + self.estimate_transit(search_cells)
+        return n_moves + 1 <= PlanValidator.get_max_cells(cells_in_single_battery)
+
+    def get_reachable_mask(self, cells_in_single_battery: int) -> np.ndarray:
+        """
+        :param cells_in_single_battery: The number of cells that can be searched in a single battery life.
+        :return: Boolean array of shape (n_height_blocks, n_width_blocks) marking cells a drone can visit and return from
+                 (a flight searching only that cell is feasible).
+        """
+        return (self.distances != UNREACHABLE) & (2 * self.distances + 1 <= PlanValidator.get_max_cells(cells_in_single_battery))
@@ -1,28 +1,144 @@
-from typing import List
+from array import array
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
 
 from core.drone_constants import BlockCoordinate
+from utils.drone_util import to_numeric
+
+INT16_TYPE = "h"
+INT32_TYPE = "i"
+BOOL_TYPE = "b"
 
 
 class DronePlan:
+    """
+    Plan of a single drone. Cells are stored as interleaved x, y values in a compact integer array (int16, widened to int32
+    if a coordinate does not fit) along with the index of the first cell of each round and whether the round starts at the
+    last cell of the previous round (which is then stored once, in the previous round).
+    """
+    __slots__ = ("id", "_cells", "_segments", "_shared_starts")
 
     def __init__(self, drone_id: str, cells: List[BlockCoordinate]):
         """
         Creates a plan for a drone.
         :param drone_id: Id of drone.
-        :param cells: The blocks that
+        :param cells: The blocks that the drone will fly through.
         """
         self.id = drone_id
-        self.coordinates = cells
+        self._cells = array(INT16_TYPE)
+        self._segments = array(INT32_TYPE)
+        self._shared_starts = array(BOOL_TYPE)
+        if cells:
+            self.add_to_plan(cells)
+
+    @property
+    def coordinates(self) -> List[Tuple[int, int]]:
+        """
+        :return: The cells of the plan as a list of (x, y) tuples.
+        """
+        cells = self._cells
+        return list(zip(cells[0::2], cells[1::2]))
+
+    @property
+    def n_rounds(self) -> int:
+        """
+        :return: The number of rounds (flights) that were added to the plan.
+        """
+        return len(self._segments)
+
+    def get_cell(self, index: int) -> Tuple[int, int]:
+        """
+        Gets a single cell of the plan without building the full list of coordinates.
+        :param index: The index of the cell (negative indices count from the end).
+        :return: The (x, y) coordinate of the cell.
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Plan of {self.id} has no cell {index}")
+        return self._cells[2 * index], self._cells[2 * index + 1]
+
+    def get_round(self, round_num: int) -> List[Tuple[int, int]]:
+        """
+        Gets the cells added in the given round.
+        :param round_num: The index of the round.
+        :return: The cells of the round.
+        """
+        start, end = self.get_round_bounds(round_num)
+        cells = self._cells[2 * start: 2 * end]
+        return list(zip(cells[0::2], cells[1::2]))
+
+    def get_flight(self, round_num: int) -> List[Tuple[int, int]]:
+        """
+        Gets the cells flown in the given round, including its starting cell when it is shared with the previous round.
+        :param round_num: The index of the round.
+        :return: The cells of the flight.
+        """
+        cells = self.get_round(round_num)
+        return [self.get_cell(self._segments[round_num] - 1)] + cells if self.is_start_shared(round_num) else cells
+
+    def is_start_shared(self, round_num: int) -> bool:
+        """
+        :param round_num: The index of the round.
+        :return: Whether the round starts at the last cell of the previous round (stored as part of the previous round).
+        """
+        return bool(self._shared_starts[round_num])
+
+    def get_round_bounds(self, round_num: int) -> Tuple[int, int]:
+        """
+        Gets the cell indices of the given round.
+        :param round_num: The index of the round.
+        :return: The index of the first cell of the round and the index after its last cell.
+        """
+        start = self._segments[round_num]
+        end = self._segments[round_num + 1] if round_num + 1 < len(self._segments) else len(self)
+        return start, end
+
+    def copy_rounds(self, n_rounds: int = None) -> "DronePlan":
+        """
+        Copies the first rounds of the plan.
+        :param n_rounds: The number of rounds to copy (all rounds if None).
+        :return: A new plan containing the rounds.
+        """
+        n_rounds = self.n_rounds if n_rounds is None else min(n_rounds, self.n_rounds)
+        end = self.get_round_bounds(n_rounds - 1)[1] if n_rounds > 0 else 0
+        plan = DronePlan(self.id, [])
+        plan._cells = self._cells[:2 * end]
+        plan._segments = self._segments[:n_rounds]
+        plan._shared_starts = self._shared_starts[:n_rounds]
+        return plan
 
-    def add_to_plan(self, coordinates: List[BlockCoordinate]) -> None:
+    def add_to_plan(self, coordinates: Iterable[BlockCoordinate]) -> None:
         """
-        Adds the new coordinates to the plan.
+        Adds the new coordinates to the plan as a new round. The first coordinate is skipped if the drone is already there.
         :param coordinates: List of coordinates to add.
         :return: None
         """
-        if self.coordinates and self.coordinates[-1] == coordinates[0]:
-            coordinates.pop(0)
-        self.coordinates.extend(self.coordinates)
+        values = [v for coordinate in coordinates for v in coordinate]
+        is_start_shared = bool(len(self._cells) and values and self._cells[-2] == values[0] and self._cells[-1] == values[1])
+        if is_start_shared:
+            values = values[2:]
+        try:
+            new_cells = array(self._cells.typecode, values)
+        except OverflowError:
+            self._cells = array(INT32_TYPE, self._cells)
+            new_cells = array(INT32_TYPE, values)
+        self._segments.append(len(self))
+        self._shared_starts.append(is_start_shared)
+        self._cells.extend(new_cells)
+
+    def __len__(self) -> int:
+        """
+        :return: The number of cells in the plan.
+        """
+        return len(self._cells) // 2
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        """
+        :return: Iterates over the cells of the plan.
+        """
+        cells = self._cells
+        return zip(cells[0::2], cells[1::2])
 
     def __add__(self, other: "DronePlan") -> "DronePlan":
         """
@@ -31,7 +147,8 @@ class DronePlan:
         :return: The combined plan.
         """
         assert other.id == self.id, "Cannot add plans from different drones"
-        self.add_to_plan(other.coordinates)
+        for round_num in range(other.n_rounds):
+            self.add_to_plan(other.get_flight(round_num))
         return self
 
     def __repr__(self) -> str:
@@ -41,13 +158,27 @@ class DronePlan:
         return f"{self.id}:{self.coordinates}"
 
 
+class PlanVisit(NamedTuple):
+    """
+    A drone being at a cell at a step (index of the cell in its plan) during a round.
+    """
+    step: int
+    drone_id: str
+    round_num: int
+
+
 class DronePlanManager:
 
     def __init__(self):
         """
-        manages all drone plans
+        manages all drone plans and indexes them by cell and by step as rounds are added.
         """
         self.drone_id_to_plan = {}
+        self._cell_to_visits: Dict[Tuple[int, int], List[PlanVisit]] = {}
+        self._step_to_positions: List[Dict[str, Tuple[int, int]]] = []
+        self._shared_cells: Set[Tuple[int, int]] = set()
+        self._collisions: Set[Tuple[int, Tuple[int, int]]] = set()
+        self._n_indexed_cells: Dict[str, int] = {}
 
     def add_plans(self, plans: List[DronePlan]) -> None:
         """
@@ -60,6 +191,7 @@ class DronePlanManager:
                 self.drone_id_to_plan[plan.id] = plan
             else:
                 self.drone_id_to_plan[plan.id] += plan
+            self._index_plan(self.drone_id_to_plan[plan.id])
 
     def get_plans(self) -> List[DronePlan]:
         """
@@ -67,3 +199,85 @@ class DronePlanManager:
         :return: A list of all drone plans
         """
         return list(self.drone_id_to_plan.values())
+
+    def get_visits(self, cell: Union[str, Tuple[int, int]]) -> List[PlanVisit]:
+        """
+        Gets every time a drone is scheduled to be at the cell.
+        :param cell: The cell (e.g. K10 or (10, 11)).
+        :return: The visits ordered by step.
+        """
+        return list(self._cell_to_visits.get(self._to_cell(cell), []))
+
+    def get_next_visit(self, cell: Union[str, Tuple[int, int]], from_step: int = 0) -> Optional[PlanVisit]:
+        """
+        Gets the first visit of the cell at or after the given step.
+        :param cell: The cell (e.g. K10 or (10, 11)).
+        :param from_step: The step to start looking from.
+        :return: The visit or None if no drone is scheduled to visit the cell.
+        """
+        visits = self._cell_to_visits.get(self._to_cell(cell), [])
+        i = bisect_left(visits, (from_step,))
+        return visits[i] if i < len(visits) else None
+
+    def get_positions(self, step: int) -> Dict[str, Tuple[int, int]]:
+        """
+        Gets where each drone is at the given step.
+        :param step: The step.
+        :return: Maps drone id to its cell (drones whose plan ended before the step are omitted).
+        """
+        return dict(self._step_to_positions[step]) if 0 <= step < len(self._step_to_positions) else {}
+
+    def get_scheduled_cells(self, from_step: int, n_steps: int) -> Set[Tuple[int, int]]:
+        """
+        Gets the cells any drone is scheduled to be at in the next steps.
+        :param from_step: The current step.
+        :param n_steps: The number of steps to look ahead.
+        :return: The scheduled cells.
+        """
+        positions = self._step_to_positions[max(from_step, 0): from_step + n_steps]
+        return {cell for step_positions in positions for cell in step_positions.values()}
+
+    def get_overlaps(self, same_step: bool = False) -> Dict[Tuple[int, int], List[PlanVisit]]:
+        """
+        Gets cells visited by more than one drone.
+        :param same_step: If True, only includes visits where drones are at the cell at the same step.
+        :return: Maps each overlapping cell to its visits.
+        """
+        if not same_step:
+            return {cell: list(self._cell_to_visits[cell]) for cell in self._shared_cells}
+        overlaps = {}
+        for step, cell in self._collisions:
+            overlaps.setdefault(cell, []).extend(v for v in self._cell_to_visits[cell] if v.step == step)
+        return overlaps
+
+    def _index_plan(self, plan: DronePlan) -> None:
+        """
+        Adds the cells of the plan that have not been indexed yet to the cell and step indices.
+        :param plan: The merged plan of a drone.
+        :return: None
+        """
+        n_indexed = self._n_indexed_cells.get(plan.id, 0)
+        for round_num in range(plan.n_rounds):
+            round_start, round_end = plan.get_round_bounds(round_num)
+            for step in range(max(n_indexed, round_start), round_end):
+                cell = plan.get_cell(step)
+                visits = self._cell_to_visits.setdefault(cell, [])
+                if any(v.drone_id != plan.id for v in visits):
+                    self._shared_cells.add(cell)
+                insort(visits, PlanVisit(step, plan.id, round_num))
+                if step == len(self._step_to_positions):
+                    self._step_to_positions.append({})
+                positions = self._step_to_positions[step]
+                if cell in positions.values():
+                    self._collisions.add((step, cell))
+                positions[plan.id] = cell
+        self._n_indexed_cells[plan.id] = len(plan)
+
+    @staticmethod
+    def _to_cell(cell: Union[str, Tuple[int, int]]) -> Tuple[int, int]:
+        """
+        Converts alphabetical cells (e.g. K10) to their numeric coordinate.
+        :param cell: The cell.
+        :return: The numeric coordinate of the cell.
+        """
+        return to_numeric([cell])[0] if isinstance(cell, str) else tuple(cell)
@@ -1,6 +1,7 @@
 import string
+from copy import copy
 from dataclasses import dataclass
-from typing import List, Tuple, Union, Dict
+from typing import List, Set, Tuple, Union, Dict
 
 from core.drone_constants import COMMA
 from core.drone_struct import DroneStruct
@@ -21,6 +22,7 @@ class DroneVariables:
     :param cells_in_single_battery: The number of cells that can be searched in a single battery life.
     :param search_priorities: Human made list of terrains to prioritize.
     :param plan_adaptation: Updated information for adapting the plan
+    :param battery_changing_stations: The cells of the battery changing stations.
     """
     drones: List[DroneStruct]
     terrains: List[TerrainStruct]
@@ -34,6 +36,7 @@ class DroneVariables:
     weather_status: str
     use_alphabetical: bool = True
     plan_adaptation: str = None
+    battery_changing_stations: Union[List[CoordinateType], str] = None
 
     def __post_init__(self):
         """
@@ -70,12 +73,40 @@ class DroneVariables:
             return f"{y}{x}"
         return f"({x}, {y})"
 
+    def to_numeric_coordinate(self, cell: str) -> CoordinateType:
+        """
+        Translates a cell in the set type (e.g. alphabetical or numeric) back to its numeric coordinate.
+        :param cell: The translated cell (e.g. K10 or (10, 11)).
+        :return: The numeric coordinate.
+        """
+        cell = cell.strip()
+        if self.use_alphabetical:
+            return int(cell[1:]), string.ascii_uppercase.index(cell[0]) + 1
+        x, y = cell.strip("()").split(COMMA)
+        return int(x), int(y)
+
     def add_current_location_to_drones(self, coordinates: Dict) -> None:
         """
         Updates the drone information to contain their current location.
+        Drones are replaced with updated copies so drone dictionaries shared with other configurations are not modified.
         :param coordinates: Maps drone id to the coordinate it is currently at
         :return: None
         """
-        for drone in self.drones:
-            if drone["id"] in coordinates:
-                drone["current_location"] = self.translate_coordinate(coordinates[drone["id"]])
+        self.drones = [{**drone, "current_location": self.translate_coordinate(coordinates[drone["id"]])}
+                       if drone["id"] in coordinates else drone for drone in self.drones]
+
+    def with_adaptation(self, plan_adaptation: str, current_location_of_drones: Dict,
+                        drone_ids: Set[str] = None) -> "DroneVariables":
+        """
+        Creates a configuration for adapting the plan that shares the terrains and settings of this one.
+        This configuration is not modified.
+        :param plan_adaptation: Contains the updated information for adapting the plan.
+        :param current_location_of_drones: Maps the id of the drone to its current cell location.
+        :param drone_ids: If provided, only these drones are included in the adapted configuration.
+        :return: The adapted configuration.
+        """
+        adapted_configuration = copy(self)
+        adapted_configuration.plan_adaptation = plan_adaptation
+        adapted_configuration.drones = [d for d in self.drones if drone_ids is None or d["id"] in drone_ids]
+        adapted_configuration.add_current_location_to_drones(current_location_of_drones)
+        return adapted_configuration
@@ -0,0 +1,150 @@
+from typing import Dict, List, NamedTuple, Set
+
+import numpy as np
+
+from core.drone_constants import STARTING_FLIGHT_PLAN_NUM
+from core.drone_plan import DronePlan
+from core.drone_variables import CoordinateType, DroneVariables
+from core.plan_validator import N_TRANSIT_CELLS
+
+SECONDS_IN_MINUTE = 60
+
+
+class SimulationState(NamedTuple):
+    """
+    The state of every drone at one or more times (leading dimension of each array is the time if several were requested).
+    """
+    positions: np.ndarray  # (..., n_drones, 2) numeric coordinate of the cell each drone is at or last reached
+    battery: np.ndarray  # (..., n_drones) remaining battery between 0 and 1
+    rounds: np.ndarray  # (..., n_drones) the round (flight) each drone is flying
+    steps: np.ndarray  # (..., n_drones) the index of the cell in each drone's plan
+
+
+class FlightSimulator:
+    """
+    Simulates the drones flying their plans. The timeline of every drone is computed once with array operations so the
+    state of all drones at any time (in seconds since launch) is a single vectorized lookup.
+    """
+
+    def __init__(self, plans: List[DronePlan], variables: DroneVariables, move_seconds: float = None,
+                 dwell_seconds: float = 0, recharge_seconds: float = 0):
+        """
+        Builds the timeline of every drone.
+        :param plans: The plan of each drone.
+        :param variables: The configuration of the mission (battery_time drives the battery drain).
+        :param move_seconds: The seconds to fly to an adjacent cell (defaults to a full flight lasting a single battery).
+        :param dwell_seconds: The seconds spent searching each cell.
+        :param recharge_seconds: The seconds spent recharging at the station at the end of each flight.
+        :raises ValueError: If a duration is negative or the dwell leaves no time to move between cells.
+        """
+        self.drone_ids = [plan.id for plan in plans]
+        self.battery_seconds = variables.battery_time * SECONDS_IN_MINUTE
+        if dwell_seconds < 0 or recharge_seconds < 0 or (move_seconds is not None and move_seconds < 0):
+            raise ValueError(f"Durations must not be negative: move_seconds={move_seconds}, dwell_seconds={dwell_seconds}, "
+                             f"recharge_seconds={recharge_seconds}.")
+        if move_seconds is None:
+            cell_seconds = self.battery_seconds / (variables.cells_in_single_battery + N_TRANSIT_CELLS)
+            if dwell_seconds >= cell_seconds:
+                raise ValueError(f"dwell_seconds ({dwell_seconds}) must be less than the {cell_seconds} seconds of a cell "
+                                 f"when move_seconds is not given.")
+            move_seconds = cell_seconds - dwell_seconds
+        self.move_seconds = move_seconds
+        self.dwell_seconds = dwell_seconds
+        self.recharge_seconds = recharge_seconds
+
+        n_steps = max([len(plan) for plan in plans] + [1])  # at least one (empty) step so lookups stay in bounds
+        self.cells = np.zeros((len(plans), n_steps, 2), dtype=np.int64)
+        self.round_of_step = np.zeros((len(plans), n_steps), dtype=np.int64)
+        self.round_start_step = np.zeros((len(plans), n_steps), dtype=np.int64)
+        is_round_end = np.zeros((len(plans), n_steps), dtype=bool)
+        is_valid = np.zeros((len(plans), n_steps), dtype=bool)
+        for d, plan in enumerate(plans):
+            if len(plan) == 0:
+                continue
+            self.cells[d, :len(plan)] = plan.coordinates
+            is_valid[d, :len(plan)] = True
+            starts = np.array([plan.get_round_bounds(r)[0] for r in range(plan.n_rounds)] + [len(plan)], dtype=np.int64)
+            round_lengths = np.diff(starts)
+            self.round_of_step[d, :len(plan)] = np.repeat(np.arange(plan.n_rounds), round_lengths)
+            self.round_start_step[d, :len(plan)] = np.repeat(np.maximum(starts[:-1] - 1, 0), round_lengths)
+            is_round_end[d, starts[1:][round_lengths > 0] - 1] = True
+
+        distances = np.zeros((len(plans), n_steps), dtype=np.int64)
+        distances[:, 1:] = np.abs(np.diff(self.cells, axis=1)).sum(axis=2)
+        stay_seconds = dwell_seconds + recharge_seconds * is_round_end
+        self.departures = np.cumsum(distances * move_seconds + stay_seconds, axis=1)
+        self.arrivals = np.where(is_valid, self.departures - stay_seconds, np.inf)
+        self.departures = np.where(is_valid, self.departures, np.inf)
+        self.is_round_end = is_round_end
+        self.is_valid = is_valid
+        self.has_plan = is_valid.any(axis=1)
+
+    @property
+    def duration(self) -> float:
+        """
+        :return: The seconds until the last drone finishes its plan.
+        """
+        finished = np.where(np.isfinite(self.departures), self.departures, 0)
+        return float(finished.max()) if finished.size else 0.0
+
+    def get_state(self, times) -> SimulationState:
+        """
+        Gets the state of all drones at the given time(s).
+        :param times: Seconds since launch, either a single time or an array of times.
+        :return: The state of the drones.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        t = times[..., None]
+        steps = np.maximum((self.arrivals <= t[..., None]).sum(axis=-1) - 1, 0)
+        drones = np.arange(len(self.drone_ids))
+        positions = self.cells[drones, steps]
+        rounds = self.round_of_step[drones, steps]
+        arrivals = self.arrivals[drones, steps]
+        departures = self.departures[drones, steps]
+        round_departures = self.departures[drones, self.round_start_step[drones, steps]]
+
+        is_recharging = self.is_round_end[drones, steps] & (t >= arrivals)
+        flown_seconds = np.clip(np.where(is_recharging, arrivals, t) - round_departures, 0, None)
+        battery = np.clip(1 - flown_seconds / self.battery_seconds, 0, 1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            progress = np.where(departures > arrivals, (t - arrivals) / (departures - arrivals), 1)
+        battery = np.where(is_recharging, battery + (1 - battery) * np.clip(progress, 0, 1), battery)
+        return SimulationState(positions=positions, battery=battery, rounds=rounds, steps=steps)
+
+    def get_current_locations(self, time: float) -> Dict[str, CoordinateType]:
+        """
+        Gets the location of each drone in the form expected by PlanGenerator.generate_adaption.
+        :param time: Seconds since launch.
+        :return: Maps the id of each drone to its current cell (drones with an empty plan are omitted).
+        """
+        positions = self.get_state(time).positions.tolist()
+        return {drone_id: tuple(position) for drone_id, position, has_plan in zip(self.drone_ids, positions, self.has_plan)
+                if has_plan}
+
+    def get_remaining_battery(self, time: float) -> Dict[str, float]:
+        """
+        Gets the battery left in each drone.
+        :param time: Seconds since launch.
+        :return: Maps the id of each drone to the share of its battery left (0-1).
+        """
+        battery = self.get_state(time).battery.tolist()
+        return dict(zip(self.drone_ids, battery))
+
+    def get_covered_cells(self, time: float) -> Set[CoordinateType]:
+        """
+        Gets the cells the drones have reached so far.
+        :param time: Seconds since launch.
+        :return: The numeric coordinates of the cells.
+        """
+        steps = self.get_state(time).steps
+        covered = (np.arange(self.cells.shape[1]) <= steps[:, None]) & self.is_valid
+        return set(map(tuple, self.cells[covered].tolist()))
+
+    def get_current_round(self, time: float) -> int:
+        """
+        Gets the round of the mission at the given time, which is the earliest round any drone is still flying.
+        :param time: Seconds since launch.
+        :return: The round in the form expected by PlanGenerator.generate_adaption.
+        """
+        rounds = self.get_state(time).rounds[self.has_plan]
+        return STARTING_FLIGHT_PLAN_NUM + (int(rounds.min()) if rounds.size else 0)
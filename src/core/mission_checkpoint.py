@@ -0,0 +1,200 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from core.drone_constants import N_DRONE_FLIGHTS, STARTING_FLIGHT_PLAN_NUM
+from core.drone_plan import DronePlan, DronePlanManager
+from core.drone_variables import DroneVariables
+
+"""
+Append-only checkpoints of a mission. Each line holds one completed round:
+    <crc32 of the json> <json containing the configuration hash, round, new messages and parsed plans of the round>
+A mission is resumed by replaying the rounds of the last run of its configuration, unless that run was completed (marked by
+a line holding the configuration hash and "completed"). Torn or corrupted lines are ignored.
+"""
+
+_CLOSE = object()
+INITIAL_GENERATION = "initial"
+ADAPTATION_GENERATION = "adaptation"
+
+
+@dataclass
+class CheckpointState:
+    """
+    :param n_rounds: The number of rounds that were completed.
+    :param conversation_history: The messages exchanged with the model during the completed rounds.
+    :param plan_manager: Contains the merged plans of the completed rounds.
+    """
+    n_rounds: int = 0
+    conversation_history: List[Dict] = field(default_factory=list)
+    plan_manager: DronePlanManager = field(default_factory=DronePlanManager)
+
+
+class MissionCheckpoint:
+    """
+    Writes round checkpoints on a background thread, fsyncing in batches so the generation is never blocked on disk.
+    """
+
+    def __init__(self, path: str, fsync_every: int = 5, fsync_interval: float = 1.0):
+        """
+        Creates the checkpoint file writer.
+        :param path: The path of the checkpoint file.
+        :param fsync_every: The number of records written before forcing them to disk.
+        :param fsync_interval: The maximum number of seconds written records wait before being forced to disk.
+        """
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._queue = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def hash_configuration(configuration: DroneVariables, n_rounds: int = N_DRONE_FLIGHTS,
+                           kind: str = INITIAL_GENERATION, context: Any = None) -> str:
+        """
+        Hashes the configuration and the generation so checkpoints are only resumed for the same generation of the mission.
+        :param configuration: The configuration used to generate the plan.
+        :param n_rounds: The number of rounds generated.
+        :param kind: The kind of generation (INITIAL_GENERATION or ADAPTATION_GENERATION).
+        :param context: Anything else the prompts depend on (e.g. the conversation an adaptation continues).
+        :return: The hash of the configuration.
+        """
+        content = json.dumps({"configuration": vars(configuration), "n_rounds": n_rounds, "kind": kind, "context": context},
+                             sort_keys=True, default=str)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def append(self, config_hash: str, round_num: int, messages: List[Dict], plans: List[DronePlan]) -> None:
+        """
+        Queues the checkpoint of a completed round.
+        :param config_hash: The hash of the configuration of the mission.
+        :param round_num: The completed round.
+        :param messages: The messages added to the conversation during the round.
+        :param plans: The plans parsed from the response of the round.
+        :return: None
+        """
+        record = {"config": config_hash, "round": round_num, "messages": messages,
+                  "plans": [{"id": plan.id, "cells": [v for cell in plan for v in cell]} for plan in plans]}
+        self._ensure_writer()
+        self._queue.put(json.dumps(record, separators=(",", ":")))
+
+    def complete(self, config_hash: str) -> None:
+        """
+        Marks the last run of the configuration as completed so it is not resumed.
+        :param config_hash: The hash of the configuration of the mission.
+        :return: None
+        """
+        self._ensure_writer()
+        self._queue.put(json.dumps({"config": config_hash, "completed": True}, separators=(",", ":")))
+
+    def load(self, config_hash: str) -> Optional[CheckpointState]:
+        """
+        Replays the last run of the configuration.
+        :param config_hash: The hash of the configuration of the mission.
+        :return: The state after the last completed round or None if there is no checkpoint or the last run was completed.
+        """
+        self.flush()
+        if not os.path.exists(self.path):
+            return None
+        state = None
+        with open(self.path) as file:
+            for line in file:
+                record = self._parse_line(line)
+                if record is None or record["config"] != config_hash:
+                    continue
+                if record.get("completed"):
+                    state = None
+                    continue
+                round_num = record["round"]
+                if round_num == STARTING_FLIGHT_PLAN_NUM:
+                    state = CheckpointState()
+                if state is None or round_num != STARTING_FLIGHT_PLAN_NUM + state.n_rounds:
+                    continue
+                state.conversation_history.extend(record["messages"])
+                state.plan_manager.add_plans([DronePlan(p["id"], list(zip(p["cells"][0::2], p["cells"][1::2])))
+                                              for p in record["plans"]])
+                state.n_rounds += 1
+        return state
+
+    def flush(self) -> None:
+        """
+        Blocks until all queued checkpoints are written and synced to disk.
+        :return: None
+        """
+        with self._lock:
+            atexit.unregister(self.flush)
+            writer = self._writer
+            if writer is None:
+                return
+            self._queue.put(_CLOSE)
+            writer.join()
+            self._writer = None
+
+    close = flush
+
+    def _ensure_writer(self) -> None:
+        """
+        Starts the background writer if it is not running.
+        :return: None
+        """
+        with self._lock:
+            if self._writer is None:
+                atexit.register(self.flush)
+                self._writer = threading.Thread(target=self._write_records, daemon=True, name="mission-checkpoint")
+                self._writer.start()
+
+    def _write_records(self) -> None:
+        """
+        Writes queued records until closed, syncing to disk every few records or seconds.
+        :return: None
+        """
+        n_unsynced = 0
+        last_sync = time.monotonic()
+        is_torn = False
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                is_torn = file.read(1) != b"\n"
+        with open(self.path, "a") as file:
+            if is_torn:
+                file.write("\n")
+            while True:
+                try:
+                    record = self._queue.get(timeout=self.fsync_interval)
+                except queue.Empty:
+                    record = None
+                if record is not None and record is not _CLOSE:
+                    file.write(f"{zlib.crc32(record.encode()):08x} {record}\n")
+                    n_unsynced += 1
+                should_sync = n_unsynced >= self.fsync_every or time.monotonic() - last_sync >= self.fsync_interval
+                if n_unsynced and (should_sync or record is _CLOSE):
+                    file.flush()
+                    os.fsync(file.fileno())
+                    n_unsynced = 0
+                    last_sync = time.monotonic()
+                if record is _CLOSE:
+                    return
+
+    @staticmethod
+    def _parse_line(line: str) -> Optional[Dict]:
+        """
+        Parses a checkpoint line, verifying its checksum.
+        :param line: The line in the checkpoint file.
+        :return: The record or None if the line is corrupted.
+        """
+        checksum, _, content = line.rstrip("\n").partition(" ")
+        try:
+            if int(checksum, 16) != zlib.crc32(content.encode()):
+                raise ValueError("Checksum mismatch")
+            return json.loads(content)
+        except ValueError:
+            logging.warning(f"Skipping corrupted checkpoint line in {MissionCheckpoint.__name__}.")
+            return None
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from src.core.drone_constants import STARTING_FLIGHT_PLAN_NUM
+from src.core.drone_plan import DronePlan
+from src.core.plan_generator import GenerationCancelled, PlanGenerator
+from utils.metrics import METRICS
+
+COALESCED_EVENTS = "mission_controller_coalesced_events_total"
+CANCELLED_GENERATIONS = "mission_controller_cancelled_generations_total"
+COMMITTED_PLANS = "mission_controller_committed_plans_total"
+
+
+@dataclass
+class AdaptationEvent:
+    """
+    :param plan_adaptation: Contains the updated information for adapting the plan.
+    :param current_location_of_drones: Maps the id of the drone to its current cell location.
+    :param current_round: The round the drones are currently flying.
+    :param affected_drone_ids: The drones to re-plan (defaults to the drones whose location is given).
+    :param remaining_battery: Maps the id of the drone to the share of its battery left (0-1).
+    """
+    plan_adaptation: str
+    current_location_of_drones: Dict = field(default_factory=dict)
+    current_round: int = STARTING_FLIGHT_PLAN_NUM
+    affected_drone_ids: Optional[Set[str]] = None
+    remaining_battery: Dict = field(default_factory=dict)
+
+
+class MissionController:
+    """
+    Adapts the plan of a mission to a stream of events. Events arriving within the debounce window are coalesced into a
+    single adaptation, a newer event cancels the adaptation in flight (at its next flight boundary) and the latest committed
+    plan can always be read without waiting.
+    """
+
+    def __init__(self, plan_generator: PlanGenerator, debounce_seconds: float = 0.5, max_delay_seconds: float = 2.0,
+                 max_workers: int = 2, **generation_params):
+        """
+        Creates the controller of the mission.
+        :param plan_generator: The generator of the mission, holding the committed plan (e.g. after generate_initial).
+        :param debounce_seconds: The quiet time after an event before adapting.
+        :param max_delay_seconds: The maximum time an event waits for the burst it is part of to end.
+        :param max_workers: The number of generations that may run at once (cancelled ones finish their current flight).
+        :param generation_params: Any additional parameters to each adaptation (e.g. mock_response).
+        """
+        self.plan_generator = plan_generator
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.generation_params = generation_params
+        self.version = 0
+        self.latest_plans: List[DronePlan] = plan_generator.plan_manager.get_plans() if plan_generator.plan_manager else []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mission-controller")
+        self._queue: Optional[asyncio.Queue] = None
+        self._committed: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending: List[AdaptationEvent] = []
+        self._generation: Optional[asyncio.Future] = None
+        self._cancel_event: Optional[threading.Event] = None
+
+    async def start(self) -> None:
+        """
+        Starts processing events on the running event loop.
+        :return: None
+        """
+        self._queue = asyncio.Queue()
+        self._committed = asyncio.Condition()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stops processing events and cancels the adaptation in flight.
+        :return: None
+        """
+        self._cancel_generation()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, event: AdaptationEvent) -> None:
+        """
+        Queues an event without waiting for it to be processed.
+        :param event: The event.
+        :return: None
+        """
+        self._queue.put_nowait(event)
+
+    async def wait_for_version(self, version: int) -> List[DronePlan]:
+        """
+        Waits until a plan at least as new as the given version is committed.
+        :param version: The version to wait for.
+        :return: The committed plans.
+        """
+        async with self._committed:
+            await self._committed.wait_for(lambda: self.version >= version)
+            return self.latest_plans
+
+    @staticmethod
+    def coalesce(events: List[AdaptationEvent]) -> AdaptationEvent:
+        """
+        Combines events into a single event. Later drone locations override earlier ones.
+        :param events: The events in the order they arrived.
+        :return: The combined event.
+        """
+        descriptions = []
+        for event in events:
+            if event.plan_adaptation not in descriptions:
+                descriptions.append(event.plan_adaptation)
+        locations = {}
+        remaining_battery = {}
+        affected_drone_ids = set()
+        for event in events:
+            locations.update(event.current_location_of_drones)
+            remaining_battery.update(event.remaining_battery)
+            affected_drone_ids.update(event.affected_drone_ids if event.affected_drone_ids is not None
+                                      else event.current_location_of_drones.keys())
+        return AdaptationEvent(plan_adaptation=" ".join(descriptions), current_location_of_drones=locations,
+                               current_round=max(e.current_round for e in events), affected_drone_ids=affected_drone_ids,
+                               remaining_battery=remaining_battery)
+
+    async def _run(self) -> None:
+        """
+        Collects bursts of events and starts an adaptation for everything not yet committed, superseding the one in flight.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            burst = await self._collect_burst(loop)
+            METRICS.increment(COALESCED_EVENTS, value=len(burst))
+            self._pending.extend(burst)
+            self._cancel_generation()
+            events = list(self._pending)
+            self._cancel_event = threading.Event()
+            self._generation = loop.run_in_executor(self._executor, self._adapt, self.coalesce(events), self._cancel_event)
+            self._generation.add_done_callback(lambda future, n_events=len(events): loop.create_task(
+                self._commit(future, n_events)))
+
+    async def _collect_burst(self, loop: asyncio.AbstractEventLoop) -> List[AdaptationEvent]:
+        """
+        Waits for an event, then for the burst it belongs to to end.
+        :param loop: The running event loop.
+        :return: The events of the burst.
+        """
+        burst = [await self._queue.get()]
+        deadline = loop.time() + self.max_delay_seconds
+        while True:
+            timeout = min(self.debounce_seconds, deadline - loop.time())
+            if timeout <= 0:
+                return burst
+            try:
+                burst.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                return burst
+
+    def _adapt(self, event: AdaptationEvent, cancel_event: threading.Event) -> PlanGenerator:
+        """
+        Generates the adaptation on its own generator so superseded generations never touch the committed plan.
+        :param event: The (coalesced) event.
+        :param cancel_event: Set when the generation is superseded.
+        :return: The generator holding the adapted plan.
+        """
+        generator = self.plan_generator.fork()
+        generator.generate_adaption(event.plan_adaptation, event.current_location_of_drones,
+                                    current_round=event.current_round, affected_drone_ids=event.affected_drone_ids,
+                                    remaining_battery=event.remaining_battery, cancel_event=cancel_event,
+                                    **self.generation_params)
+        return generator
+
+    async def _commit(self, generation: asyncio.Future, n_events: int) -> None:
+        """
+        Commits the adapted plan unless the generation was superseded or failed.
+        :param generation: The finished generation.
+        :param n_events: The number of pending events the generation covered.
+        :return: None
+        """
+        if generation.cancelled():
+            return
+        try:
+            generator = generation.result()
+        except GenerationCancelled:
+            return
+        except Exception:
+            logging.exception("Failed to adapt the plan; the events will be retried with the next event.")
+            return
+        if generation is not self._generation:
+            return
+        self.plan_generator.adopt(generator)
+        self._pending = self._pending[n_events:]
+        self._generation = None
+        async with self._committed:
+            self.latest_plans = generator.plan_manager.get_plans()
+            self.version += 1
+            METRICS.increment(COMMITTED_PLANS)
+            self._committed.notify_all()
+
+    def _cancel_generation(self) -> None:
+        """
+        Signals the generation in flight to stop at its next flight boundary.
+        :return: None
+        """
+        if self._generation is not None and not self._generation.done():
+            self._cancel_event.set()
+            METRICS.increment(CANCELLED_GENERATIONS)
+        self._generation = None
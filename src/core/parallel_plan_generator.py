@@ -0,0 +1,104 @@
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from typing import Dict, List, Tuple
+
+from src.core.drone_plan import DronePlan
+from src.core.drone_struct import DroneStruct
+from src.core.drone_variables import CoordinateType, DroneVariables
+from src.core.plan_generator import PlanGenerator
+from src.core.plan_reconciler import PlanReconciler
+from src.core.plan_validator import STATION_TERRAINS
+from src.utils.list_util import ListUtil
+
+Region = Tuple[CoordinateType, CoordinateType]
+MAX_SEARCH_PRIORITIES = 5
+
+
+class ParallelPlanGenerator:
+    """
+    Generates the plan of each group of drones with its own, smaller prompt covering an assigned region of the search area.
+    The groups are completed concurrently and their plans are reconciled locally.
+    """
+
+    def __init__(self, drone_variables: DroneVariables, group_size: int = 1, max_workers: int = None, **generator_params):
+        """
+        Creates the generator.
+        :param drone_variables: The variables of the whole mission.
+        :param group_size: The number of drones planned in each prompt.
+        :param max_workers: The maximum number of concurrent generations (defaults to one per group).
+        :param generator_params: Parameters passed to the plan generator of each group (e.g. retry_policy).
+        """
+        self.variables = drone_variables
+        self.group_size = group_size
+        self.max_workers = max_workers
+        self.generator_params = generator_params
+
+    def generate_initial(self, **params) -> List[DronePlan]:
+        """
+        Generates the flight plans of all groups concurrently.
+        :param params: Any additional parameters to the generation (e.g. mock_response).
+        :return: A plan for each drone.
+        """
+        groups = ListUtil.batch(self.variables.drones, self.group_size)
+        regions = self.split_regions(self.variables, len(groups))
+        configurations = [self.create_group_configuration(self.variables, group, region)
+                          for group, region in zip(groups, regions)]
+        with ThreadPoolExecutor(max_workers=self.max_workers or len(groups), thread_name_prefix="drone-group") as executor:
+            futures = [executor.submit(PlanGenerator(configuration, **self.get_group_params(self.generator_params, i))
+                                       .generate_initial, **params) for i, configuration in enumerate(configurations)]
+            plans = [plan for future in futures for plan in future.result()]
+        return PlanReconciler.reconcile(plans)
+
+    @staticmethod
+    def get_group_params(generator_params: Dict, group_num: int) -> Dict:
+        """
+        Gives each concurrently planned group its own checkpoint file so their writers do not share a file.
+        :param generator_params: The parameters of the plan generators.
+        :param group_num: The index of the group.
+        :return: The parameters of the plan generator of the group.
+        """
+        checkpoint_path = generator_params.get("checkpoint_path")
+        if not checkpoint_path:
+            return generator_params
+        return {**generator_params, "checkpoint_path": f"{checkpoint_path}.{group_num}"}
+
+    @staticmethod
+    def split_regions(variables: DroneVariables, n_regions: int) -> List[Region]:
+        """
+        Splits the search area into vertical strips of (nearly) equal width.
+        :param variables: The variables of the mission.
+        :param n_regions: The number of regions.
+        :return: The top-left and bottom-right cell of each region.
+        """
+        n_regions = max(1, min(n_regions, variables.n_width_blocks))
+        regions = []
+        for i in range(n_regions):
+            first_column = i * variables.n_width_blocks // n_regions + 1
+            last_column = (i + 1) * variables.n_width_blocks // n_regions
+            regions.append(((first_column, 1), (last_column, variables.n_height_blocks)))
+        return regions
+
+    @staticmethod
+    def create_group_configuration(variables: DroneVariables, drones: List[DroneStruct], region: Region) -> DroneVariables:
+        """
+        Creates the configuration of a group containing only its drones and the terrain of its region (and all stations).
+        :param variables: The variables of the whole mission.
+        :param drones: The drones in the group.
+        :param region: The region assigned to the group.
+        :return: The configuration of the group.
+        """
+        (min_x, min_y), (max_x, max_y) = region
+
+        def is_in_region(block: str) -> bool:
+            x, y = variables.to_numeric_coordinate(block)
+            return min_x <= x <= max_x and min_y <= y <= max_y
+
+        configuration = copy(variables)
+        configuration.drones = drones
+        terrains = [{**t, "blocks": [b for b in t["blocks"] if t["type"] in STATION_TERRAINS or is_in_region(b)]}
+                    for t in variables.terrains]
+        configuration.terrains = [t for t in terrains if t["blocks"]]
+        region_priority = f"Only search cells from {variables.translate_coordinate(region[0])} " \
+                          f"to {variables.translate_coordinate(region[1])}; other drones search the rest of the area."
+        configuration.search_priorities = [region_priority] + variables.search_priorities[:MAX_SEARCH_PRIORITIES - 1]
+        return configuration
@@ -0,0 +1,288 @@
+import csv
+import json
+import os
+import zipfile
+from abc import ABC, abstractmethod
+from typing import IO, Iterable, Iterator, List, NamedTuple, Tuple
+
+import numpy as np
+
+from core.drone_constants import END_KEY, SEARCH_KEY, START_KEY
+from core.drone_plan import DronePlan
+
+MAX_ID_LENGTH = 32
+PLAN_DTYPE = np.dtype([("mission", f"U{MAX_ID_LENGTH}"), ("drone", f"U{MAX_ID_LENGTH}"), ("round", np.int16),
+                       ("step", np.int32), ("x", np.int32), ("y", np.int32), ("stage", "U1")])
+DEFAULT_CHUNK_ROWS = 1 << 16
+NPZ_CHUNK_PREFIX = "plans_"
+CSV_EXTENSION, NPZ_EXTENSION, GEOJSON_EXTENSION = ".csv", ".npz", ".geojson"
+GEOJSON_HEADER = '{"type": "FeatureCollection", "features": ['
+GEOJSON_FOOTER = "]}\n"
+
+Mission = Tuple[str, List[DronePlan]]
+
+
+class GridTransform(NamedTuple):
+    """
+    Affine transform from grid cells to geographic coordinates, in the order of a GDAL geotransform. The geographic
+    coordinate of a cell is that of its center.
+    :param origin_x: The x (longitude) of the outer corner of cell (1, 1).
+    :param cell_width: The x step of each column.
+    :param row_rotation: The x step of each row (0 for north-up grids).
+    :param origin_y: The y (latitude) of the outer corner of cell (1, 1).
+    :param column_rotation: The y step of each column (0 for north-up grids).
+    :param cell_height: The y step of each row (negative when row 1 is the northern edge).
+    """
+    origin_x: float = 0.0
+    cell_width: float = 1.0
+    row_rotation: float = 0.0
+    origin_y: float = 0.0
+    column_rotation: float = 0.0
+    cell_height: float = 1.0
+
+    @staticmethod
+    def from_bounds(west: float, south: float, east: float, north: float, n_width_blocks: int,
+                    n_height_blocks: int) -> "GridTransform":
+        """
+        Creates the transform of a north-up grid covering the bounds, with row 1 along the northern edge.
+        :param west: The western bound (longitude).
+        :param south: The southern bound (latitude).
+        :param east: The eastern bound (longitude).
+        :param north: The northern bound (latitude).
+        :param n_width_blocks: The width of the search area in blocks.
+        :param n_height_blocks: The height of the search area in blocks.
+        :return: The transform.
+        """
+        return GridTransform(west, (east - west) / n_width_blocks, 0.0, north, 0.0, -(north - south) / n_height_blocks)
+
+    def to_geo(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        :param x: The x of each cell.
+        :param y: The y of each cell.
+        :return: Array of shape (n_cells, 2) with the geographic coordinate of the center of each cell.
+        """
+        column, row = np.asarray(x) - 0.5, np.asarray(y) - 0.5
+        return np.stack([self.origin_x + column * self.cell_width + row * self.row_rotation,
+                         self.origin_y + column * self.column_rotation + row * self.cell_height], axis=-1)
+
+
+class PlanWriter(ABC):
+    """
+    Streams the plans of many missions to a file, one mission at a time, so memory does not grow with the number of
+    missions. Each cell of a plan is a row of PLAN_DTYPE: the step is the index of the cell in the plan of its drone and
+    the stage is a (start), b (search) or c (end) of its flight. A flight that starts where the previous flight ended
+    shares that cell, which the plan stores once, as the c row of the previous round; any other flight starts with an a row.
+    """
+
+    def __init__(self, path: str):
+        """
+        Creates the file.
+        :param path: The path to write to.
+        """
+        self.path = path
+        self.n_missions = 0
+        self.n_rows = 0
+
+    @staticmethod
+    def for_path(path: str, transform: GridTransform = None, **params) -> "PlanWriter":
+        """
+        Creates the writer of the format matching the extension of the path.
+        :param path: The path to write to (.csv, .npz or .geojson).
+        :param transform: Converts cells to geographic coordinates (GeoJSON only).
+        :param params: Any additional parameters to the writer.
+        :return: The writer.
+        """
+        extension = os.path.splitext(path)[1].lower()
+        if extension == CSV_EXTENSION:
+            return CsvPlanWriter(path, **params)
+        if extension == NPZ_EXTENSION:
+            return NpzPlanWriter(path, **params)
+        if extension == GEOJSON_EXTENSION:
+            return GeoJsonPlanWriter(path, transform if transform is not None else GridTransform(), **params)
+        raise ValueError(f"Unknown plan export format: {path}")
+
+    @staticmethod
+    def to_array(mission_id: str, plans: Iterable[DronePlan]) -> np.ndarray:
+        """
+        Converts the plans of a mission to rows.
+        :param mission_id: The id of the mission.
+        :param plans: The plan of each drone.
+        :return: Structured array of PLAN_DTYPE.
+        """
+        arrays = []
+        for plan in plans:
+            if len(mission_id) > MAX_ID_LENGTH or len(plan.id) > MAX_ID_LENGTH:
+                raise ValueError(f"Ids are limited to {MAX_ID_LENGTH} characters: {mission_id}, {plan.id}")
+            rows = np.zeros(len(plan), dtype=PLAN_DTYPE)
+            if not len(rows):
+                continue
+            cells = np.array(plan.coordinates, dtype=np.int32)
+            bounds = np.array([plan.get_round_bounds(r) for r in range(plan.n_rounds)], dtype=np.int32)
+            rows["mission"], rows["drone"] = mission_id, plan.id
+            rows["round"] = np.repeat(np.arange(plan.n_rounds), bounds[:, 1] - bounds[:, 0])
+            rows["step"] = np.arange(len(plan))
+            rows["x"], rows["y"] = cells[:, 0], cells[:, 1]
+            has_start = np.array([not plan.is_start_shared(r) for r in range(plan.n_rounds)])
+            rows["stage"] = SEARCH_KEY
+            rows["stage"][bounds[:, 1] - 1] = END_KEY
+            rows["stage"][bounds[has_start, 0]] = START_KEY
+            arrays.append(rows)
+        return np.concatenate(arrays) if arrays else np.zeros(0, dtype=PLAN_DTYPE)
+
+    def write(self, mission_id: str, plans: Iterable[DronePlan]) -> None:
+        """
+        Writes the plans of a mission.
+        :param mission_id: The id of the mission.
+        :param plans: The plan of each drone.
+        :return: None
+        """
+        rows = self.to_array(mission_id, plans)
+        self._write_rows(rows)
+        self.n_missions += 1
+        self.n_rows += len(rows)
+
+    def write_all(self, missions: Iterable[Mission]) -> None:
+        """
+        Writes the plans of each mission, consuming the missions one at a time (e.g. from a generator).
+        :param missions: The id and plans of each mission.
+        :return: None
+        """
+        for mission_id, plans in missions:
+            self.write(mission_id, plans)
+
+    @abstractmethod
+    def close(self) -> None:
+        """
+        Completes the file.
+        :return: None
+        """
+
+    def __enter__(self) -> "PlanWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    @abstractmethod
+    def _write_rows(self, rows: np.ndarray) -> None:
+        """
+        Writes the rows of a mission.
+        :param rows: Structured array of PLAN_DTYPE.
+        :return: None
+        """
+
+
+class CsvPlanWriter(PlanWriter):
+    """
+    Writes one row per cell with a header of the PLAN_DTYPE fields.
+    """
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._file: IO = open(path, "w", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(PLAN_DTYPE.names)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def _write_rows(self, rows: np.ndarray) -> None:
+        self._writer.writerows(rows.tolist())
+
+
+class NpzPlanWriter(PlanWriter):
+    """
+    Writes the rows in chunks of at most chunk_rows, each stored as an array (plans_00000, plans_00001, ...) of an .npz file,
+    so at most one chunk is held in memory. Read the chunks with NpzPlanWriter.read or np.load.
+    """
+
+    def __init__(self, path: str, chunk_rows: int = DEFAULT_CHUNK_ROWS, compress: bool = True):
+        """
+        Creates the file.
+        :param path: The path to write to.
+        :param chunk_rows: The number of rows per array.
+        :param compress: Whether the arrays are deflated (as np.savez_compressed).
+        """
+        super().__init__(path)
+        self.chunk_rows = chunk_rows
+        self._zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED,
+                                    allowZip64=True)
+        self._pending: List[np.ndarray] = []
+        self._n_pending = 0
+        self._n_chunks = 0
+
+    @staticmethod
+    def read(path: str) -> Iterator[np.ndarray]:
+        """
+        Reads the chunks of an exported file one at a time.
+        :param path: The path to the .npz file.
+        :return: Iterates over the structured arrays of PLAN_DTYPE.
+        """
+        with np.load(path) as chunks:
+            for name in sorted(chunks.files, key=lambda n: int(n[len(NPZ_CHUNK_PREFIX):])):
+                yield chunks[name]
+
+    def close(self) -> None:
+        self._flush()
+        self._zip.close()
+
+    def _write_rows(self, rows: np.ndarray) -> None:
+        self._pending.append(rows)
+        self._n_pending += len(rows)
+        if self._n_pending >= self.chunk_rows:
+            self._flush()
+
+    def _flush(self) -> None:
+        """
+        Writes the pending rows as chunks.
+        :return: None
+        """
+        if not self._pending:
+            return
+        rows = np.concatenate(self._pending)
+        self._pending, self._n_pending = [], 0
+        for start in range(0, len(rows), self.chunk_rows):
+            with self._zip.open(f"{NPZ_CHUNK_PREFIX}{self._n_chunks:05d}.npy", "w", force_zip64=True) as file:
+                np.lib.format.write_array(file, rows[start:start + self.chunk_rows], allow_pickle=False)
+            self._n_chunks += 1
+
+
+class GeoJsonPlanWriter(PlanWriter):
+    """
+    Writes a FeatureCollection with a LineString per flight (drone round) through the geographic centers of its cells.
+    Flights without a start (a) row start at the end of the previous flight. A flight of a single cell repeats it.
+    """
+
+    def __init__(self, path: str, transform: GridTransform):
+        """
+        Creates the file.
+        :param path: The path to write to.
+        :param transform: Converts cells to geographic coordinates.
+        """
+        super().__init__(path)
+        self.transform = transform
+        self._file: IO = open(path, "w")
+        self._file.write(GEOJSON_HEADER)
+
+    def close(self) -> None:
+        self._file.write(GEOJSON_FOOTER)
+        self._file.close()
+
+    def _write_rows(self, rows: np.ndarray) -> None:
+        if not len(rows):
+            return
+        positions = self.transform.to_geo(rows["x"], rows["y"]).tolist()
+        flight_starts = np.flatnonzero((rows["drone"][1:] != rows["drone"][:-1]) | (rows["round"][1:] != rows["round"][:-1])) + 1
+        for start, end in zip([0, *flight_starts.tolist()], [*flight_starts.tolist(), len(rows)]):
+            first = rows[start]
+            coordinates = positions[start:end]
+            if first["stage"] != START_KEY and start > 0 and rows["drone"][start - 1] == first["drone"]:
+                coordinates = [positions[start - 1]] + coordinates
+            if len(coordinates) == 1:
+                coordinates = coordinates * 2
+            feature = {"type": "Feature", "geometry": {"type": "LineString", "coordinates": coordinates},
+                       "properties": {"mission": str(first["mission"]), "drone": str(first["drone"]),
+                                      "round": int(first["round"]), "first_step": int(first["step"]),
+                                      "last_step": int(rows[end - 1]["step"])}}
+            separator = "," if self.n_rows or start else ""
+            self._file.write(f"{separator}\n{json.dumps(feature)}")
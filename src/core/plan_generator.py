@@ -1,36 +1,110 @@
-from copy import deepcopy
-from typing import List, Dict
+from typing import Iterable, List, Dict, Optional, Set, Tuple
 
 from src.core.drone_constants import N_DRONE_FLIGHTS, STARTING_FLIGHT_PLAN_NUM
 from src.core.drone_plan import DronePlanManager, DronePlan
 from src.core.drone_variables import DroneVariables
+from src.core.mission_checkpoint import ADAPTATION_GENERATION, INITIAL_GENERATION, MissionCheckpoint
+from src.core.plan_validator import PlanValidator
 from src.llms.llm_manager import LLMManager
-from src.prompts.prompt_factory import PromptFactory
+from src.llms.model_cascade import ModelCascade
+from src.llms.rate_limiter import RequestPriority
+from src.llms.retry_policy import DEFAULT_RETRY_POLICY, RetryPolicy
+from src.prompts.prompt_factory import DEFAULT_COMPLETION_RESERVE, AdaptationContext, PromptFactory
+from prompts.prompt_builder import PromptBudgetExceeded
+from llms.llm_models import OpenAIModel
+from llms.token_calculator import TokenCalculator
+from prompts.structured_output import ResponseMode
+from utils.metrics import METRICS, PROMPT_DEGRADATIONS
+from utils.profiler import Profiler
 import logging
+import threading
+from contextlib import nullcontext
+
+
+class GenerationCancelled(Exception):
+    """
+    Raised when a generation is cancelled before all of its flights were planned.
+    """
 
 
 class PlanGenerator:
 
-    def __init__(self, drone_variables: DroneVariables, ):
+    def __init__(self, drone_variables: DroneVariables, retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+                 checkpoint_path: str = None, model_cascade: ModelCascade = None,
+                 response_mode: ResponseMode = ResponseMode.XML, profiler: Profiler = None,
+                 delta_adaptations: bool = False, completion_reserve: int = DEFAULT_COMPLETION_RESERVE):
         """
         Uses the model to generate a flight plan for the scenario provided in the variables.
         :param drone_variables: The variables to include in the prompt.
+        :param retry_policy: Controls the timeouts, retries and hedging of each completion.
+        :param checkpoint_path: If provided, each round is checkpointed to this file and generation resumes from the last
+                                completed round of the same configuration.
+        :param model_cascade: If provided, follow-up flights are first completed by cheaper models and only escalated to
+                              stronger ones when the plans fail validation.
+        :param response_mode: Whether the model responds with xml tags or with json arguments to a function call.
+        :param profiler: Samples the stacks (and allocations) while generating, defaults to the profiler configured by
+                         DRONE_PROFILE_DIR (none if unset).
+        :param delta_adaptations: Whether adaptations send a compact mission description, a summary of the current plan and
+                                  only what changed, instead of describing the whole mission again (off by default: it
+                                  shrinks the first request but not the tokens of the whole adaptation).
+        :param completion_reserve: The number of tokens of the model's window kept for each completion. Sections of the
+                                   prompt are degraded until it fits the rest of the window.
         """
+        self.retry_policy = retry_policy
+        self.checkpoint = MissionCheckpoint(checkpoint_path) if checkpoint_path else None
+        self.model_cascade = model_cascade
+        self.response_mode = response_mode
+        self.profiler = profiler if profiler is not None else Profiler.get_default()
+        self.delta_adaptations = delta_adaptations
+        self.completion_reserve = completion_reserve
         self.initial_configuration = drone_variables
         self.current_configuration = drone_variables
         self.conversation_history = []
+        self.plan_manager: DronePlanManager = None
+        self.adaptations: List[str] = []
 
-    def generate_adaption(self, plan_adaptation: str, current_location_of_drones: Dict, **params) -> List[DronePlan]:
+    def generate_adaption(self, plan_adaptation: str, current_location_of_drones: Dict,
+                          current_round: int = STARTING_FLIGHT_PLAN_NUM, affected_drone_ids: Iterable[str] = None,
+                          remaining_battery: Dict[str, float] = None, covered_cells: Iterable[Tuple[int, int]] = None,
+                          **params) -> List[DronePlan]:
         """
         Uses the model to generate an adapted flight plan with the new information.
+        Only the remaining rounds of the affected drones are re-planned, the rest of the current plan is kept.
+        If delta adaptations are enabled and there is a current plan, the conversation is replaced by a compact description of
+        the mission and a summary of the current plan, and the prompt only contains the event and the state of the mission.
+        The whole mission is described again if there is no current plan or the compact conversation would not fit.
         :param plan_adaptation: Contains the updated information for adapting the plan.
         :param current_location_of_drones: Maps the id of the drone to its current cell location.
-          :return: A plan for each drone.
+        :param current_round: The round the drones are currently flying, rounds before it are kept.
+        :param affected_drone_ids: The drones to re-plan (defaults to the drones whose location is given).
+        :param remaining_battery: Maps the id of the drone to the share of its battery left (0-1), if known.
+        :param covered_cells: The cells already searched (defaults to the cells of the kept rounds).
+        :return: A plan for each drone.
         """
-        self.current_configuration = deepcopy(self.current_configuration)
-        self.current_configuration.plan_adaptation = plan_adaptation
-        self.current_configuration.add_current_location_to_drones(current_location_of_drones)
-        return self._generate(**params)
+        affected_drone_ids = set(affected_drone_ids) if affected_drone_ids is not None \
+            else set(current_location_of_drones.keys())
+        self.current_configuration = self.initial_configuration.with_adaptation(plan_adaptation, current_location_of_drones,
+                                                                                drone_ids=affected_drone_ids)
+        params.setdefault("priority", RequestPriority.LIVE)
+        n_kept_rounds = current_round - STARTING_FLIGHT_PLAN_NUM
+        previous_plan_manager = self.plan_manager
+        adaptation_context, context_history = None, None
+        if self.delta_adaptations and previous_plan_manager is not None:
+            if covered_cells is None:
+                covered_cells = self._get_covered_cells(previous_plan_manager, n_kept_rounds)
+            adaptation_context = AdaptationContext(covered_cells, remaining_battery)
+            context_history = self._get_adaptation_history(previous_plan_manager, adaptation_context)
+            if context_history is None:
+                adaptation_context = None
+        elif self.delta_adaptations:
+            logging.info("No current plan to adapt, describing the whole mission.")
+        adapted_plans = self._generate(n_rounds=N_DRONE_FLIGHTS - n_kept_rounds, adaptation_context=adaptation_context,
+                                       context_history=context_history, **params)
+        self.adaptations.append(plan_adaptation)
+        if previous_plan_manager is None:
+            return adapted_plans
+        self.plan_manager = self._merge_adaptation(previous_plan_manager, adapted_plans, n_kept_rounds)
+        return self.plan_manager.get_plans()
 
     def generate_initial(self, **params) -> List[DronePlan]:
         """
@@ -40,28 +114,218 @@ class PlanGenerator:
         self.current_configuration = self.initial_configuration
         return self._generate(**params)
 
-    def _generate(self, mock_response: str = None) -> List[DronePlan]:
+    def fork(self) -> "PlanGenerator":
+        """
+        Copies the generator and the state of its mission so an adaptation can be generated without changing this generator.
+        :return: The copy (without the checkpoint, see adopt).
+        """
+        generator = PlanGenerator(self.initial_configuration, retry_policy=self.retry_policy,
+                                  model_cascade=self.model_cascade, response_mode=self.response_mode,
+                                  profiler=self.profiler, delta_adaptations=self.delta_adaptations,
+                                  completion_reserve=self.completion_reserve)
+        generator.current_configuration = self.current_configuration
+        generator.plan_manager = self.plan_manager
+        generator.conversation_history = list(self.conversation_history)
+        generator.adaptations = list(self.adaptations)
+        return generator
+
+    def adopt(self, generator: "PlanGenerator") -> None:
+        """
+        Takes the state of the mission from a fork (e.g. once its adaptation succeeded).
+        :param generator: The fork.
+        :return: None
+        """
+        self.current_configuration = generator.current_configuration
+        self.plan_manager = generator.plan_manager
+        self.conversation_history = generator.conversation_history
+        self.adaptations = generator.adaptations
+
+    def _generate(self, mock_response: str = None, priority: RequestPriority = RequestPriority.DEFAULT,
+                  n_rounds: int = N_DRONE_FLIGHTS, cancel_event: threading.Event = None,
+                  adaptation_context: AdaptationContext = None, context_history: List[Dict] = None) -> List[DronePlan]:
         """
         Uses the model to generate a flight plan for the scenario provided in the variables.
         :param mock_response: If provided, uses the mock response in place of an actual generation from the model.
+        :param priority: The priority of the completions when rate limited (adaptations are live by default).
+        :param n_rounds: The number of flights to plan.
+        :param cancel_event: If set while generating, the generation stops before planning the next flight.
+        :param adaptation_context: If provided, the context history is continued with a prompt containing only the
+                                   adaptation and this state of the mission.
+        :param context_history: The messages describing the mission and its current plan (see build_adaptation_history).
         :return: A plan for each drone.
         """
-        self.conversation_history.clear()
-        prompt_factory = PromptFactory(self.current_configuration)
+        base_history = list(context_history) if adaptation_context is not None else []
+        self.conversation_history = list(base_history)
+        prompt_factory = PromptFactory(self.current_configuration, response_mode=self.response_mode,
+                                       adaptation_context=adaptation_context, model=self._get_smallest_model(),
+                                       completion_reserve=self.completion_reserve)
+        completion_params = prompt_factory.get_completion_params()
         drone_plan_manager = DronePlanManager()
-        last_flight_plan_num = N_DRONE_FLIGHTS + STARTING_FLIGHT_PLAN_NUM
-        for i in range(STARTING_FLIGHT_PLAN_NUM, last_flight_plan_num):
-            prompt = prompt_factory.build(flight_plan_num=i)
-
-            logging.info(f"Completing flight plan {i}")
-            if mock_response:
-                res_text = mock_response
-            else:
-                self.conversation_history = LLMManager.make_completion(prompt, conversation_history=self.conversation_history)
-                res_text = self.conversation_history[-1]["content"]
-
-            drones = prompt_factory.parse(res_text)
-            drone_plan_manager.add_plans(drones)
-            logging.info(res_text)
-
-        return drone_plan_manager.get_plans()
\ No newline at end of file
+        first_flight_plan_num = STARTING_FLIGHT_PLAN_NUM
+        last_flight_plan_num = n_rounds + STARTING_FLIGHT_PLAN_NUM
+        config_hash = None
+        if self.checkpoint:
+            is_initial = self.current_configuration is self.initial_configuration
+            config_hash = MissionCheckpoint.hash_configuration(
+                self.current_configuration, n_rounds=n_rounds,
+                kind=INITIAL_GENERATION if is_initial else ADAPTATION_GENERATION,
+                context=[base_history, sorted(adaptation_context.covered_cells), adaptation_context.remaining_battery]
+                if adaptation_context is not None else None)
+            with METRICS.span("checkpoint_load"):
+                checkpoint_state = self.checkpoint.load(config_hash)
+            if checkpoint_state:
+                logging.info(f"Resuming from checkpoint after {checkpoint_state.n_rounds} flight plans")
+                self.conversation_history = base_history + checkpoint_state.conversation_history
+                drone_plan_manager = checkpoint_state.plan_manager
+                first_flight_plan_num += checkpoint_state.n_rounds
+                prompt_factory.build(flight_plan_num=STARTING_FLIGHT_PLAN_NUM)
+        with self.profiler or nullcontext():
+            for i in range(first_flight_plan_num, last_flight_plan_num):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise GenerationCancelled(f"Generation cancelled before flight plan {i}")
+                with METRICS.span("prompt_build", round=i):
+                    prompt = self._build_prompt(prompt_factory, i, n_pinned_messages=len(base_history) + 2)
+                n_previous_messages = len(self.conversation_history)
+
+                logging.info(f"Completing flight plan {i}")
+                if mock_response:
+                    res_text = mock_response
+                    self.conversation_history += [{"role": "user", "content": prompt},
+                                                  {"role": "assistant", "content": res_text}]
+                elif self.model_cascade and i > STARTING_FLIGHT_PLAN_NUM:
+                    validator = PlanValidator(self.current_configuration)
+                    self.conversation_history = self.model_cascade.make_completion(
+                        prompt, self.conversation_history,
+                        is_valid=lambda response: self._is_valid_response(prompt_factory, validator, response),
+                        metric_labels={"round": i}, retry_policy=self.retry_policy, priority=priority,
+                        **completion_params)
+                    res_text = self.conversation_history[-1]["content"]
+                else:
+                    self.conversation_history = LLMManager.make_completion(
+                        prompt, conversation_history=self.conversation_history, metric_labels={"round": i},
+                        retry_policy=self.retry_policy, priority=priority, **completion_params)
+                    res_text = self.conversation_history[-1]["content"]
+
+                with METRICS.span("parse", round=i):
+                    drones = prompt_factory.parse(res_text)
+                with METRICS.span("merge", round=i):
+                    drone_plan_manager.add_plans(drones)
+                if self.checkpoint:
+                    self.checkpoint.append(config_hash, i, self.conversation_history[n_previous_messages:], drones)
+                logging.info(res_text)
+                if self.profiler:
+                    self.profiler.snapshot(f"round_{i}")
+
+        if self.checkpoint:
+            self.checkpoint.complete(config_hash)
+        METRICS.flush()
+        self.plan_manager = drone_plan_manager
+        return drone_plan_manager.get_plans()
+
+    def _build_prompt(self, prompt_factory: PromptFactory, flight_plan_num: int, n_pinned_messages: int) -> str:
+        """
+        Builds the prompt of a flight, dropping the oldest flights of the conversation while the prompt (at its smallest)
+        and the conversation do not fit the window. The pinned messages (the mission and the first request) and the last
+        flight are always kept.
+        :param prompt_factory: Builds the prompt.
+        :param flight_plan_num: The flight being planned.
+        :param n_pinned_messages: The number of messages at the start of the conversation that are never dropped.
+        :return: The prompt.
+        :raises PromptBudgetExceeded: If the prompt does not fit even with only the pinned messages and the last flight.
+        """
+        while True:
+            n_context_tokens = self._count_tokens(self.conversation_history, prompt_factory.model)
+            try:
+                return prompt_factory.build(flight_plan_num=flight_plan_num, n_context_tokens=n_context_tokens)
+            except PromptBudgetExceeded:
+                if len(self.conversation_history) < n_pinned_messages + 4:
+                    raise
+            del self.conversation_history[n_pinned_messages:n_pinned_messages + 2]
+            METRICS.increment(PROMPT_DEGRADATIONS, degradation="drop_oldest_flight")
+            logging.info(f"Dropped the oldest flight of the conversation to fit flight plan {flight_plan_num}")
+
+    def _get_adaptation_history(self, plan_manager: DronePlanManager,
+                                adaptation_context: AdaptationContext) -> Optional[List[Dict]]:
+        """
+        Builds the compact conversation of a delta adaptation if it and the update prompt fit the window of the model.
+        :param plan_manager: Contains the current plan.
+        :param adaptation_context: The state of the mission sent with the update.
+        :return: The messages or None if the whole mission should be described instead.
+        """
+        model = self._get_smallest_model()
+        context_history = PromptFactory(self.initial_configuration, response_mode=self.response_mode).build_adaptation_history(
+            plan_manager.get_plans(), previous_adaptations=self.adaptations)
+        prompt_factory = PromptFactory(self.current_configuration, response_mode=self.response_mode,
+                                       adaptation_context=adaptation_context, model=model,
+                                       completion_reserve=self.completion_reserve)
+        try:
+            prompt_factory.build(STARTING_FLIGHT_PLAN_NUM, n_context_tokens=self._count_tokens(context_history, model))
+        except PromptBudgetExceeded:
+            logging.info("The current plan does not fit the window of the model, describing the whole mission.")
+            return None
+        return context_history
+
+    @staticmethod
+    def _count_tokens(messages: List[Dict], model: OpenAIModel) -> int:
+        """
+        :param messages: The messages of a conversation.
+        :param model: The model the messages are sent to.
+        :return: The estimated number of tokens of the messages.
+        """
+        return TokenCalculator.estimate_num_tokens("".join([m["content"] for m in messages]), model)
+
+    def _get_smallest_model(self) -> OpenAIModel:
+        """
+        :return: The model with the smallest window that may complete the prompts (which the prompts must fit).
+        """
+        models = [OpenAIModel.GPT4] + (self.model_cascade.models if self.model_cascade else [])
+        return min(models, key=lambda model: model.get_max_tokens())
+
+    @staticmethod
+    def _get_covered_cells(plan_manager: DronePlanManager, n_rounds: int) -> Set[Tuple[int, int]]:
+        """
+        Gets the cells searched during the first rounds of the plan.
+        :param plan_manager: Contains the plan.
+        :param n_rounds: The number of rounds that were flown.
+        :return: The cells of those rounds.
+        """
+        covered_cells = set()
+        for plan in plan_manager.get_plans():
+            for round_num in range(min(n_rounds, plan.n_rounds)):
+                covered_cells.update(plan.get_round(round_num))
+        return covered_cells
+
+    @staticmethod
+    def _is_valid_response(prompt_factory: PromptFactory, validator: PlanValidator, response: str) -> bool:
+        """
+        Checks whether the plans in the response can be used without asking a stronger model.
+        :param prompt_factory: Parses the response.
+        :param validator: Validates the parsed plans.
+        :param response: The response of the model.
+        :return: Whether the response is valid.
+        """
+        try:
+            plans = prompt_factory.parse(response)
+        except Exception:
+            return False
+        return validator.is_valid(plans)
+
+    @staticmethod
+    def _merge_adaptation(previous_plan_manager: DronePlanManager, adapted_plans: List[DronePlan],
+                          n_kept_rounds: int) -> DronePlanManager:
+        """
+        Replaces the remaining rounds of the adapted drones in the previous plan.
+        :param previous_plan_manager: Contains the plan before the adaptation.
+        :param adapted_plans: The newly generated plans of the affected drones.
+        :param n_kept_rounds: The number of rounds of the previous plan that were already flown.
+        :return: A plan manager containing the merged plans.
+        """
+        id2adapted = {plan.id: plan for plan in adapted_plans}
+        merged_plan_manager = DronePlanManager()
+        for plan in previous_plan_manager.get_plans():
+            if plan.id not in id2adapted:
+                merged_plan_manager.add_plans([plan.copy_rounds()])
+            elif n_kept_rounds > 0:
+                merged_plan_manager.add_plans([plan.copy_rounds(n_kept_rounds)])
+        merged_plan_manager.add_plans([plan.copy_rounds() for plan in adapted_plans])
+        return merged_plan_manager
\ No newline at end of file
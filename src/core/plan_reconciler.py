@@ -0,0 +1,137 @@
+import logging
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from core.drone_plan import DronePlan
+
+Cell = Tuple[int, int]
+DETOUR_MARGIN = 2
+MOVES = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+class PlanReconciler:
+    """
+    Merges plans that were generated independently (e.g. per drone or per sector) into a single consistent plan.
+    """
+
+    @staticmethod
+    def reconcile(plans: List[DronePlan]) -> List[DronePlan]:
+        """
+        Merges the plans of the same drone and removes cells searched more than once.
+        A cell is kept by the visit that searches it first (the earliest step of its drone's plan, then the earliest plan).
+        Later visits are removed and the flight is re-routed from the cell before them to the cell after them around
+        the cells searched by other visits (through them, as a reported transit, if there is no way around). The first and
+        last cell of every flight are kept since they are transit cells (e.g. charging stations) that may be shared.
+        :param plans: The plans to merge (plans of the same drone in the order they are flown).
+        :return: A plan for each drone.
+        """
+        id2plan = {}
+        for plan in plans:
+            if plan.id in id2plan:
+                id2plan[plan.id] += plan.copy_rounds()
+            else:
+                id2plan[plan.id] = plan.copy_rounds()
+
+        first_visits: Dict[Cell, Tuple[int, int]] = {}
+        for plan_num, plan in enumerate(id2plan.values()):
+            for step, cell in PlanReconciler._get_search_steps(plan):
+                if cell not in first_visits or (step, plan_num) < first_visits[cell]:
+                    first_visits[cell] = (step, plan_num)
+
+        blocked_cells: Set[Cell] = set(first_visits)
+        reconciled_plans, n_transits = [], 0
+        for plan_num, (drone_id, plan) in enumerate(id2plan.items()):
+            reconciled_plan = DronePlan(drone_id, [])
+            for round_num in range(plan.n_rounds):
+                start, _ = plan.get_round_bounds(round_num)
+                flight = plan.get_flight(round_num)
+                first_step = start - 1 if plan.is_start_shared(round_num) else start
+                kept_cells, has_gap = [], False
+                for i, cell in enumerate(flight):
+                    is_search_cell = 0 < i < len(flight) - 1
+                    if is_search_cell and first_visits[cell] != (first_step + i, plan_num):
+                        has_gap = True
+                        continue
+                    if has_gap and not PlanReconciler._is_adjacent(kept_cells[-1], cell):
+                        detour = PlanReconciler._find_detour(kept_cells[-1], cell, blocked_cells)
+                        if detour is None:
+                            detour = PlanReconciler._get_straight_path(kept_cells[-1], cell)
+                            n_transits += len(detour)
+                        blocked_cells.update(detour)
+                        kept_cells.extend(detour)
+                    has_gap = False
+                    kept_cells.append(cell)
+                reconciled_plan.add_to_plan(kept_cells)
+            reconciled_plans.append(reconciled_plan)
+        if n_transits:
+            logging.info(f"Re-routed through {n_transits} cells searched by another visit since there was no way around.")
+        return reconciled_plans
+
+    @staticmethod
+    def _get_search_steps(plan: DronePlan) -> Iterator[Tuple[int, Cell]]:
+        """
+        :param plan: The plan of a drone.
+        :return: Iterates over the step and cell of each cell searched by the plan (excluding the first and last cell of
+                 each flight).
+        """
+        for round_num in range(plan.n_rounds):
+            start, end = plan.get_round_bounds(round_num)
+            first_search_step = start if plan.is_start_shared(round_num) else start + 1
+            for step in range(first_search_step, end - 1):
+                yield step, plan.get_cell(step)
+
+    @staticmethod
+    def _find_detour(source: Cell, target: Cell, blocked_cells: Set[Cell]) -> Optional[List[Cell]]:
+        """
+        Finds the shortest path between two cells that avoids the blocked cells, near the two cells.
+        :param source: The cell the path starts from.
+        :param target: The cell the path leads to.
+        :param blocked_cells: The cells the path may not pass through.
+        :return: The cells between the source and the target or None if there is no such path.
+        """
+        min_x, max_x = max(1, min(source[0], target[0]) - DETOUR_MARGIN), max(source[0], target[0]) + DETOUR_MARGIN
+        min_y, max_y = max(1, min(source[1], target[1]) - DETOUR_MARGIN), max(source[1], target[1]) + DETOUR_MARGIN
+        previous: Dict[Cell, Cell] = {source: source}
+        frontier = deque([source])
+        while frontier:
+            cell = frontier.popleft()
+            for dx, dy in MOVES:
+                neighbor = (cell[0] + dx, cell[1] + dy)
+                if neighbor in previous or not (min_x <= neighbor[0] <= max_x and min_y <= neighbor[1] <= max_y):
+                    continue
+                if neighbor == target:
+                    path = []
+                    while cell != source:
+                        path.append(cell)
+                        cell = previous[cell]
+                    return path[::-1]
+                if neighbor not in blocked_cells:
+                    previous[neighbor] = cell
+                    frontier.append(neighbor)
+        return None
+
+    @staticmethod
+    def _get_straight_path(source: Cell, target: Cell) -> List[Cell]:
+        """
+        :param source: The cell the path starts from.
+        :param target: The cell the path leads to.
+        :return: The cells between the source and the target, moving along x first and then along y.
+        """
+        (x, y), (target_x, target_y) = source, target
+        path = []
+        while (x, y) != (target_x, target_y):
+            if x != target_x:
+                x += 1 if target_x > x else -1
+            else:
+                y += 1 if target_y > y else -1
+            path.append((x, y))
+        return path[:-1]
+
+    @staticmethod
+    def _is_adjacent(cell: Cell, other_cell: Cell) -> bool:
+        """
+        :param cell: A cell.
+        :param other_cell: Another cell.
+        :return: Whether a drone can fly from one cell to the other in a single move (or they are the same cell).
+        """
+        return abs(cell[0] - other_cell[0]) + abs(cell[1] - other_cell[1]) <= 1
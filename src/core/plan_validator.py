@@ -0,0 +1,87 @@
+import ast
+from typing import List, Set, Tuple
+
+from core.drone_constants import COMMA
+from core.drone_plan import DronePlan
+from core.drone_variables import DroneVariables
+
+STATION_TERRAINS = {"BatteryCharging", "LaunchPad"}
+N_TRANSIT_CELLS = 2  # the starting (a) and ending (c) cells of a flight
+
+
+class PlanValidator:
+    """
+    Checks the plans of a single round against the configuration of the mission without calling the model.
+    """
+
+    def __init__(self, variables: DroneVariables):
+        """
+        Creates the validator for the mission.
+        :param variables: The configuration of the mission.
+        """
+        self.variables = variables
+        self.drone_ids = {drone["id"] for drone in variables.drones}
+        self.stations = self._get_stations(variables)
+
+    def validate(self, plans: List[DronePlan]) -> List[str]:
+        """
+        Validates the plans of a round.
+        :param plans: The plan of each drone for the round.
+        :return: The problems found (empty if the plans are valid).
+        """
+        errors = [f"Missing plan for {drone_id}" for drone_id in self.drone_ids - {plan.id for plan in plans}]
+        max_cells = self.get_max_cells(self.variables.cells_in_single_battery)
+        for plan in plans:
+            if len(plan) == 0:
+                errors.append(f"{plan.id} has an empty plan")
+                continue
+            if plan.id not in self.drone_ids:
+                errors.append(f"Unknown drone {plan.id}")
+            if len(plan) > max_cells:
+                errors.append(f"{plan.id} visits {len(plan)} cells but can only visit {max_cells}")
+            for x, y in plan:
+                if not (1 <= x <= self.variables.n_width_blocks and 1 <= y <= self.variables.n_height_blocks):
+                    errors.append(f"{plan.id} leaves the search area at {(x, y)}")
+                    break
+            if self.stations and plan.get_cell(-1) not in self.stations:
+                errors.append(f"{plan.id} does not end at a charging station")
+        return errors
+
+    @staticmethod
+    def get_max_cells(cells_in_single_battery: int) -> int:
+        """
+        :param cells_in_single_battery: The number of cells that can be searched in a single battery life.
+        :return: The number of cells a single flight may visit, including its starting and ending station.
+        """
+        return cells_in_single_battery + N_TRANSIT_CELLS
+
+    def is_valid(self, plans: List[DronePlan]) -> bool:
+        """
+        :param plans: The plan of each drone for the round.
+        :return: Whether the plans are valid.
+        """
+        return len(self.validate(plans)) == 0
+
+    def _get_stations(self, variables: DroneVariables) -> Set[Tuple[int, int]]:
+        """
+        Gets the cells drones can recharge at (charging stations, charging terrain and the launch point).
+        :param variables: The configuration of the mission.
+        :return: The numeric coordinates of the stations.
+        """
+        blocks = [b for t in variables.terrains if t["type"] in STATION_TERRAINS for b in t["blocks"]]
+        if isinstance(variables.launch_point, str):
+            blocks.append(variables.launch_point)
+        battery_changing_stations = getattr(variables, "battery_changing_stations", None)
+        if isinstance(battery_changing_stations, str) and battery_changing_stations:
+            blocks.extend(self._split_cells(battery_changing_stations))
+        return {variables.to_numeric_coordinate(b) for b in blocks}
+
+    def _split_cells(self, cells: str) -> List[str]:
+        """
+        Splits a comma separated list of translated cells.
+        :param cells: The cells.
+        :return: The list of cells.
+        """
+        if self.variables.use_alphabetical:
+            return cells.split(COMMA)
+        return [str(c) for c in ast.literal_eval(f"[{cells}]")]
@@ -0,0 +1,167 @@
+import os
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from core.drone_variables import CoordinateType, DroneVariables
+from core.terrain_struct import TerrainStruct
+
+BATTERY_CHARGING_TERRAIN = "BatteryCharging"
+LAUNCH_PAD_TERRAIN = "LaunchPad"
+NPZ_LABELS_KEY = "labels"
+BACKGROUND_LABEL = 0
+POINT_TERRAINS = [LAUNCH_PAD_TERRAIN, BATTERY_CHARGING_TERRAIN]  # kept if any pixel is present, in order of precedence
+
+PaletteKey = Union[int, Tuple[int, int, int]]
+
+
+class RasterTerrainLoader:
+    """
+    Builds the terrains, charging stations and launch point of a mission from a labeled raster map.
+    Supported rasters are .npy/.npz arrays of integer labels and .png images (palette indices or RGB colors).
+    """
+
+    def __init__(self, palette: Dict[PaletteKey, Optional[str]]):
+        """
+        Creates the loader.
+        :param palette: Maps a raster value (integer label, palette index or RGB color) to its terrain type.
+                        Values mapped to None or missing from the palette are background.
+        """
+        self.palette = palette
+        self.terrain_types = sorted({t for t in palette.values() if t is not None})
+
+    def load(self, path: str, n_width_blocks: int, n_height_blocks: int) -> Tuple[List[TerrainStruct], List[CoordinateType],
+                                                                                  Optional[CoordinateType]]:
+        """
+        Loads the raster and downsamples it to the grid.
+        :param path: The path to the raster.
+        :param n_width_blocks: The width of the search area in blocks.
+        :param n_height_blocks: The height of the search area in blocks.
+        :return: The terrains, the battery changing stations and the launch point.
+        """
+        labels = self.read_labels(path)
+        point_labels = [self.terrain_types.index(t) + 1 for t in POINT_TERRAINS if t in self.terrain_types]
+        grid = self.downsample(labels, n_width_blocks, n_height_blocks, len(self.terrain_types) + 1,
+                               point_labels=point_labels)
+        return self.to_terrains(grid)
+
+    def create_drone_variables(self, path: str, n_width_blocks: int, n_height_blocks: int, **variables) -> DroneVariables:
+        """
+        Creates the variables of a mission whose search area is given by the raster.
+        :param path: The path to the raster.
+        :param n_width_blocks: The width of the search area in blocks.
+        :param n_height_blocks: The height of the search area in blocks.
+        :param variables: The remaining variables of the mission (e.g. drones, battery_time).
+        :return: The variables.
+        :raises ValueError: If the raster contains no launch pad and no launch point is given.
+        """
+        terrains, battery_changing_stations, launch_point = self.load(path, n_width_blocks, n_height_blocks)
+        if variables.get("launch_point") is None:
+            if launch_point is None:
+                raise ValueError(f"No {LAUNCH_PAD_TERRAIN} in {path}, provide the launch_point.")
+            variables["launch_point"] = launch_point
+        return DroneVariables(terrains=terrains, battery_changing_stations=battery_changing_stations,
+                              n_width_blocks=n_width_blocks, n_height_blocks=n_height_blocks, **variables)
+
+    def read_labels(self, path: str) -> np.ndarray:
+        """
+        Reads the raster and maps its values to label ids (0 for background, i + 1 for the i-th terrain type).
+        :param path: The path to the raster.
+        :return: 2D array of label ids (rows are the height of the area).
+        """
+        extension = os.path.splitext(path)[1].lower()
+        if extension == ".npy":
+            raw = np.load(path)
+        elif extension == ".npz":
+            with np.load(path) as archive:
+                raw = archive[NPZ_LABELS_KEY] if NPZ_LABELS_KEY in archive else archive[archive.files[0]]
+        elif extension == ".png":
+            raw = self._read_png(path)
+        else:
+            raise ValueError(f"Unsupported raster format: {extension}")
+        assert raw.ndim == 2, f"Expected a 2D raster but got shape {raw.shape}"
+        return self._map_to_label_ids(raw)
+
+    @staticmethod
+    def downsample(labels: np.ndarray, n_width_blocks: int, n_height_blocks: int, n_labels: int,
+                   point_labels: List[int] = ()) -> np.ndarray:
+        """
+        Downsamples the raster to the grid, assigning each cell the most common label among its pixels. Point labels
+        (e.g. stations) are assigned to every cell containing any of their pixels, taking precedence over area labels.
+        :param labels: 2D array of label ids.
+        :param n_width_blocks: The width of the search area in blocks.
+        :param n_height_blocks: The height of the search area in blocks.
+        :param n_labels: The number of label ids (including background).
+        :param point_labels: The point label ids, highest precedence first.
+        :return: Array of shape (n_height_blocks, n_width_blocks) containing the label id of each cell.
+        """
+        height, width = labels.shape
+        assert height >= n_height_blocks and width >= n_width_blocks, \
+            f"Raster ({width}x{height}) is smaller than the grid ({n_width_blocks}x{n_height_blocks})"
+        rows = np.arange(height) * n_height_blocks // height
+        columns = np.arange(width) * n_width_blocks // width
+        cell_ids = rows[:, None] * n_width_blocks + columns[None, :]
+        n_cells = n_width_blocks * n_height_blocks
+        counts = np.bincount((cell_ids * n_labels + labels).ravel(), minlength=n_cells * n_labels).reshape(n_cells, n_labels)
+        grid = counts.argmax(axis=1)
+        for label_id in reversed(point_labels):
+            grid[counts[:, label_id] > 0] = label_id
+        return grid.reshape(n_height_blocks, n_width_blocks)
+
+    def to_terrains(self, grid: np.ndarray) -> Tuple[List[TerrainStruct], List[CoordinateType], Optional[CoordinateType]]:
+        """
+        Converts the label of each cell to the terrains of the mission.
+        :param grid: Array of shape (n_height_blocks, n_width_blocks) containing the label id of each cell.
+        :return: The terrains, the battery changing stations and the launch point (numeric coordinates starting at 1).
+        """
+        terrains, battery_changing_stations, launch_point = [], [], None
+        for label_id, terrain_type in enumerate(self.terrain_types, start=1):
+            rows, columns = np.nonzero(grid == label_id)
+            if len(rows) == 0:
+                continue
+            blocks = list(zip((columns + 1).tolist(), (rows + 1).tolist()))
+            terrains.append(TerrainStruct(type=terrain_type, blocks=blocks))
+            if terrain_type == BATTERY_CHARGING_TERRAIN:
+                battery_changing_stations.extend(blocks)
+            elif terrain_type == LAUNCH_PAD_TERRAIN and launch_point is None:
+                launch_point = blocks[0]
+        return terrains, battery_changing_stations, launch_point
+
+    def _map_to_label_ids(self, raw: np.ndarray) -> np.ndarray:
+        """
+        Maps raster values to label ids using the palette.
+        :param raw: 2D array of raster values (integers or packed RGB colors).
+        :return: 2D array of label ids.
+        """
+        type2id = {t: i for i, t in enumerate(self.terrain_types, start=1)}
+        values, inverse = np.unique(raw, return_inverse=True)
+        value_ids = np.array([type2id.get(self.palette.get(self._to_palette_key(v)), BACKGROUND_LABEL) for v in values.tolist()],
+                             dtype=np.int64)
+        return value_ids[inverse].reshape(raw.shape)
+
+    @staticmethod
+    def _to_palette_key(value: int) -> PaletteKey:
+        """
+        Converts a raster value to the key used in the palette.
+        :param value: The raster value (packed RGB colors are negative).
+        :return: The palette key.
+        """
+        if value < 0:
+            color = -value - 1
+            return (color >> 16) & 255, (color >> 8) & 255, color & 255
+        return value
+
+    @staticmethod
+    def _read_png(path: str) -> np.ndarray:
+        """
+        Reads a png as palette indices (paletted images) or as packed RGB colors (stored as negative values).
+        :param path: The path to the image.
+        :return: 2D array of raster values.
+        """
+        from PIL import Image  # only needed for png rasters
+
+        with Image.open(path) as image:
+            if image.mode in ("P", "L"):
+                return np.asarray(image).astype(np.int64)
+            rgb = np.asarray(image.convert("RGB")).astype(np.int64)
+        return -((rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]) - 1
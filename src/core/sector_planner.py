@@ -0,0 +1,221 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+from src.core.drone_constants import N_DRONE_FLIGHTS
+from src.core.drone_plan import DronePlan
+from src.core.drone_variables import CoordinateType, DroneVariables
+from src.core.parallel_plan_generator import MAX_SEARCH_PRIORITIES, ParallelPlanGenerator, Region
+from src.core.plan_generator import PlanGenerator
+from src.core.plan_reconciler import PlanReconciler
+from src.core.plan_validator import STATION_TERRAINS
+
+
+class Sector(NamedTuple):
+    """
+    A rectangular part of the search area and the number of terrain cells it contains.
+    """
+    region: Region
+    weight: int
+
+
+DEFAULT_MAX_WORKERS = 4
+CONTINUE_FROM_PRIORITY = "Each drone starts its first flight at its current_location (a charging station) instead of the " \
+                         "launch pad."
+
+
+class SectorPlanner:
+    """
+    Plans large search areas by splitting them into sectors (quadtree on the terrain cells) so each prompt only describes one
+    sector. Sectors are assigned to drones locally and the flights of each drone are split across its sectors. The sectors
+    of a drone are planned in order, each starting from where the previous one ended, while different drones are planned
+    concurrently. The plans are then stitched together, removing cells searched twice at sector boundaries.
+    """
+
+    def __init__(self, drone_variables: DroneVariables, max_cells_per_sector: int = 200,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 **generator_params):
+        """
+        Creates the planner.
+        :param drone_variables: The variables of the whole mission.
+        :param max_cells_per_sector: The maximum number of terrain cells described in a single prompt.
+        :param max_workers: The maximum number of concurrent generations.
+        :param generator_params: Parameters passed to the plan generator of each sector (e.g. retry_policy).
+        """
+        self.variables = drone_variables
+        self.max_cells_per_sector = max_cells_per_sector
+        self.max_workers = max_workers
+        self.generator_params = generator_params
+
+    def generate_initial(self, **params) -> List[DronePlan]:
+        """
+        Generates the flight plans of all sectors and stitches them together.
+        :param params: Any additional parameters to the generation (e.g. mock_response).
+        :return: A plan for each drone.
+        """
+        sectors = self.split_sectors()
+        sector2drones = self.assign_sectors(sectors)
+        sector2rounds = self.split_flights(sectors, sector2drones)
+        chains = [[i for i in sector2drones if sector2drones[i][0] == drone_id] for drone_id in
+                  dict.fromkeys(drone_ids[0] for drone_ids in sector2drones.values())]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chains)), thread_name_prefix="sector") as executor:
+            futures = [executor.submit(self._generate_chain, [(i, sectors[i], sector2drones[i], sector2rounds[i])
+                                                              for i in chain], params) for chain in chains]
+            plans = [plan for future in futures for plan in future.result()]
+        return PlanReconciler.reconcile(plans)
+
+    def split_flights(self, sectors: List[Sector], sector2drones: Dict[int, List[str]]) -> Dict[int, int]:
+        """
+        Splits the flights of each drone across its sectors in proportion to their terrain cells (at least one each).
+        :param sectors: The sectors of the search area.
+        :param sector2drones: Maps the index of each sector to the ids of the drones planned in it (see assign_sectors).
+        :return: Maps the index of each sector to the number of flights planned in it.
+        """
+        sector2rounds = {}
+        for drone_id in dict.fromkeys(drone_ids[0] for drone_ids in sector2drones.values()):
+            drone_sectors = [i for i, drone_ids in sector2drones.items() if drone_ids[0] == drone_id]
+            weights = np.array([max(sectors[i].weight, 1) for i in drone_sectors], dtype=np.float64)
+            extra_rounds = N_DRONE_FLIGHTS - len(drone_sectors)
+            shares = weights / weights.sum() * extra_rounds
+            rounds = 1 + np.floor(shares).astype(np.int64)
+            for j in np.argsort(-(shares - np.floor(shares)))[:N_DRONE_FLIGHTS - rounds.sum()]:
+                rounds[j] += 1
+            sector2rounds.update(zip(drone_sectors, rounds.tolist()))
+        return sector2rounds
+
+    def split_sectors(self) -> List[Sector]:
+        """
+        Recursively splits the search area into quadrants until each contains at most the maximum number of terrain cells.
+        Sectors without terrain are dropped. If the drones do not have enough flights for one sector each, the maximum is
+        doubled until they do.
+        :return: The sectors ordered by their distance from the launch point.
+        """
+        cells = self._get_terrain_cells()
+        max_sectors = len(self.variables.drones) * N_DRONE_FLIGHTS
+        max_cells_per_sector = self.max_cells_per_sector
+        sectors = self._split_quadrants(cells, max_cells_per_sector)
+        while len(sectors) > max(max_sectors, 1):
+            max_cells_per_sector *= 2
+            sectors = self._split_quadrants(cells, max_cells_per_sector)
+        if max_cells_per_sector != self.max_cells_per_sector:
+            logging.warning(f"Sectors contain up to {max_cells_per_sector} terrain cells instead of "
+                            f"{self.max_cells_per_sector} so that each of the {max_sectors} flights plans at most one.")
+        launch_x, launch_y = self._get_launch_cell()
+        return sorted(sectors, key=lambda s: abs((s.region[0][0] + s.region[1][0]) / 2 - launch_x)
+                                             + abs((s.region[0][1] + s.region[1][1]) / 2 - launch_y))
+
+    def assign_sectors(self, sectors: List[Sector]) -> Dict[int, List[str]]:
+        """
+        Assigns sectors to drones, balancing the number of terrain cells each drone searches. A drone is assigned at most as
+        many sectors as it has flights. If there are more drones than sectors, the remaining drones join the heaviest sectors.
+        :param sectors: The sectors of the search area.
+        :return: Maps the index of each sector to the ids of the drones planned in it (the drone it was assigned to first).
+        :raises ValueError: If there are more sectors than flights of all drones.
+        """
+        drone_ids = [drone["id"] for drone in self.variables.drones]
+        drone_loads = {drone_id: 0 for drone_id in drone_ids}
+        drone_sectors = {drone_id: 0 for drone_id in drone_ids}
+        sector2drones = {}
+        for i in sorted(range(len(sectors)), key=lambda s: -sectors[s].weight):
+            available_ids = [d for d in drone_ids if drone_sectors[d] < N_DRONE_FLIGHTS]
+            if not available_ids:
+                raise ValueError(f"Sector {sectors[i].region} cannot be planned: every drone has a flight in "
+                                 f"{N_DRONE_FLIGHTS} sectors (see split_sectors).")
+            drone_id = min(available_ids, key=lambda d: drone_loads[d])
+            drone_loads[drone_id] += sectors[i].weight
+            drone_sectors[drone_id] += 1
+            sector2drones[i] = [drone_id]
+        unassigned = [d for d in drone_ids if not any(d in ids for ids in sector2drones.values())]
+        heaviest_sectors = sorted(sector2drones.keys(), key=lambda s: -sectors[s].weight)
+        for j, drone_id in enumerate(unassigned):
+            sector2drones[heaviest_sectors[j % len(heaviest_sectors)]].append(drone_id)
+        return dict(sorted(sector2drones.items()))
+
+    def _generate_chain(self, chain: List[Tuple[int, Sector, List[str], int]], params: Dict) -> List[DronePlan]:
+        """
+        Plans the sectors of a drone in order, each starting where the previous one ended.
+        :param chain: The index of the sector, the sector, the ids of its drones and its number of flights, in the order
+                      they are flown.
+        :param params: Any additional parameters to the generation.
+        :return: The plans of the sectors in order (only of the sector's drones).
+        """
+        plans = []
+        end_cells = {}
+        for sector_num, sector, drone_ids, n_rounds in chain:
+            drones = [d for d in self.variables.drones if d["id"] in drone_ids]
+            configuration = ParallelPlanGenerator.create_group_configuration(self.variables, drones, sector.region)
+            if end_cells:
+                configuration = self._continue_from(configuration, end_cells)
+            generator_params = ParallelPlanGenerator.get_group_params(self.generator_params, sector_num)
+            sector_plans = [plan for plan in PlanGenerator(configuration, **generator_params).generate_initial(
+                n_rounds=n_rounds, **params) if plan.id in drone_ids]
+            end_cells.update({plan.id: plan.get_cell(-1) for plan in sector_plans if len(plan)})
+            plans.extend(sector_plans)
+        return plans
+
+    @staticmethod
+    def _continue_from(configuration: DroneVariables, end_cells: Dict[str, CoordinateType]) -> DroneVariables:
+        """
+        Starts the drones of the configuration where their previous sector ended.
+        :param configuration: The configuration of the sector.
+        :param end_cells: Maps the id of a drone to the last cell of its previous sector.
+        :return: The configuration of the sector starting from those cells.
+        """
+        configuration = copy(configuration)
+        configuration.drones = [{**d, "current_location": configuration.translate_coordinate(end_cells[d["id"]])}
+                                if d["id"] in end_cells else d for d in configuration.drones]
+        priorities = configuration.search_priorities
+        configuration.search_priorities = priorities[:1] + [CONTINUE_FROM_PRIORITY] + priorities[1:MAX_SEARCH_PRIORITIES - 1]
+        return configuration
+
+    def _split_quadrants(self, cells: np.ndarray, max_cells_per_sector: int) -> List[Sector]:
+        """
+        Recursively splits the search area into quadrants until each contains at most the given number of terrain cells.
+        :param cells: The numeric coordinates of the terrain cells (see _get_terrain_cells).
+        :param max_cells_per_sector: The maximum number of terrain cells of a sector.
+        :return: The sectors containing terrain (the whole area if there is none).
+        """
+        full_region = ((1, 1), (self.variables.n_width_blocks, self.variables.n_height_blocks))
+        if len(cells) == 0:
+            return [Sector(full_region, 0)]
+        sectors = []
+        stack = [(full_region, cells)]
+        while stack:
+            region, region_cells = stack.pop()
+            (min_x, min_y), (max_x, max_y) = region
+            if len(region_cells) <= max_cells_per_sector or (min_x == max_x and min_y == max_y):
+                if len(region_cells) > 0:
+                    sectors.append(Sector(region, len(region_cells)))
+                continue
+            mid_x, mid_y = (min_x + max_x) // 2, (min_y + max_y) // 2
+            is_left = region_cells[:, 0] <= mid_x
+            is_top = region_cells[:, 1] <= mid_y
+            quadrants = [(((min_x, min_y), (mid_x, mid_y)), is_left & is_top),
+                         (((mid_x + 1, min_y), (max_x, mid_y)), ~is_left & is_top),
+                         (((min_x, mid_y + 1), (mid_x, max_y)), is_left & ~is_top),
+                         (((mid_x + 1, mid_y + 1), (max_x, max_y)), ~is_left & ~is_top)]
+            for quadrant, mask in quadrants:
+                (q_min_x, q_min_y), (q_max_x, q_max_y) = quadrant
+                if q_min_x <= q_max_x and q_min_y <= q_max_y:
+                    stack.append((quadrant, region_cells[mask]))
+        return sectors
+
+    def _get_terrain_cells(self) -> np.ndarray:
+        """
+        Gets the numeric coordinates of all terrain cells that need to be searched (stations excluded).
+        :return: Array of shape (n_cells, 2).
+        """
+        cells = {self.variables.to_numeric_coordinate(b) for t in self.variables.terrains
+                 if t["type"] not in STATION_TERRAINS for b in t["blocks"]}
+        return np.array(sorted(cells), dtype=np.int64).reshape(-1, 2)
+
+    def _get_launch_cell(self) -> CoordinateType:
+        """
+        Gets the numeric coordinate of the launch point.
+        :return: The launch point (the top-left corner if it is unknown).
+        """
+        launch_point = self.variables.launch_point
+        return self.variables.to_numeric_coordinate(launch_point) if launch_point else (1, 1)
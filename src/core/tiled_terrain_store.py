@@ -0,0 +1,190 @@
+import json
+import struct
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from core.drone_variables import CoordinateType, DroneVariables
+from core.raster_terrain_loader import RasterTerrainLoader
+from core.terrain_struct import TerrainStruct
+
+MAGIC = b"DRTILES1"
+HEADER_FORMAT = "<8sIIII"  # magic, tile size, width, height, length of the terrain types
+HEADER_ALIGNMENT = 4096
+TILE_DTYPE = np.uint8
+DEFAULT_TILE_SIZE = 256
+
+WindowType = Tuple[CoordinateType, CoordinateType]
+
+
+class TiledTerrainStore:
+    """
+    Stores a large terrain grid on disk as fixed-size tiles of label ids (0 for background, i + 1 for the i-th terrain type).
+    The tiles are memory-mapped so a mission only reads the tiles covering its search area.
+    """
+
+    def __init__(self, path: str, tiles: np.memmap, tile_size: int, n_width_blocks: int, n_height_blocks: int,
+                 terrain_types: List[str]):
+        """
+        Wraps an opened store; use create or open.
+        :param path: The path to the store.
+        :param tiles: The memory-mapped tiles of shape (n_tile_rows, n_tile_columns, tile_size, tile_size).
+        :param tile_size: The width and height of a tile in cells.
+        :param n_width_blocks: The width of the whole grid in cells.
+        :param n_height_blocks: The height of the whole grid in cells.
+        :param terrain_types: The terrain type of each label id (starting at label 1).
+        """
+        self.path = path
+        self.tiles = tiles
+        self.tile_size = tile_size
+        self.n_width_blocks = n_width_blocks
+        self.n_height_blocks = n_height_blocks
+        self.terrain_types = terrain_types
+        self._loader = RasterTerrainLoader({i: t for i, t in enumerate(terrain_types, start=1)})
+
+    @classmethod
+    def create(cls, path: str, n_width_blocks: int, n_height_blocks: int, terrain_types: List[str],
+               tile_size: int = DEFAULT_TILE_SIZE) -> "TiledTerrainStore":
+        """
+        Creates an empty store (all background) on disk. The terrain types are sorted, so the label id of a terrain type
+        is its position in sorted(set(terrain_types)) plus 1, not in the given list.
+        :param path: The path to the store.
+        :param n_width_blocks: The width of the whole grid in cells.
+        :param n_height_blocks: The height of the whole grid in cells.
+        :param terrain_types: The terrain types that can be stored.
+        :param tile_size: The width and height of a tile in cells.
+        :return: The store opened for writing.
+        """
+        terrain_types = sorted(set(terrain_types))
+        assert len(terrain_types) <= np.iinfo(TILE_DTYPE).max, f"At most {np.iinfo(TILE_DTYPE).max} terrain types are supported."
+        types_json = json.dumps(terrain_types).encode("utf-8")
+        header = struct.pack(HEADER_FORMAT, MAGIC, tile_size, n_width_blocks, n_height_blocks, len(types_json)) + types_json
+        with open(path, "wb") as f:
+            f.write(header)
+        offset = cls._get_data_offset(len(header))
+        shape = cls._get_tiles_shape(n_width_blocks, n_height_blocks, tile_size)
+        tiles = np.memmap(path, dtype=TILE_DTYPE, mode="r+", offset=offset, shape=shape)
+        return cls(path, tiles, tile_size, n_width_blocks, n_height_blocks, terrain_types)
+
+    @classmethod
+    def open(cls, path: str, writable: bool = False) -> "TiledTerrainStore":
+        """
+        Opens an existing store without reading its tiles.
+        :param path: The path to the store.
+        :param writable: Whether the tiles may be written.
+        :return: The store.
+        """
+        with open(path, "rb") as f:
+            fixed_header = f.read(struct.calcsize(HEADER_FORMAT))
+            magic, tile_size, n_width_blocks, n_height_blocks, types_length = struct.unpack(HEADER_FORMAT, fixed_header)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a tiled terrain store.")
+            terrain_types = json.loads(f.read(types_length).decode("utf-8"))
+        offset = cls._get_data_offset(len(fixed_header) + types_length)
+        shape = cls._get_tiles_shape(n_width_blocks, n_height_blocks, tile_size)
+        tiles = np.memmap(path, dtype=TILE_DTYPE, mode="r+" if writable else "r", offset=offset, shape=shape)
+        return cls(path, tiles, tile_size, n_width_blocks, n_height_blocks, terrain_types)
+
+    def write_window(self, top_left: CoordinateType, labels: np.ndarray) -> None:
+        """
+        Writes the label ids of a rectangular part of the grid (e.g. while converting a large raster in chunks).
+        :param top_left: The numeric coordinate (starting at 1) of the first cell in labels.
+        :param labels: Array of shape (height, width) containing label ids.
+        :return: None
+        """
+        height, width = labels.shape
+        min_x, min_y = top_left
+        self._get_window_view(((min_x, min_y), (min_x + width - 1, min_y + height - 1)), labels=labels)
+
+    def read_window(self, window: WindowType) -> np.ndarray:
+        """
+        Reads the label ids of a rectangular part of the grid, only touching the tiles that cover it.
+        :param window: The top-left and bottom-right cell (numeric, starting at 1) of the window.
+        :return: Array of shape (height, width) containing the label id of each cell.
+        """
+        return self._get_window_view(window)
+
+    def load_terrains(self, window: WindowType) -> Tuple[List[TerrainStruct], List[CoordinateType], Optional[CoordinateType]]:
+        """
+        Converts a window of the grid to the terrains of a mission. Coordinates are relative to the window (starting at 1).
+        :param window: The top-left and bottom-right cell (numeric, starting at 1) of the search area.
+        :return: The terrains, the battery changing stations and the launch point.
+        """
+        return self._loader.to_terrains(self.read_window(window))
+
+    def create_drone_variables(self, window: WindowType, **variables) -> DroneVariables:
+        """
+        Creates the variables of a mission whose search area is a window of the grid.
+        :param window: The top-left and bottom-right cell (numeric, starting at 1) of the search area.
+        :param variables: The remaining variables of the mission (e.g. drones, battery_time).
+        :return: The variables.
+        """
+        terrains, battery_changing_stations, launch_point = self.load_terrains(window)
+        (min_x, min_y), (max_x, max_y) = window
+        variables.setdefault("launch_point", launch_point)
+        return DroneVariables(terrains=terrains, battery_changing_stations=battery_changing_stations,
+                              n_width_blocks=max_x - min_x + 1, n_height_blocks=max_y - min_y + 1, **variables)
+
+    def flush(self) -> None:
+        """
+        Writes modified tiles to disk.
+        :return: None
+        """
+        self.tiles.flush()
+
+    def close(self) -> None:
+        """
+        Flushes and releases the memory map (it is unmapped once no window views reference it).
+        :return: None
+        """
+        if self.tiles.mode != "r":
+            self.flush()
+        self.tiles = None
+
+    def __enter__(self) -> "TiledTerrainStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _get_window_view(self, window: WindowType, labels: np.ndarray = None) -> np.ndarray:
+        """
+        Copies a window out of the tiles covering it, or into them if labels are given.
+        :param window: The top-left and bottom-right cell (numeric, starting at 1) of the window.
+        :param labels: The label ids to write into the window.
+        :return: The label ids of the window.
+        """
+        (min_x, min_y), (max_x, max_y) = window
+        assert 1 <= min_x <= max_x <= self.n_width_blocks and 1 <= min_y <= max_y <= self.n_height_blocks, \
+            f"Window {window} is outside of the grid ({self.n_width_blocks}x{self.n_height_blocks})."
+        size = self.tile_size
+        first_row, last_row = (min_y - 1) // size, (max_y - 1) // size
+        first_column, last_column = (min_x - 1) // size, (max_x - 1) // size
+        tiles = self.tiles[first_row:last_row + 1, first_column:last_column + 1]
+        n_rows, n_columns = tiles.shape[:2]
+        top, left = min_y - 1 - first_row * size, min_x - 1 - first_column * size
+        height, width = max_y - min_y + 1, max_x - min_x + 1
+        window_cells = np.ascontiguousarray(tiles.transpose(0, 2, 1, 3)).reshape(n_rows * size, n_columns * size)
+        if labels is None:
+            return window_cells[top:top + height, left:left + width]
+        window_cells[top:top + height, left:left + width] = labels
+        tiles[...] = window_cells.reshape(n_rows, size, n_columns, size).transpose(0, 2, 1, 3)
+        return labels
+
+    @staticmethod
+    def _get_tiles_shape(n_width_blocks: int, n_height_blocks: int, tile_size: int) -> Tuple[int, int, int, int]:
+        """
+        :param n_width_blocks: The width of the whole grid in cells.
+        :param n_height_blocks: The height of the whole grid in cells.
+        :param tile_size: The width and height of a tile in cells.
+        :return: The shape of the tiles (rows of tiles, columns of tiles, tile height, tile width).
+        """
+        return -(-n_height_blocks // tile_size), -(-n_width_blocks // tile_size), tile_size, tile_size
+
+    @staticmethod
+    def _get_data_offset(header_length: int) -> int:
+        """
+        :param header_length: The length of the header in bytes.
+        :return: The offset of the first tile (the header is padded to a page boundary).
+        """
+        return -(-header_length // HEADER_ALIGNMENT) * HEADER_ALIGNMENT
@@ -0,0 +1,56 @@
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+@dataclass(frozen=True)
+class HTTPClientConfig:
+    """
+    :param pool_connections: The number of hosts to keep connection pools for.
+    :param pool_maxsize: The maximum number of kept-alive connections per host (should be >= the number of concurrent calls).
+    :param pool_block: If True, callers wait for a free connection instead of opening extra, non-pooled connections.
+    """
+    pool_connections: int = 4
+    pool_maxsize: int = 32
+    pool_block: bool = False
+
+
+class PooledSession(requests.Session):
+    """
+    Session shared by all threads making completions.
+    The openai client closes its sessions periodically, which would drop every pooled connection, so close is a no-op
+    and the pool is only released by shutdown.
+    """
+
+    def close(self) -> None:
+        """
+        Keeps the pooled connections alive when the client tries to recycle the session.
+        :return: None
+        """
+        return None
+
+    def shutdown(self) -> None:
+        """
+        Closes all pooled connections.
+        :return: None
+        """
+        super().close()
+
+
+def create_session(config: HTTPClientConfig) -> PooledSession:
+    """
+    Creates a session whose connections (and TLS sessions) are kept alive and reused across requests.
+    Retries are disabled on the adapter because they are handled by the retry policy of the manager.
+    :param config: The configuration of the connection pool.
+    :return: The session.
+    """
+    session = PooledSession()
+    adapter = HTTPAdapter(pool_connections=config.pool_connections, pool_maxsize=config.pool_maxsize,
+                          pool_block=config.pool_block, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+DEFAULT_HTTP_CLIENT_CONFIG = HTTPClientConfig()
@@ -0,0 +1,59 @@
+import argparse
+import json
+import time
+from typing import Dict
+
+import requests
+import urllib3
+
+from llms.http_client import HTTPClientConfig, create_session
+from llms.mock_llm_server import FaultConfig, MockLLMServer
+
+"""
+Measures the connection setup cost removed by the pooled session against the local stand-in server.
+HTTPS requires a certificate, e.g.:
+    openssl req -x509 -newkey rsa:2048 -nodes -keyout key.pem -out cert.pem -days 1 -subj /CN=localhost
+    python -m llms.http_client_benchmark --certfile cert.pem --keyfile key.pem
+"""
+
+REQUEST_BODY = json.dumps({"model": "gpt-4", "messages": [{"role": "user", "content": "Plan the first flight."}]})
+
+
+def run_benchmark(n_calls: int = 200, certfile: str = None, keyfile: str = None) -> Dict[str, Dict[str, float]]:
+    """
+    Makes the same number of completions with a new connection per call and with the pooled session.
+    :param n_calls: The number of calls made by each client.
+    :param certfile: If provided, the server uses HTTPS with this certificate.
+    :param keyfile: The private key of the certificate.
+    :return: Maps the client to its mean latency (ms) per call and the number of connections it opened.
+    """
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+    results = {}
+    with MockLLMServer(FaultConfig(), certfile=certfile, keyfile=keyfile) as server:
+        url = f"{server.api_base}/chat/completions"
+        pooled_session = create_session(HTTPClientConfig())
+        clients = {"new_connection_per_call": lambda: requests.post(url, data=REQUEST_BODY, verify=False),
+                   "pooled_session": lambda: pooled_session.post(url, data=REQUEST_BODY, verify=False)}
+        for name, make_call in clients.items():
+            n_connections_before = server.n_connections
+            start = time.perf_counter()
+            for _ in range(n_calls):
+                make_call().raise_for_status()
+            elapsed = time.perf_counter() - start
+            results[name] = {"ms_per_call": elapsed / n_calls * 1000,
+                             "connections": server.n_connections - n_connections_before}
+        pooled_session.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the pooled http client against per-call connections.")
+    parser.add_argument("--n-calls", type=int, default=200)
+    parser.add_argument("--certfile", default=None)
+    parser.add_argument("--keyfile", default=None)
+    args = parser.parse_args()
+    benchmark = run_benchmark(args.n_calls, args.certfile, args.keyfile)
+    for client_name, stats in benchmark.items():
+        print(f"{client_name}: {stats['ms_per_call']:.2f} ms/call, {stats['connections']} connections")
+    saved = benchmark["new_connection_per_call"]["ms_per_call"] - benchmark["pooled_session"]["ms_per_call"]
+    print(f"Connection setup removed per call: {saved:.2f} ms")
@@ -1,10 +1,23 @@
+import asyncio
+import json
+import logging
 import os
-from typing import TypeVar, Dict, List
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, TypeVar, Dict, List, Tuple
 
 import openai
 from dotenv import load_dotenv
+from openai.api_requestor import _thread_context
+from openai.error import APIConnectionError, APIError, RateLimitError, ServiceUnavailableError, Timeout, TryAgain
 
+from llms.http_client import DEFAULT_HTTP_CLIENT_CONFIG, HTTPClientConfig, PooledSession, create_session
 from llms.llm_models import OpenAIModel
+from llms.rate_limiter import RateLimiter, RequestPriority
+from llms.retry_policy import DEFAULT_RETRY_POLICY, LatencyTracker, RetryPolicy
+from llms.single_flight import SingleFlight
+from utils.metrics import COMPLETION_TOKENS, HEDGES, METRICS, PROMPT_TOKENS, RETRIES, SHARED_REQUESTS, TOKEN_BUCKETS
 
 from src.llms.token_calculator import TokenCalculator
 
@@ -18,42 +31,401 @@ assert OPEN_AI_ORG and OPEN_AI_KEY, f"Must supply value for {f'{OPEN_AI_ORG=}'.s
                                     f"and {f'{OPEN_AI_KEY=}'.split('=')[0]} in .env"
 openai.organization = OPEN_AI_ORG
 openai.api_key = OPEN_AI_KEY
+if os.environ.get("OPEN_AI_API_BASE"):
+    openai.api_base = os.environ["OPEN_AI_API_BASE"]
+
+RETRYABLE_ERRORS = (APIConnectionError, APIError, RateLimitError, ServiceUnavailableError, Timeout, TryAgain)
+RETRYABLE_API_STATUSES = range(500, 600)
+MAX_HEDGE_WORKERS = 8
 
 
 class LLMManager:
     """
     Interface for all AI utility classes.
     """
+    _latencies = LatencyTracker()
+    _hedge_executor: ThreadPoolExecutor = None
+    _rate_limiter: RateLimiter = None
+    _session: PooledSession = None
+    _session_lock = threading.Lock()
+    _single_flight = SingleFlight()
+
+    @classmethod
+    def set_rate_limiter(cls, rate_limiter: RateLimiter = None) -> None:
+        """
+        Sets the limiter that all completions in this process must be admitted by (None to disable).
+        :param rate_limiter: The rate limiter shared by all completions.
+        :return: None
+        """
+        cls._rate_limiter = rate_limiter
+
+    @classmethod
+    def configure_http_client(cls, config: HTTPClientConfig = DEFAULT_HTTP_CLIENT_CONFIG) -> PooledSession:
+        """
+        Replaces the long-lived session used for all completions (closing the connections of the previous one).
+        Threads switch to the new session on their next completion.
+        :param config: The configuration of the connection pool.
+        :return: The new session.
+        """
+        previous_session = cls._session
+        cls._session = create_session(config)
+        openai.requestssession = cls._session
+        if previous_session:
+            previous_session.shutdown()
+        return cls._session
+
+    @classmethod
+    def close_http_client(cls) -> None:
+        """
+        Closes the pooled connections. A new session is created by the next completion.
+        :return: None
+        """
+        if cls._session:
+            cls._session.shutdown()
+            cls._session = None
+            openai.requestssession = None
 
     @staticmethod
     def make_completion(prompt: str, temperature: float = 0, model: OpenAIModel = OpenAIModel.GPT4,
-                        conversation_history: List[Dict] = None) -> List[Dict]:
+                        conversation_history: List[Dict] = None, metric_labels: Dict = None,
+                        retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+                        priority: RequestPriority = RequestPriority.DEFAULT, functions: List[Dict] = None) -> List[Dict]:
         """
         Makes a request to completion a model
         :param prompt: The prompt to make completion for.
         :param temperature: The temperature to run the model at.
         :param model: The OpenAI model to use.
         :param conversation_history: Contains all the previous responses and messages between AI and Human
+        :param metric_labels: Additional labels (e.g. round) attached to the token usage metrics.
+        :param retry_policy: Controls the timeouts, retries and hedging of the request.
+        :param priority: The order in which the request is admitted by the rate limiter relative to other waiting requests.
+        :param functions: If provided, the model must respond by calling the first function (its arguments become the response).
         :return: The response from open AI.
         """
 
+        params, n_tokens = LLMManager._build_params(prompt, temperature, model, conversation_history, functions)
+        create = lambda: LLMManager._create_with_retries(params, retry_policy, n_tokens=n_tokens, priority=priority)
+        with METRICS.span("api_call"):
+            if temperature == 0:
+                res, is_shared = LLMManager._share_call(params, priority, retry_policy, create)
+            else:
+                res, is_shared = create(), False
+        return LLMManager._add_response(res, model, params["messages"], metric_labels, is_shared)
+
+    @staticmethod
+    async def make_completion_async(prompt: str, temperature: float = 0, model: OpenAIModel = OpenAIModel.GPT4,
+                                    conversation_history: List[Dict] = None, metric_labels: Dict = None,
+                                    retry_policy: RetryPolicy = DEFAULT_RETRY_POLICY,
+                                    priority: RequestPriority = RequestPriority.DEFAULT,
+                                    functions: List[Dict] = None) -> List[Dict]:
+        """
+        Same as make_completion but waits for the response without blocking the event loop.
+        Identical requests in flight from threads or coroutines share a single call.
+        :return: The conversation history containing the response.
+        """
+        params, n_tokens = LLMManager._build_params(prompt, temperature, model, conversation_history, functions)
+        create = lambda: LLMManager._create_with_retries(params, retry_policy, n_tokens=n_tokens, priority=priority)
+        with METRICS.span("api_call"):
+            if temperature == 0:
+                res, is_shared = await LLMManager._share_call_async(params, priority, retry_policy, create)
+            else:
+                res, is_shared = await asyncio.get_running_loop().run_in_executor(None, create), False
+        return LLMManager._add_response(res, model, params["messages"], metric_labels, is_shared)
+
+    @staticmethod
+    def _share_call(params: Dict, priority: RequestPriority, retry_policy: RetryPolicy,
+                    create: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Shares the call with identical requests in flight. Waiting on another caller's call is bounded by this request's own
+        deadline since the call follows the retry policy of the caller that made it.
+        :param params: The parameters of the request.
+        :param priority: The priority of the request.
+        :param retry_policy: The retry policy of the request.
+        :param create: Makes the call.
+        :return: The response and whether it was shared from another caller's call.
+        """
+        try:
+            return LLMManager._single_flight.do(LLMManager._get_request_key(params, priority), create,
+                                                timeout=retry_policy.deadline)
+        except TimeoutError:
+            raise Timeout(f"The shared request did not finish within the deadline of {retry_policy.deadline} seconds")
+
+    @staticmethod
+    async def _share_call_async(params: Dict, priority: RequestPriority, retry_policy: RetryPolicy,
+                                create: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Same as _share_call but waits without blocking the event loop.
+        :return: The response and whether it was shared from another caller's call.
+        """
+        try:
+            return await LLMManager._single_flight.do_async(LLMManager._get_request_key(params, priority), create,
+                                                            timeout=retry_policy.deadline)
+        except TimeoutError:
+            raise Timeout(f"The shared request did not finish within the deadline of {retry_policy.deadline} seconds")
+
+    @staticmethod
+    def _get_request_key(params: Dict, priority: RequestPriority) -> str:
+        """
+        Creates the key identical requests share a call on. The priority is part of the key so a request never waits on a
+        call that was admitted by the rate limiter at a lower priority.
+        :param params: The parameters of the request.
+        :param priority: The priority of the request.
+        :return: The key.
+        """
+        return SingleFlight.hash_request({**params, "priority": priority.name})
+
+    @staticmethod
+    def _build_params(prompt: str, temperature: float, model: OpenAIModel, conversation_history: List[Dict] = None,
+                      functions: List[Dict] = None) -> Tuple[Dict, int]:
+        """
+        Adds the prompt to the conversation and creates the parameters of the request.
+        :param prompt: The prompt to make completion for.
+        :param temperature: The temperature to run the model at.
+        :param model: The OpenAI model to use.
+        :param conversation_history: Contains all the previous responses and messages between AI and Human
+        :param functions: The functions the model must respond with (the first one is called).
+        :return: The parameters of the request and its estimated number of tokens (prompt and max completion).
+        """
         assert isinstance(model, OpenAIModel), f"Expected OpenAIModel to be passed in but got {model}."
 
         conversation_history = [] if not conversation_history else conversation_history
         conversation_history.append({"role": "user", "content": prompt})
 
-        if model == OpenAIModel.GPT4:
-            all_prompts = [p["content"] for p in conversation_history]
-            max_tokens = TokenCalculator.calculate_max_tokens(OpenAIModel.GPT4, "".join(all_prompts))
-        else:
-            max_tokens = model.get_max_tokens()
+        with METRICS.span("token_estimation"):
+            all_prompts = "".join([p["content"] for p in conversation_history])
+            if functions:
+                all_prompts += json.dumps(functions)
+            prompt_tokens = TokenCalculator.estimate_num_tokens(all_prompts, model)
+            max_tokens = TokenCalculator.calculate_max_tokens(model, all_prompts, prompt_tokens=prompt_tokens)
+        if max_tokens <= 0:
+            raise ValueError(f"Prompt of {prompt_tokens} tokens leaves no room for the completion in {model.value}.")
 
         params = {
             "max_tokens": max_tokens,
             "temperature": temperature,
             "model": model.value,
             "messages": conversation_history}
-        res = openai.ChatCompletion.create(**params)
-        res_text = res.choices[0]["message"]["content"]
+        if functions:
+            params["functions"] = functions
+            params["function_call"] = {"name": functions[0]["name"]}
+        return params, prompt_tokens + max_tokens
+
+    @staticmethod
+    def _add_response(res: AIObject, model: OpenAIModel, conversation_history: List[Dict], metric_labels: Dict = None,
+                      is_shared: bool = False) -> List[Dict]:
+        """
+        Adds the response to the conversation, recording its token usage unless it was shared from another caller's request.
+        :param res: The response from open AI.
+        :param model: The model used for the completion.
+        :param conversation_history: The conversation the request was made with.
+        :param metric_labels: Additional labels to attach to the metrics.
+        :param is_shared: Whether the response came from an identical request made by another caller.
+        :return: The conversation history containing the response.
+        """
+        message = res.choices[0]["message"]
+        res_text = message["function_call"]["arguments"] if message.get("function_call") else message["content"]
+        if is_shared:
+            METRICS.increment(SHARED_REQUESTS)
+        else:
+            LLMManager._record_usage(res, model, metric_labels)
         conversation_history.append({"role": "assistant", "content": res_text})
         return conversation_history
+
+    @staticmethod
+    def _create_with_retries(params: Dict, policy: RetryPolicy, n_tokens: int = 0,
+                             priority: RequestPriority = RequestPriority.DEFAULT) -> AIObject:
+        """
+        Makes the request, retrying with jittered exponential backoff when a retryable error occurs.
+        Each attempt waits to be admitted by the rate limiter (if any) before its timeout and hedge clocks start; the wait
+        counts against the deadline of the policy.
+        :param params: The parameters of the request.
+        :param policy: Controls the timeouts, retries and hedging of the request.
+        :param n_tokens: The estimated number of tokens used by the request (prompt and max completion).
+        :param priority: The priority of the request used by the rate limiter.
+        :return: The response from open AI.
+        """
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            LLMManager._acquire(n_tokens, priority, LLMManager._get_remaining(policy, start, attempt))
+            timeout = policy.request_timeout
+            if policy.deadline is not None:
+                timeout = min(timeout, LLMManager._get_remaining(policy, start, attempt))
+            try:
+                return LLMManager._create_hedged(params, timeout, policy, n_tokens, priority)
+            except RETRYABLE_ERRORS as e:
+                if not LLMManager._is_retryable(e) or attempt >= policy.max_retries:
+                    raise
+                delay = max(policy.get_delay(attempt), LLMManager._get_retry_after(e))
+                if policy.deadline is not None and time.monotonic() - start + delay >= policy.deadline:
+                    raise
+                if isinstance(e, RateLimitError) and LLMManager._rate_limiter:
+                    LLMManager._rate_limiter.pause(delay)
+                METRICS.increment(RETRIES, error=type(e).__name__)
+                logging.warning(f"Request failed ({type(e).__name__}: {e}). Retrying in {round(delay, 2)} seconds.")
+                time.sleep(delay)
+                attempt += 1
+
+    @staticmethod
+    def _create_hedged(params: Dict, timeout: float, policy: RetryPolicy, n_tokens: int,
+                       priority: RequestPriority) -> AIObject:
+        """
+        Makes the (admitted) request and, if hedging is enabled and the request is slower than usual, fires a second
+        identical request once it is admitted by the rate limiter. The first successful response is returned. The losing
+        request is cancelled if it has not started; otherwise (requests in flight cannot be interrupted) it runs to its
+        timeout in the background and its response is ignored.
+        :param params: The parameters of the request.
+        :param timeout: The number of seconds to wait for the request.
+        :param policy: Controls the hedging of the request.
+        :param n_tokens: The estimated number of tokens used by the request.
+        :param priority: The priority of the request used by the rate limiter.
+        :return: The response from open AI.
+        """
+        hedge_after = LLMManager._latencies.percentile(policy.hedge_percentile, policy.hedge_min_samples) \
+            if policy.hedge_percentile else None
+        if hedge_after is None or hedge_after >= timeout:
+            return LLMManager._timed_create(params, timeout, n_tokens)
+
+        executor = LLMManager._get_hedge_executor()
+        pending = {executor.submit(LLMManager._timed_create, params, timeout, n_tokens)}
+        done, _ = wait(pending, timeout=hedge_after)
+        if not done:
+            METRICS.increment(HEDGES)
+            pending.add(executor.submit(LLMManager._timed_create, params, timeout - hedge_after, n_tokens, priority,
+                                        needs_admission=True))
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    @staticmethod
+    def _timed_create(params: Dict, timeout: float, n_tokens: int = 0,
+                      priority: RequestPriority = RequestPriority.DEFAULT, needs_admission: bool = False) -> AIObject:
+        """
+        Makes a single request and records its latency.
+        :param params: The parameters of the request.
+        :param timeout: The number of seconds to wait for the request (including the admission if needed).
+        :param n_tokens: The estimated number of tokens used by the request.
+        :param priority: The priority of the request used by the rate limiter.
+        :param needs_admission: Whether the request must first be admitted by the rate limiter.
+        :return: The response from open AI.
+        """
+        LLMManager._bind_session()
+        if needs_admission:
+            timeout -= LLMManager._acquire(n_tokens, priority, timeout)
+            if timeout <= 0:
+                raise Timeout("No time left for the request after its admission.")
+        rate_limiter = LLMManager._rate_limiter
+        start = time.perf_counter()
+        res = openai.ChatCompletion.create(**params, request_timeout=timeout)
+        LLMManager._latencies.record(time.perf_counter() - start)
+        if rate_limiter and "usage" in res:
+            rate_limiter.adjust(n_tokens, res["usage"].get("total_tokens", n_tokens))
+        return res
+
+    @staticmethod
+    def _acquire(n_tokens: int, priority: RequestPriority, timeout: float = None) -> float:
+        """
+        Waits to be admitted by the rate limiter (if any).
+        :param n_tokens: The estimated number of tokens used by the request.
+        :param priority: The priority of the request used by the rate limiter.
+        :param timeout: The maximum number of seconds to wait (None to wait indefinitely).
+        :return: The number of seconds spent waiting.
+        """
+        rate_limiter = LLMManager._rate_limiter
+        if not rate_limiter:
+            return 0
+        with METRICS.span("rate_limit_wait"):
+            try:
+                return rate_limiter.acquire(n_tokens, priority, timeout=timeout)
+            except TimeoutError as e:
+                raise Timeout(f"Request was not admitted by the rate limiter: {e}")
+
+    @staticmethod
+    def _get_remaining(policy: RetryPolicy, start: float, attempt: int) -> float:
+        """
+        :param policy: The retry policy of the request.
+        :param start: The monotonic time the first attempt started.
+        :param attempt: The number of the attempt.
+        :return: The seconds left before the deadline (None if there is no deadline).
+        :raises Timeout: If the deadline was exceeded.
+        """
+        if policy.deadline is None:
+            return None
+        remaining = policy.deadline - (time.monotonic() - start)
+        if remaining <= 0:
+            raise Timeout(f"Deadline of {policy.deadline} seconds exceeded after {attempt} retries.")
+        return remaining
+
+    @classmethod
+    def _bind_session(cls) -> None:
+        """
+        Makes the current thread use the shared session (creating it the first time). The openai client caches a session
+        per thread, which would otherwise keep using a session that was replaced or closed.
+        :return: None
+        """
+        if cls._session is None:
+            with cls._session_lock:
+                if cls._session is None:
+                    cls.configure_http_client()
+        session = cls._session
+        if getattr(_thread_context, "session", None) is not session:
+            _thread_context.session = session
+            _thread_context.session_create_time = time.time()
+
+    @staticmethod
+    def _is_retryable(e: Exception) -> bool:
+        """
+        :param e: An error of the RETRYABLE_ERRORS types.
+        :return: Whether the request should be retried. Generic API errors are only retried for server (5xx) errors.
+        """
+        if isinstance(e, APIError):
+            return e.http_status in RETRYABLE_API_STATUSES
+        return True
+
+    @staticmethod
+    def _get_retry_after(e: Exception) -> float:
+        """
+        Gets the number of seconds the server asked to wait before retrying.
+        :param e: The error returned by the server.
+        :return: The number of seconds to wait (0 if not specified).
+        """
+        headers = getattr(e, "headers", None) or {}
+        try:
+            return float(headers.get("retry-after", 0))
+        except (TypeError, ValueError):
+            return 0
+
+    @classmethod
+    def _get_hedge_executor(cls) -> ThreadPoolExecutor:
+        """
+        Gets the thread pool used to run hedged requests, creating it the first time.
+        :return: The thread pool.
+        """
+        if cls._hedge_executor is None:
+            cls._hedge_executor = ThreadPoolExecutor(max_workers=MAX_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+        return cls._hedge_executor
+
+    @staticmethod
+    def _record_usage(res: AIObject, model: OpenAIModel, metric_labels: Dict = None) -> None:
+        """
+        Records the prompt and completion tokens reported by the API.
+        :param res: The response from open AI.
+        :param model: The model used for the completion.
+        :param metric_labels: Additional labels to attach to the metrics.
+        :return: None
+        """
+        if not METRICS.enabled:
+            return
+        usage = res.get("usage", {}) if hasattr(res, "get") else {}
+        labels = {"model": model.value, **(metric_labels or {})}
+        if "prompt_tokens" in usage:
+            METRICS.observe(PROMPT_TOKENS, usage["prompt_tokens"], buckets=TOKEN_BUCKETS, **labels)
+        if "completion_tokens" in usage:
+            METRICS.observe(COMPLETION_TOKENS, usage["completion_tokens"], buckets=TOKEN_BUCKETS, **labels)
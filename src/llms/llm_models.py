@@ -7,15 +7,26 @@ class OpenAIModel(Enum):
     """
     GPT4 = "gpt-4"
     GPT3 = "gpt-3.5-turbo-1106"
-    _token_map = {
-        GPT3: 4096,
-        GPT4: 8192
-    }
 
     def get_max_tokens(self) -> int:
         """
-        Returns the max number of tokens for given model.
-        :param model: The model to return max tokens for.
+        Returns the max number of tokens (prompt and completion) for given model.
         :return: Number of max tokens.
         """
-        return self._token_map.value[self.value]
+        return _MODEL_TOKEN_LIMITS[self.value]
+
+    def get_max_completion_tokens(self) -> int:
+        """
+        Returns the max number of tokens the model can generate in a single completion.
+        :return: Number of max completion tokens.
+        """
+        return _MODEL_COMPLETION_LIMITS.get(self.value, self.get_max_tokens())
+
+
+_MODEL_TOKEN_LIMITS = {
+    OpenAIModel.GPT3.value: 16385,
+    OpenAIModel.GPT4.value: 8192
+}
+_MODEL_COMPLETION_LIMITS = {
+    OpenAIModel.GPT3.value: 4096
+}
@@ -0,0 +1,178 @@
+import argparse
+import json
+import random
+import ssl
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+"""
+Local stand-in for the OpenAI chat completion endpoint that can inject failures and slow responses.
+Point the manager at it by setting OPEN_AI_API_BASE=http://localhost:<port>/v1.
+"""
+
+DEFAULT_COMPLETION = "<reasoning>Mock reasoning.</reasoning>"
+
+
+@dataclass
+class FaultConfig:
+    """
+    :param completion: The text returned as the assistant's message (or as the arguments when a function call is requested).
+    :param latency: The number of seconds to wait before responding.
+    :param failure_rate: The probability of responding with an error.
+    :param failure_status: The status returned when a failure is injected (e.g. 429, 500, 503).
+    :param slow_rate: The probability of a response being slow (tail latency).
+    :param slow_latency: The number of seconds a slow response takes.
+    """
+    completion: str = DEFAULT_COMPLETION
+    latency: float = 0
+    failure_rate: float = 0
+    failure_status: int = 500
+    slow_rate: float = 0
+    slow_latency: float = 5
+
+
+class MockLLMServer:
+    """
+    Threaded HTTP server answering /chat/completions requests according to a fault configuration.
+    """
+
+    def __init__(self, config: FaultConfig = None, host: str = "127.0.0.1", port: int = 0, certfile: str = None,
+                 keyfile: str = None):
+        """
+        Creates the server (port 0 picks a free port).
+        :param config: Controls the responses and injected faults.
+        :param host: The host to bind to.
+        :param port: The port to bind to.
+        :param certfile: If provided, serves HTTPS using this certificate.
+        :param keyfile: The private key of the certificate.
+        """
+        self.config = config if config else FaultConfig()
+        self.n_requests = 0
+        self.n_connections = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._create_handler())
+        self._server.daemon_threads = True
+        self.scheme = "http"
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+            self.scheme = "https"
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def api_base(self) -> str:
+        """
+        :return: The url to use as the api base of the client.
+        """
+        host, port = self._server.server_address[:2]
+        return f"{self.scheme}://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        """
+        Starts serving in a background thread.
+        :return: The server.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the server.
+        :return: None
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def _create_handler(self):
+        """
+        Creates the request handler bound to this server.
+        :return: The request handler class.
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self) -> None:
+                super().setup()
+                with server._lock:
+                    server.n_connections += 1
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.n_requests += 1
+                config = server.config
+                latency = config.slow_latency if random.random() < config.slow_rate else config.latency
+                if latency:
+                    time.sleep(latency)
+                if random.random() < config.failure_rate:
+                    body = {"error": {"message": "Injected failure", "type": "server_error"}}
+                    self._respond(config.failure_status, body)
+                    return
+                n_prompt_tokens = sum(len(m.get("content", "").split()) for m in request.get("messages", []))
+                body = {
+                    "id": f"mock-{server.n_requests}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": config.completion},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": n_prompt_tokens, "completion_tokens": len(config.completion.split()),
+                              "total_tokens": n_prompt_tokens + len(config.completion.split())}
+                }
+                function_call = request.get("function_call")
+                if isinstance(function_call, dict):
+                    body["choices"][0]["message"] = {"role": "assistant", "content": None,
+                                                     "function_call": {"name": function_call["name"],
+                                                                       "arguments": config.completion}}
+                    body["choices"][0]["finish_reason"] = "function_call"
+                self._respond(200, body)
+
+            def _respond(self, status: int, body: dict) -> None:
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args) -> None:
+                return None
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a fault-injecting stand-in for the chat completion API.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--completion-file", default=None)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--failure-rate", type=float, default=0)
+    parser.add_argument("--failure-status", type=int, default=500)
+    parser.add_argument("--slow-rate", type=float, default=0)
+    parser.add_argument("--slow-latency", type=float, default=5)
+    parser.add_argument("--certfile", default=None)
+    parser.add_argument("--keyfile", default=None)
+    args = parser.parse_args()
+    completion = open(args.completion_file).read() if args.completion_file else DEFAULT_COMPLETION
+    mock_server = MockLLMServer(FaultConfig(completion=completion, latency=args.latency, failure_rate=args.failure_rate,
+                                            failure_status=args.failure_status, slow_rate=args.slow_rate,
+                                            slow_latency=args.slow_latency), port=args.port,
+                                 certfile=args.certfile, keyfile=args.keyfile)
+    print(f"Serving mock completions at {mock_server.api_base}")
+    mock_server._server.serve_forever()
@@ -0,0 +1,66 @@
+import logging
+import threading
+from typing import Callable, Dict, List, Sequence
+
+from llms.llm_models import OpenAIModel
+from utils.metrics import METRICS
+
+from src.llms.llm_manager import LLMManager
+
+CASCADE_COMPLETIONS = "model_cascade_completions_total"
+CASCADE_ESCALATIONS = "model_cascade_escalations_total"
+
+
+class ModelCascade:
+    """
+    Tries the cheapest model first and escalates to the next model only when the response fails validation.
+    """
+
+    def __init__(self, models: Sequence[OpenAIModel] = (OpenAIModel.GPT3, OpenAIModel.GPT4)):
+        """
+        Creates the cascade.
+        :param models: The models to try, from the cheapest to the strongest.
+        """
+        assert len(models) > 0, "Must provide at least one model."
+        self.models = list(models)
+        self.n_completions = 0
+        self.n_escalations = 0
+        self._lock = threading.Lock()
+
+    @property
+    def escalation_rate(self) -> float:
+        """
+        :return: The fraction of completions that were escalated past the first model.
+        """
+        return self.n_escalations / self.n_completions if self.n_completions else 0
+
+    def make_completion(self, prompt: str, conversation_history: List[Dict], is_valid: Callable[[str], bool],
+                        **completion_params) -> List[Dict]:
+        """
+        Completes the prompt with the first model whose response is valid (the last model's response is always accepted).
+        :param prompt: The prompt to make completion for.
+        :param conversation_history: Contains all the previous responses and messages between AI and Human.
+        :param is_valid: Returns whether the response of a model can be used.
+        :param completion_params: Any additional parameters to the completion.
+        :return: The conversation history with the accepted response.
+        """
+        escalated = False
+        for i, model in enumerate(self.models):
+            is_last_model = i == len(self.models) - 1
+            try:
+                history = LLMManager.make_completion(prompt, model=model, conversation_history=list(conversation_history),
+                                                     **completion_params)
+                if is_last_model or is_valid(history[-1]["content"]):
+                    break
+                logging.info(f"Response from {model.value} failed validation.")
+            except Exception:
+                if is_last_model:
+                    raise
+                logging.exception(f"Completion with {model.value} failed.")
+            METRICS.increment(CASCADE_ESCALATIONS, from_model=model.value)
+            escalated = True
+        with self._lock:
+            self.n_completions += 1
+            self.n_escalations += int(escalated)
+        METRICS.increment(CASCADE_COMPLETIONS, model=model.value)
+        return history
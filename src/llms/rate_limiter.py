@@ -0,0 +1,168 @@
+import fcntl
+import heapq
+import itertools
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass
+from enum import IntEnum
+from typing import List, Tuple
+
+SECONDS_PER_MINUTE = 60
+
+
+class RequestPriority(IntEnum):
+    """
+    The order in which waiting requests are admitted (lowest first).
+    """
+    LIVE = 0
+    DEFAULT = 1
+    BACKGROUND = 2
+
+
+@dataclass
+class _BucketState:
+    """
+    :param requests: The number of requests currently available.
+    :param tokens: The number of tokens currently available.
+    :param updated_at: The (wall clock) time the buckets were last refilled.
+    :param paused_until: No requests are admitted before this time (set after the server rate limits us).
+    """
+    requests: float
+    tokens: float
+    updated_at: float
+    paused_until: float = 0
+
+    def try_consume(self, now: float, n_tokens: int, requests_per_minute: int, tokens_per_minute: int) -> float:
+        """
+        Refills both buckets and consumes a request and the tokens if both are available.
+        :param now: The current time.
+        :param n_tokens: The number of tokens the request will use.
+        :param requests_per_minute: The capacity and refill rate of the request bucket.
+        :param tokens_per_minute: The capacity and refill rate of the token bucket.
+        :return: 0 if the request was admitted, else the number of seconds until it could be.
+        """
+        elapsed = max(0.0, now - self.updated_at)
+        self.requests = min(requests_per_minute, self.requests + elapsed * requests_per_minute / SECONDS_PER_MINUTE)
+        self.tokens = min(tokens_per_minute, self.tokens + elapsed * tokens_per_minute / SECONDS_PER_MINUTE)
+        self.updated_at = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        missing_requests = 1 - self.requests
+        missing_tokens = n_tokens - self.tokens
+        if missing_requests <= 0 and missing_tokens <= 0:
+            self.requests -= 1
+            self.tokens -= n_tokens
+            return 0
+        return max(missing_requests * SECONDS_PER_MINUTE / requests_per_minute,
+                   missing_tokens * SECONDS_PER_MINUTE / tokens_per_minute)
+
+
+class RateLimiter:
+    """
+    Token-bucket scheduler admitting requests within a requests-per-minute and a tokens-per-minute budget.
+    Waiting requests are admitted in priority order (FIFO within a priority).
+    If a state path is given, the buckets are shared by all processes using that path (guarded by a file lock).
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, state_path: str = None):
+        """
+        Creates the limiter with full buckets.
+        :param requests_per_minute: The number of requests allowed per minute.
+        :param tokens_per_minute: The number of tokens (prompt + max completion) allowed per minute.
+        :param state_path: Path to the file storing the shared bucket state for cross-process limiting.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.state_path = state_path
+        self._state = _BucketState(requests=requests_per_minute, tokens=tokens_per_minute, updated_at=time.time())
+        self._condition = threading.Condition()
+        self._waiters: List[Tuple[int, int]] = []
+        self._counter = itertools.count()
+
+    def acquire(self, n_tokens: int, priority: RequestPriority = RequestPriority.DEFAULT, timeout: float = None) -> float:
+        """
+        Blocks until the request may be sent.
+        :param n_tokens: The estimated number of tokens the request will use.
+        :param priority: The priority of the request.
+        :param timeout: The maximum number of seconds to wait (None to wait indefinitely).
+        :return: The number of seconds spent waiting.
+        :raises TimeoutError: If the request was not admitted within the timeout.
+        """
+        n_tokens = min(n_tokens, self.tokens_per_minute)
+        ticket = (int(priority), next(self._counter))
+        start = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    wait_time = None
+                    if self._waiters[0] == ticket:
+                        wait_time = self._update_state(lambda state: state.try_consume(time.time(), n_tokens,
+                                                                                         self.requests_per_minute,
+                                                                                         self.tokens_per_minute))
+                        if wait_time <= 0:
+                            return time.monotonic() - start
+                    if timeout is not None:
+                        remaining = timeout - (time.monotonic() - start)
+                        if remaining <= 0:
+                            raise TimeoutError(f"Not admitted within {timeout} seconds.")
+                        wait_time = remaining if wait_time is None else min(wait_time, remaining)
+                    self._condition.wait(wait_time)
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+
+    def adjust(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """
+        Corrects the token bucket once the actual usage of a request is known.
+        :param estimated_tokens: The number of tokens acquired for the request.
+        :param actual_tokens: The number of tokens the request actually used.
+        :return: None
+        """
+        difference = min(estimated_tokens, self.tokens_per_minute) - actual_tokens
+
+        def refund(state: _BucketState) -> None:
+            state.tokens = min(self.tokens_per_minute, state.tokens + difference)
+
+        with self._condition:
+            self._update_state(refund)
+            self._condition.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stops admitting requests for the given time (e.g. after the server responded with a 429).
+        :param seconds: The number of seconds to pause for.
+        :return: None
+        """
+        paused_until = time.time() + seconds
+
+        def update_pause(state: _BucketState) -> None:
+            state.paused_until = max(state.paused_until, paused_until)
+
+        with self._condition:
+            self._update_state(update_pause)
+
+    def _update_state(self, update):
+        """
+        Applies the update to the bucket state (the shared state if a state path is set).
+        :param update: Function receiving the state and returning the result.
+        :return: The result of the update.
+        """
+        if not self.state_path:
+            return update(self._state)
+        with open(self.state_path, "a+") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.seek(0)
+                content = file.read()
+                state = _BucketState(**json.loads(content)) if content else self._state
+                result = update(state)
+                file.seek(0)
+                file.truncate()
+                json.dump(asdict(state), file)
+                file.flush()
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+        return result
@@ -0,0 +1,74 @@
+import random
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    :param request_timeout: The number of seconds to wait for a single request before abandoning it.
+    :param max_retries: The number of times a request is retried after a retryable error.
+    :param base_delay: The delay (seconds) before the first retry, doubled for every following retry.
+    :param max_delay: The upper bound of the delay between retries.
+    :param deadline: The total number of seconds allowed for a completion including all retries (None for no deadline).
+    :param hedge_percentile: If provided, a second identical request is sent once the first has been in flight longer than
+                             this percentile of recent latencies; the first response to arrive is used.
+    :param hedge_min_samples: The number of latency samples needed before hedging is enabled.
+    """
+    request_timeout: float = 120
+    max_retries: int = 3
+    base_delay: float = 1
+    max_delay: float = 30
+    deadline: Optional[float] = None
+    hedge_percentile: Optional[float] = None
+    hedge_min_samples: int = 10
+
+    def get_delay(self, attempt: int) -> float:
+        """
+        Calculates the delay before the given retry using exponential backoff with full jitter.
+        :param attempt: The number of the retry (starting at 0).
+        :return: The number of seconds to wait.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class LatencyTracker:
+    """
+    Keeps a window of recent request latencies to decide when to hedge a request.
+    """
+
+    def __init__(self, window_size: int = 200):
+        """
+        Creates an empty tracker.
+        :param window_size: The number of most recent latencies to keep.
+        """
+        self._latencies = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        """
+        Records the latency of a successful request.
+        :param latency: The number of seconds the request took.
+        :return: None
+        """
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, percentile: float, min_samples: int = 1) -> Optional[float]:
+        """
+        Gets the latency at the given percentile.
+        :param percentile: The percentile between 0 and 100.
+        :param min_samples: The number of samples needed to return a value.
+        :return: The latency at the percentile or None if there are too few samples.
+        """
+        with self._lock:
+            if len(self._latencies) < max(min_samples, 1):
+                return None
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, int(round(percentile / 100 * (len(latencies) - 1))))
+        return latencies[index]
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
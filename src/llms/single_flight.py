@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import json
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class SingleFlight:
+    """
+    Shares one call between concurrent callers with the same key: the first caller (the leader) makes the call and every
+    caller arriving before it finishes waits for its result instead of making the call again. Threads and coroutines can
+    wait on the same call. Nothing is kept once the call finishes, so this is not a cache.
+    """
+
+    def __init__(self):
+        """
+        Creates an empty group of calls.
+        """
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def hash_request(params: Dict) -> str:
+        """
+        Creates the key of a request.
+        :param params: The parameters of the request (must be json serializable).
+        :return: The hash of the parameters.
+        """
+        return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Calls the function unless a call with the same key is in flight, in which case its result is awaited.
+        :param key: The key of the call.
+        :param fn: Makes the call.
+        :param timeout: The maximum number of seconds to wait for another caller's call (None to wait until it finishes).
+        :return: The result and whether it was shared from another caller's call.
+        :raises TimeoutError: If another caller's call did not finish within the timeout (it continues for its other callers).
+        """
+        future, is_leader = self._join(key)
+        if is_leader:
+            self._run(key, fn, future)
+            return future.result(), False
+        try:
+            return future.result(timeout=timeout), True
+        except FutureTimeoutError:
+            raise TimeoutError(f"The shared call did not finish within {timeout} seconds")
+
+    async def do_async(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Same as do but waits without blocking the event loop (the leader runs the function on the default executor).
+        Cancelling a waiting coroutine only stops its wait, the call continues for the other callers.
+        :param key: The key of the call.
+        :param fn: Makes the (blocking) call.
+        :param timeout: The maximum number of seconds to wait for another caller's call (None to wait until it finishes).
+        :return: The result and whether it was shared from another caller's call.
+        :raises TimeoutError: If another caller's call did not finish within the timeout (it continues for its other callers).
+        """
+        future, is_leader = self._join(key)
+        if is_leader:
+            asyncio.get_running_loop().run_in_executor(None, self._run, key, fn, future)
+            return await asyncio.shield(asyncio.wrap_future(future)), False
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout), True
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"The shared call did not finish within {timeout} seconds")
+
+    def in_flight(self) -> int:
+        """
+        :return: The number of calls currently in flight.
+        """
+        with self._lock:
+            return len(self._calls)
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        """
+        Gets the call in flight for the key, registering a new one if there is none.
+        :param key: The key of the call.
+        :return: The future of the call and whether the caller is its leader.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            future.set_running_or_notify_cancel()  # waiters may no longer cancel the shared call
+            self._calls[key] = future
+            return future, True
+
+    def _run(self, key: str, fn: Callable[[], Any], future: Future) -> None:
+        """
+        Makes the call and hands its result (or error) to every waiter.
+        :param key: The key of the call.
+        :param fn: Makes the call.
+        :param future: Receives the result of the call.
+        :return: None
+        """
+        try:
+            result = fn()
+        except BaseException as e:
+            with self._lock:
+                self._calls.pop(key, None)
+            future.set_exception(e)
+            return
+        with self._lock:
+            self._calls.pop(key, None)
+        future.set_result(result)
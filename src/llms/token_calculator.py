@@ -1,25 +1,32 @@
+from typing import Dict
+
 import tiktoken
 
 from llms.llm_models import OpenAIModel
+from utils.metrics import CACHE_HITS, CACHE_MISSES, METRICS
 
 TOKENS_2_WORDS_CONVERSION = (3 / 4)  # open ai's rule of thumb for approximating tokens from number of words
+CHARS_PER_TOKEN = 4  # open ai's rule of thumb for approximating tokens from number of characters
 MAX_TOKENS_BUFFER = 400
 MAX_TOKENS_DEFAULT = 2000
 
 
 class TokenCalculator:
+    _encodings: Dict[str, tiktoken.Encoding] = {}
 
     @staticmethod
-    def calculate_max_tokens(model: OpenAIModel, prompt: str) -> int:
+    def calculate_max_tokens(model: OpenAIModel, prompt: str, prompt_tokens: int = None) -> int:
         """
         Gets the token limit for the given model with the given max tokens for completion
         :param model: The model used to predict on prompt.
         :param prompt: The prompt being given to model for completion.
+        :param prompt_tokens: The number of tokens in the prompt if already calculated.
         :return: The max token allowed for given model and prompt.
         """
         model_token_limit = model.get_max_tokens()
-        prompt_tokens = TokenCalculator.estimate_num_tokens(prompt, model)
-        return model_token_limit - prompt_tokens - MAX_TOKENS_BUFFER
+        if prompt_tokens is None:
+            prompt_tokens = TokenCalculator.estimate_num_tokens(prompt, model)
+        return min(model_token_limit - prompt_tokens - MAX_TOKENS_BUFFER, model.get_max_completion_tokens())
 
     @staticmethod
     def estimate_num_tokens(content: str, model: OpenAIModel) -> int:
@@ -31,17 +38,34 @@ class TokenCalculator:
         :return: The approximate number of tokens
         """
         try:
-            encoding = tiktoken.encoding_for_model(model.value)
+            encoding = TokenCalculator.get_encoding(model)
             num_tokens = len(encoding.encode(content))
             return num_tokens
         except Exception:
             return TokenCalculator.rough_estimate_num_tokens(content)
 
+    @staticmethod
+    def get_encoding(model: OpenAIModel) -> tiktoken.Encoding:
+        """
+        Gets the tokenizer for the model, loading it only the first time it is requested.
+        :param model: The model that will be doing the tokenization.
+        :return: The encoding used by the model.
+        """
+        encoding = TokenCalculator._encodings.get(model.value)
+        if encoding is not None:
+            METRICS.increment(CACHE_HITS, cache="encoding")
+            return encoding
+        METRICS.increment(CACHE_MISSES, cache="encoding")
+        encoding = tiktoken.encoding_for_model(model.value)
+        TokenCalculator._encodings[model.value] = encoding
+        return encoding
+
     @staticmethod
     def rough_estimate_num_tokens(content: str) -> int:
         """
         Gives a rough estimate the number of tokens that some content will be tokenized into using the 4/3 rule used by open ai
+        (or the 4 characters per token rule if larger, e.g. for lists of cells without spaces)
         :param content: The content to be tokenized
         :return: The approximate number of tokens
         """
-        return round(len(content.split()) * (1 / TOKENS_2_WORDS_CONVERSION))
+        return round(max(len(content.split()) * (1 / TOKENS_2_WORDS_CONVERSION), len(content) / CHARS_PER_TOKEN))
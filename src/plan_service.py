@@ -0,0 +1,461 @@
+import argparse
+import json
+import logging
+import math
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+from core.distance_field import StationDistanceField
+from core.drone_variables import DroneVariables
+from llms.llm_models import OpenAIModel
+from llms.token_calculator import TokenCalculator
+from prompts.prompt_builder import PromptBudgetExceeded
+from prompts.structured_output import ResponseMode
+from src.core.drone_plan import DronePlan
+from src.core.plan_generator import GenerationCancelled, PlanGenerator
+from src.llms.llm_manager import LLMManager
+from utils.metrics import METRICS, SECONDS_BUCKETS
+
+"""
+Long-running HTTP service generating plans, so requests skip process startup and share warm caches (token encodings,
+pooled connections to the API, distance fields and the conversations of the missions).
+    python plan_service.py --port 8000 --workers 4 --queue-size 16
+    POST /missions                          {"variables": {...}, "response_mode": "xml", "deadline_seconds": 120}
+    POST /missions/<mission_id>/adaptations {"plan_adaptation": "...", "current_location_of_drones": {"Red": [3, 4]}, ...}
+    GET  /health, GET /metrics
+Requests beyond the queue are rejected with 429 and a Retry-After header; requests that miss their deadline get 504.
+"""
+
+SERVICE_REQUESTS = "plan_service_requests_total"
+QUEUE_SECONDS = "plan_service_queue_seconds"
+MISSIONS_PATH = "missions"
+ADAPTATIONS_PATH = "adaptations"
+
+
+class BadRequest(Exception):
+    """
+    Raised when the body of a request is missing fields or contains invalid values.
+    """
+
+
+class UnknownMission(Exception):
+    """
+    Raised when an adaptation refers to a mission that does not exist.
+    """
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a request is not completed before its deadline.
+    """
+
+
+@dataclass
+class ServiceConfig:
+    """
+    :param host: The host to bind to.
+    :param port: The port to bind to (0 picks a free port).
+    :param n_workers: The number of plans generated at once.
+    :param queue_size: The number of requests that may wait for a worker before new ones are rejected.
+    :param deadline_seconds: The default (and maximum) number of seconds a request may take, including its time queued.
+    :param max_missions: The number of missions whose generator (and conversation) is kept for adaptations.
+    """
+    host: str = "127.0.0.1"
+    port: int = 8000
+    n_workers: int = 4
+    queue_size: int = 16
+    deadline_seconds: float = 120
+    max_missions: int = 128
+
+
+@dataclass
+class _Job:
+    """
+    A request waiting for or being processed by a worker.
+    """
+    run: Callable[[threading.Event], Dict]
+    deadline: float
+    enqueued: float = field(default_factory=time.monotonic)
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    done: threading.Event = field(default_factory=threading.Event)
+    result: Optional[Dict] = None
+    error: Optional[BaseException] = None
+
+
+@dataclass
+class _Mission:
+    """
+    A mission whose plan can be adapted; its generator is used by one request at a time.
+    """
+    plan_generator: PlanGenerator
+    distance_field: StationDistanceField
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class PlanService:
+    """
+    Serves plan generation over HTTP with a bounded queue in front of a fixed pool of workers.
+    """
+
+    def __init__(self, config: ServiceConfig = None, **generator_params):
+        """
+        Creates the service.
+        :param config: The configuration of the service.
+        :param generator_params: Any additional parameters to each plan generator (e.g. retry_policy).
+        """
+        self.config = config if config else ServiceConfig()
+        self.generator_params = generator_params
+        self.n_rejected = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=self.config.queue_size)
+        self._missions: "OrderedDict[str, _Mission]" = OrderedDict()
+        self._missions_lock = threading.Lock()
+        self._job_seconds = self.config.deadline_seconds / 10
+        self._workers: List[threading.Thread] = []
+        self._server = ThreadingHTTPServer((self.config.host, self.config.port), self._create_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """
+        :return: The base url of the service.
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "PlanService":
+        """
+        Warms the caches, starts the workers and serves requests in a background thread.
+        :return: The service.
+        """
+        self.warm_up()
+        for i in range(self.config.n_workers):
+            worker = threading.Thread(target=self._work, name=f"plan-service-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info(f"Serving plans at {self.url}")
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops accepting requests and stops the workers once the queued requests are done.
+        :return: None
+        """
+        self._server.shutdown()
+        self._server.server_close()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def __enter__(self) -> "PlanService":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    @staticmethod
+    def warm_up() -> None:
+        """
+        Loads the token encodings and opens the pooled client before the first request.
+        :return: None
+        """
+        for model in OpenAIModel:
+            try:
+                TokenCalculator.get_encoding(model)
+            except Exception:
+                logging.warning(f"Could not load the encoding of {model.value}, token counts will be estimated.")
+        if LLMManager._session is None:
+            LLMManager.configure_http_client()
+
+    def submit(self, run: Callable[[threading.Event], Dict], deadline_seconds: float = None) -> Dict:
+        """
+        Queues the work and waits for its result.
+        :param run: Does the work, stopping early once the given event is set.
+        :param deadline_seconds: The seconds the request may take (capped by the configured deadline).
+        :return: The result of the work.
+        :raises queue.Full: If the queue is full.
+        :raises DeadlineExceeded: If the work was not done before the deadline.
+        """
+        timeout = min(deadline_seconds or self.config.deadline_seconds, self.config.deadline_seconds)
+        job = _Job(run, deadline=time.monotonic() + timeout)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self.n_rejected += 1
+            raise
+        if not job.done.wait(timeout):
+            job.cancel_event.set()
+            raise DeadlineExceeded(f"Request did not complete within {timeout:.1f} seconds")
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def get_retry_after(self) -> int:
+        """
+        :return: The estimated seconds until the queue has room, based on recent job durations.
+        """
+        return max(1, math.ceil(self._job_seconds * (self._queue.qsize() + 1) / self.config.n_workers))
+
+    def create_mission(self, body: Dict, cancel_event: threading.Event) -> Dict:
+        """
+        Generates the initial plan of a new mission.
+        :param body: Contains the variables of the mission and optionally the response mode.
+        :param cancel_event: Set when the request is past its deadline.
+        :return: The id of the mission and its plans.
+        :raises BadRequest: If the variables or the response mode are missing or invalid.
+        """
+        if "variables" not in body:
+            raise BadRequest("Missing variables")
+        variables = self._parse_variables(body["variables"])
+        try:
+            response_mode = ResponseMode(body.get("response_mode", ResponseMode.XML.value))
+        except ValueError as e:
+            raise BadRequest(str(e)) from e
+        plan_generator = PlanGenerator(variables, response_mode=response_mode, **self.generator_params)
+        mission = _Mission(plan_generator, StationDistanceField.for_variables(variables))
+        plans = plan_generator.generate_initial(cancel_event=cancel_event)
+        mission_id = uuid.uuid4().hex
+        with self._missions_lock:
+            self._missions[mission_id] = mission
+            while len(self._missions) > self.config.max_missions:
+                self._missions.popitem(last=False)
+        return {"mission_id": mission_id, "plans": self._to_json_plans(plans, mission)}
+
+    def adapt_mission(self, mission_id: str, body: Dict, cancel_event: threading.Event) -> Dict:
+        """
+        Adapts the plan of a mission on a fork of its generator, so the mission is only changed if the adaptation succeeds.
+        :param mission_id: The id of the mission.
+        :param body: Contains the adaptation and the state of the drones (see PlanGenerator.generate_adaption).
+        :param cancel_event: Set when the request is past its deadline.
+        :return: The id of the mission and its adapted plans.
+        :raises UnknownMission: If the mission does not exist (or was forgotten).
+        :raises BadRequest: If the adaptation is missing or the state of the drones is invalid.
+        """
+        with self._missions_lock:
+            mission = self._missions.get(mission_id)
+            if mission is None:
+                raise UnknownMission(f"Unknown mission {mission_id}")
+            self._missions.move_to_end(mission_id)
+        if not isinstance(body.get("plan_adaptation"), str):
+            raise BadRequest("Missing plan_adaptation")
+        current_round = body.get("current_round", 0)
+        if not isinstance(current_round, int) or current_round < 0:
+            raise BadRequest(f"Invalid current_round: {current_round}")
+        try:
+            locations = {drone_id: self._parse_cell(cell)
+                         for drone_id, cell in body.get("current_location_of_drones", {}).items()}
+            covered_cells = [self._parse_cell(cell) for cell in body["covered_cells"]] if "covered_cells" in body else None
+        except (AttributeError, TypeError) as e:
+            raise BadRequest(f"Invalid cells: {e}") from e
+        with mission.lock:
+            generator = mission.plan_generator.fork()
+            plans = generator.generate_adaption(body["plan_adaptation"], locations,
+                                                current_round=current_round,
+                                                affected_drone_ids=body.get("affected_drone_ids"),
+                                                remaining_battery=body.get("remaining_battery"),
+                                                covered_cells=covered_cells, cancel_event=cancel_event)
+            mission.plan_generator.adopt(generator)
+        return {"mission_id": mission_id, "plans": self._to_json_plans(plans, mission)}
+
+    def get_health(self) -> Dict:
+        """
+        :return: The load of the service.
+        """
+        with self._missions_lock:
+            n_missions = len(self._missions)
+        return {"queued": self._queue.qsize(), "queue_size": self.config.queue_size, "workers": self.config.n_workers,
+                "missions": n_missions, "rejected": self.n_rejected}
+
+    def _work(self) -> None:
+        """
+        Processes queued jobs until stopped, skipping jobs that are already past their deadline.
+        :return: None
+        """
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            start = time.monotonic()
+            METRICS.observe(QUEUE_SECONDS, start - job.enqueued, buckets=SECONDS_BUCKETS)
+            if start >= job.deadline or job.cancel_event.is_set():
+                job.error = DeadlineExceeded("Request expired while queued")
+                job.done.set()
+                continue
+            timer = threading.Timer(job.deadline - start, job.cancel_event.set)
+            timer.start()
+            try:
+                job.result = job.run(job.cancel_event)
+            except BaseException as e:
+                job.error = e
+            finally:
+                timer.cancel()
+                self._job_seconds = 0.8 * self._job_seconds + 0.2 * (time.monotonic() - start)
+                job.done.set()
+
+    @staticmethod
+    def _parse_variables(values: Dict) -> DroneVariables:
+        """
+        Creates the variables of a mission from json, where cells are [x, y] lists.
+        :param values: The fields of DroneVariables.
+        :return: The variables.
+        :raises BadRequest: If a required field is missing or a field is invalid.
+        """
+        if not isinstance(values, dict):
+            raise BadRequest("variables must be an object")
+        values = dict(values)
+        missing = [name for name in ("launch_point", "terrains") if name not in values]
+        if missing or any(not isinstance(t, dict) or "blocks" not in t for t in values["terrains"]):
+            raise BadRequest(f"Missing {', '.join(missing) or 'blocks of a terrain'}")
+        try:
+            values["launch_point"] = PlanService._parse_cell(values["launch_point"])
+            values["terrains"] = [{**t, "blocks": [PlanService._parse_cell(b) for b in t["blocks"]]} for t in values["terrains"]]
+            if values.get("battery_changing_stations") is not None:
+                values["battery_changing_stations"] = [PlanService._parse_cell(c) for c in values["battery_changing_stations"]]
+            return DroneVariables(**values)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise BadRequest(f"Invalid variables: {e}") from e
+
+    @staticmethod
+    def _parse_cell(cell: List[int]) -> Tuple[int, int]:
+        """
+        :param cell: The json cell ([x, y]).
+        :return: The numeric coordinate of the cell.
+        :raises BadRequest: If the cell is not a pair of integers.
+        """
+        if not isinstance(cell, (list, tuple)) or len(cell) != 2 or not all(isinstance(v, int) for v in cell):
+            raise BadRequest(f"Invalid cell {cell}, expected [x, y]")
+        return cell[0], cell[1]
+
+    @staticmethod
+    def _to_json_plans(plans: List[DronePlan], mission: _Mission) -> List[Dict]:
+        """
+        Converts the plans to json, flagging the rounds that cannot be flown on a single battery.
+        :param plans: The plan of each drone.
+        :param mission: The mission of the plans.
+        :return: The rounds of each drone and the indices of its infeasible rounds.
+        """
+        variables = mission.plan_generator.initial_configuration
+        stations = set(map(tuple, mission.distance_field.stations.tolist()))
+        json_plans = []
+        for plan in plans:
+            rounds = [plan.get_round(r) for r in range(plan.n_rounds)]
+            infeasible_rounds = [r for r, cells in enumerate(rounds)
+                                 if not PlanService._is_feasible(cells, stations, mission.distance_field, variables)]
+            json_plans.append({"id": plan.id, "rounds": rounds, "infeasible_rounds": infeasible_rounds})
+        return json_plans
+
+    @staticmethod
+    def _is_feasible(cells: List[Tuple[int, int]], stations: set, distance_field: StationDistanceField,
+                     variables: DroneVariables) -> bool:
+        """
+        :param cells: The cells of a round.
+        :param stations: The cells of the stations.
+        :param distance_field: The distances of the mission's map.
+        :param variables: The configuration of the mission.
+        :return: Whether the round stays in the search area and its search can be flown on a single battery.
+        """
+        if any(not (1 <= x <= variables.n_width_blocks and 1 <= y <= variables.n_height_blocks) for x, y in cells):
+            return False
+        search_cells = [cell for cell in cells if cell not in stations]
+        return distance_field.is_feasible(search_cells, variables.cells_in_single_battery)
+
+    def _create_handler(self):
+        """
+        Creates the request handler bound to this service.
+        :return: The request handler class.
+        """
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                if self.path == "/health":
+                    self._respond(200, service.get_health())
+                elif self.path == "/metrics":
+                    self._respond(200, METRICS.to_prometheus_text(), content_type="text/plain")
+                else:
+                    self._respond(404, {"error": f"Unknown path {self.path}"})
+
+            def do_POST(self) -> None:
+                parts = [p for p in self.path.split("/") if p]
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError as e:
+                    self._respond(400, {"error": f"Invalid json: {e}"})
+                    return
+                if not isinstance(body, dict):
+                    self._respond(400, {"error": "The body must be a json object"})
+                    return
+                if parts == [MISSIONS_PATH]:
+                    run = lambda cancel_event: service.create_mission(body, cancel_event)
+                elif len(parts) == 3 and parts[0] == MISSIONS_PATH and parts[2] == ADAPTATIONS_PATH:
+                    run = lambda cancel_event: service.adapt_mission(parts[1], body, cancel_event)
+                else:
+                    self._respond(404, {"error": f"Unknown path {self.path}"})
+                    return
+                deadline_seconds = body.get("deadline_seconds")
+                if deadline_seconds is not None and (not isinstance(deadline_seconds, (int, float)) or deadline_seconds <= 0):
+                    self._respond(400, {"error": f"Invalid deadline_seconds: {deadline_seconds}"})
+                    return
+                try:
+                    self._respond(200, service.submit(run, deadline_seconds))
+                except queue.Full:
+                    self._respond(429, {"error": "Too many requests queued"},
+                                  headers={"Retry-After": str(service.get_retry_after())})
+                except (DeadlineExceeded, GenerationCancelled) as e:
+                    self._respond(504, {"error": str(e)})
+                except UnknownMission as e:
+                    self._respond(404, {"error": str(e)})
+                except BadRequest as e:
+                    self._respond(400, {"error": str(e)})
+                except PromptBudgetExceeded as e:
+                    self._respond(413, {"error": str(e)})
+                except Exception as e:
+                    logging.exception("Failed to generate the plans")
+                    self._respond(500, {"error": str(e)})
+
+            def _respond(self, status: int, body, content_type: str = "application/json", headers: Dict = None) -> None:
+                payload = (body if isinstance(body, str) else json.dumps(body)).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+                METRICS.increment(SERVICE_REQUESTS, status=str(status), method=self.command)
+
+            def log_message(self, *args) -> None:
+                return None
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves initial and adapted plans over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--deadline", type=float, default=120, help="Default and maximum seconds per request.")
+    parser.add_argument("--max-missions", type=int, default=128)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    service = PlanService(ServiceConfig(host=args.host, port=args.port, n_workers=args.workers, queue_size=args.queue_size,
+                                        deadline_seconds=args.deadline, max_missions=args.max_missions)).start()
+    try:
+        service._thread.join()
+    except KeyboardInterrupt:
+        service.stop()
@@ -0,0 +1,123 @@
+import argparse
+import os
+import threading
+import time
+from typing import Dict, List
+
+import openai
+import requests
+
+from llms.mock_llm_server import FaultConfig, MockLLMServer
+from plan_service import PlanService, ServiceConfig
+from test_data import test_drones, test_terrains
+
+"""
+Load tests the plan service against the local stand-in for the model:
+    python plan_service_benchmark.py --n-clients 16 --n-requests 8 --workers 4 --queue-size 8 --latency 0.2
+Each client creates missions (with a different weather, so identical requests are not shared) and adapts each of them once.
+Reports the throughput, the latency percentiles of the accepted requests and the number of rejected (429) and expired (504)
+requests.
+"""
+
+DEFAULT_RESPONSE_PATH = os.path.join(os.path.dirname(__file__), "..", "examples", "alpha_response.txt")
+ADAPTATION_EVENT = "The weather has changed to fog."
+
+
+def run_benchmark(n_clients: int = 16, n_requests: int = 8, n_workers: int = 4, queue_size: int = 8,
+                  latency: float = 0.2, deadline_seconds: float = 30,
+                  response_path: str = DEFAULT_RESPONSE_PATH) -> Dict[str, float]:
+    """
+    Sends concurrent requests to the service, backed by a mock model server.
+    :param n_clients: The number of concurrent clients.
+    :param n_requests: The number of missions created (and adapted) by each client.
+    :param n_workers: The number of workers of the service.
+    :param queue_size: The size of the queue of the service.
+    :param latency: The seconds the mock model takes per completion.
+    :param deadline_seconds: The deadline of each request.
+    :param response_path: The path to the response returned by the mock model.
+    :return: The throughput, latency percentiles (ms) and the count of each status.
+    """
+    with open(response_path) as f:
+        completion = f.read()
+    statuses: Dict[int, int] = {}
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    with MockLLMServer(FaultConfig(completion=completion, latency=latency)) as llm_server:
+        openai.api_base = llm_server.api_base
+        config = ServiceConfig(port=0, n_workers=n_workers, queue_size=queue_size, deadline_seconds=deadline_seconds)
+        with PlanService(config) as service:
+            def record(response: requests.Response, elapsed: float) -> None:
+                with lock:
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    if response.status_code == 200:
+                        latencies.append(elapsed)
+
+            def run_client(client_num: int) -> None:
+                session = requests.Session()
+                for request_num in range(n_requests):
+                    body = {"variables": _create_variables(f"weather {client_num}-{request_num}"),
+                            "deadline_seconds": deadline_seconds}
+                    start = time.perf_counter()
+                    response = session.post(f"{service.url}/missions", json=body)
+                    record(response, time.perf_counter() - start)
+                    if response.status_code != 200:
+                        continue
+                    mission_id = response.json()["mission_id"]
+                    body = {"plan_adaptation": ADAPTATION_EVENT, "current_round": 2,
+                            "current_location_of_drones": {drone["id"]: [1, 1] for drone in test_drones},
+                            "deadline_seconds": deadline_seconds}
+                    start = time.perf_counter()
+                    response = session.post(f"{service.url}/missions/{mission_id}/adaptations", json=body)
+                    record(response, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            clients = [threading.Thread(target=run_client, args=(i,)) for i in range(n_clients)]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    results = {"requests_per_second": statuses.get(200, 0) / elapsed,
+               "p50_ms": _get_percentile(latencies, 0.5) * 1000, "p95_ms": _get_percentile(latencies, 0.95) * 1000}
+    results.update({f"status_{status}": count for status, count in sorted(statuses.items())})
+    return results
+
+
+def _create_variables(weather_status: str) -> Dict:
+    """
+    :param weather_status: The weather of the mission.
+    :return: The json variables of the test mission.
+    """
+    return {"drones": test_drones, "terrains": [{**t, "blocks": list(t["blocks"])} for t in test_terrains],
+            "drone_max_distance": 8, "n_width_blocks": 28, "n_height_blocks": 16, "launch_point": [1, 1],
+            "battery_time": 30, "cells_in_single_battery": 8,
+            "battery_changing_stations": [[1, 1], [1, 14], [8, 14], [8, 1]], "weather_status": weather_status,
+            "search_priorities": ["Search bodies of water first.", "Search woods next."]}
+
+
+def _get_percentile(values: List[float], percentile: float) -> float:
+    """
+    :param values: The sorted values.
+    :param percentile: The percentile (0-1).
+    :return: The value at the percentile (0 if there are no values).
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(percentile * len(values)))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load tests the plan service against a mock model.")
+    parser.add_argument("--n-clients", type=int, default=16)
+    parser.add_argument("--n-requests", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per mock completion.")
+    parser.add_argument("--deadline", type=float, default=30)
+    args = parser.parse_args()
+    benchmark = run_benchmark(args.n_clients, args.n_requests, args.workers, args.queue_size, args.latency, args.deadline)
+    for name, value in benchmark.items():
+        print(f"{name}: {value:.1f}" if isinstance(value, float) else f"{name}: {value}")
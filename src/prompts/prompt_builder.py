@@ -1,8 +1,28 @@
-from typing import Any, Dict, List
+import logging
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
 
 from core.drone_constants import COMPLETION_KEY, EMPTY_STRING, NEW_LINE, PROMPY_KEY
 from prompts.prompt import Prompt
 from prompts.prompt_args import PromptArgs
+from utils.metrics import METRICS, PROMPT_DEGRADATIONS
+
+
+class PromptBudgetExceeded(Exception):
+    """
+    Raised when a prompt does not fit its token budget even after every degradation was applied.
+    """
+
+
+class Degradation(NamedTuple):
+    """
+    A smaller form of a section used when the prompt does not fit its token budget.
+    :param priority: Degradations with lower priorities are applied first (across all sections).
+    :param prompt: The smaller form of the section (None to drop the section).
+    :param name: Describes the degradation in logs and metrics.
+    """
+    priority: int
+    prompt: Optional[Prompt]
+    name: str
 
 
 class PromptBuilder:
@@ -15,21 +35,28 @@ class PromptBuilder:
         """
         self.prompts = prompts if prompts else []
         self.format_variables = format_variables if format_variables else {}
+        self.degradations: Dict[str, List[Degradation]] = {}
+        self.applied_degradations: List[str] = []
         self._n_built = 0
 
     def build(self, model_format_args: PromptArgs, correct_completion: Any = EMPTY_STRING, delimiter: str = NEW_LINE,
-              **prompt_kwargs) -> Dict[str, str]:
+              max_tokens: int = None, token_counter: Callable[[str], int] = None, **prompt_kwargs) -> Dict[str, str]:
         """
         Generates the prompt and response
         :param model_format_args: Defines the formatting specific to the model
         :param correct_completion: The correct completion that the model should produce
+        :param max_tokens: If provided, sections are degraded (lowest priority first) until the prompt fits this many tokens.
+        :param token_counter: Counts the tokens of a prompt (required with max_tokens).
         :return: Dictionary containing the prompt and completion
         """
         format_vars = {key: val[self._n_built] for key, val in self.format_variables.items() if len(val) > self._n_built}
         prompt_kwargs.update(format_vars)
         built_prompts = [prompt.build(**prompt_kwargs) for prompt in self.prompts]
-        base_prompt = delimiter.join(built_prompts)
-        prompt = self._format_prompt_for_model(base_prompt, prompt_args=model_format_args)
+        prompt = self._format_prompt_for_model(delimiter.join(built_prompts), prompt_args=model_format_args)
+        self.applied_degradations = []
+        if max_tokens is not None:
+            prompt = self._fit_to_budget(built_prompts, prompt, model_format_args, delimiter, max_tokens, token_counter,
+                                         **prompt_kwargs)
         completion = self._format_completion(correct_completion, prompt_args=model_format_args)
         self._n_built += 1
         return {
@@ -37,6 +64,18 @@ class PromptBuilder:
             COMPLETION_KEY: completion
         }
 
+    def add_degradation(self, prompt_id: str, priority: int, prompt: Prompt = None, name: str = None) -> None:
+        """
+        Adds a smaller form of a section, used if the prompt does not fit its budget. The forms of a section are applied in
+        the order they were added and should be increasingly small.
+        :param prompt_id: The id of the section.
+        :param priority: Degradations with lower priorities are applied first.
+        :param prompt: The smaller form of the section (None to drop the section).
+        :param name: Describes the degradation in logs and metrics.
+        :return: None
+        """
+        self.degradations.setdefault(prompt_id, []).append(Degradation(priority, prompt, name or prompt_id))
+
     def add_prompt(self, prompt: Prompt, i: int = None) -> None:
         """
         Adds a prompt at the given index (appens to end by defailt
@@ -115,6 +154,38 @@ class PromptBuilder:
         """
         return {prompt.id: prompt.parse_response(res) for prompt in self.prompts}
 
+    def _fit_to_budget(self, built_prompts: List[str], prompt: str, model_format_args: PromptArgs, delimiter: str,
+                       max_tokens: int, token_counter: Callable[[str], int], **prompt_kwargs) -> str:
+        """
+        Applies the degradations of the sections, lowest priority first, until the prompt fits the budget.
+        :param built_prompts: The built sections, replaced by their degraded forms.
+        :param prompt: The prompt built from the sections.
+        :param model_format_args: Defines the formatting specific to the model.
+        :param delimiter: Joins the sections.
+        :param max_tokens: The maximum number of tokens in the prompt.
+        :param token_counter: Counts the tokens of a prompt.
+        :param prompt_kwargs: The arguments the sections are built with.
+        :return: The prompt fitting the budget.
+        """
+        remaining = [list(self.degradations.get(p.id, [])) for p in self.prompts]
+        n_tokens = token_counter(prompt)
+        while n_tokens > max_tokens:
+            candidates = [(steps[0].priority, i) for i, steps in enumerate(remaining) if steps]
+            if not candidates:
+                raise PromptBudgetExceeded(f"Prompt needs {n_tokens} tokens but only {max_tokens} are available "
+                                           f"after applying: {self.applied_degradations}")
+            _, i = min(candidates)
+            degradation = remaining[i].pop(0)
+            built_prompts[i] = degradation.prompt.build(**prompt_kwargs) if degradation.prompt else None
+            self.applied_degradations.append(degradation.name)
+            METRICS.increment(PROMPT_DEGRADATIONS, degradation=degradation.name)
+            prompt = self._format_prompt_for_model(delimiter.join(p for p in built_prompts if p is not None),
+                                                   prompt_args=model_format_args)
+            n_tokens = token_counter(prompt)
+        if self.applied_degradations:
+            logging.info(f"Degraded prompt to {n_tokens} tokens: {self.applied_degradations}")
+        return prompt
+
     @staticmethod
     def _format_prompt_for_model(base_prompt: str, prompt_args: PromptArgs) -> str:
         """
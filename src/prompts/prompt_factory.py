@@ -1,19 +1,41 @@
 import ast
-from typing import Dict, List, Tuple
+import json
+from typing import Dict, Iterable, List, NamedTuple, Tuple
 
-from core.drone_constants import CELLS_KEY, DRONE_ID_KEY, DRONE_KEY, DronePromptArgs, NEW_LINE
+from core.drone_constants import CELLS_KEY, COMMA, DRONE_ID_KEY, DRONE_KEY, DronePromptArgs, NEW_LINE, SPACE
 from core.drone_plan import DronePlan
-from core.drone_variables import DroneVariables
+from core.drone_variables import CoordinateType, DroneVariables
+from llms.llm_models import OpenAIModel
+from llms.token_calculator import MAX_TOKENS_BUFFER, TokenCalculator
 from prompts.multi_dict_prompt import MultiDictPrompt
 from prompts.prompt import Prompt
 from prompts.prompt_builder import PromptBuilder
 from prompts.prompt_response_manager import PromptResponseManager
 from prompts.questionnaire_prompt import QuestionnairePrompt
+from prompts.structured_output import PLAN_FUNCTION_NAME, REASONING_KEY, ResponseMode, StructuredOutput
 from utils.drone_util import parse_coordinates
 
 from src.core.drone_constants import STARTING_FLIGHT_PLAN_NUM, START_KEY, SEARCH_KEY, END_KEY
 from src.prompts.prompt_util import PromptUtil
 
+DEFAULT_COMPLETION_RESERVE = 1000
+# Sections are degraded in this order when the prompt does not fit the model's window.
+TERRAIN_RECTANGLES_PRIORITY = 0  # lossless: cells merged into rectangles and terrains of a type into one
+REASONING_PRIORITY = 1  # the reasoning questions are dropped
+SEARCH_PRIORITIES_PRIORITY = 2  # the search priorities are halved until none are left
+TERRAIN_BOUNDS_PRIORITY = 3  # lossy: each terrain is described by its bounding box
+COVERED_BOUNDS_PRIORITY = 3  # lossy: the cells already searched are described by their bounding box
+
+
+class AdaptationContext(NamedTuple):
+    """
+    The state of the mission sent in place of its full description when an adaptation continues the mission's conversation.
+    :param covered_cells: The cells that were already searched.
+    :param remaining_battery: Maps the id of a drone to the share of its battery left (0-1), if known.
+    """
+    covered_cells: Iterable[CoordinateType]
+    remaining_battery: Dict[str, float] = None
+
 
 class PromptFactory:
     RESPONSE_FORMAT_EXAMPLE = {DRONE_ID_KEY: "[Drone ID e.g., Purple]",
@@ -22,55 +44,139 @@ class PromptFactory:
                                END_KEY: "[Ending Cell (nearest charging station)]"}
     ORDINAL_NUMBERS = ["first", "second", "third", "fourth", "fifth"]
 
-    def __init__(self, variables: DroneVariables):
+    def __init__(self, variables: DroneVariables, response_mode: ResponseMode = ResponseMode.XML,
+                 adaptation_context: AdaptationContext = None, model: OpenAIModel = OpenAIModel.GPT4,
+                 completion_reserve: int = DEFAULT_COMPLETION_RESERVE):
         """
         Builds the prompt for creating a drone plan.
         :param variables: The variables to include in the prompt.
+        :param response_mode: Whether the model responds with xml tags or by calling a function with json arguments.
+        :param adaptation_context: If provided, adaptation prompts only describe what changed, assuming the conversation
+                                   contains the mission (see build_adaptation_history).
+        :param model: The model whose window the prompts must fit.
+        :param completion_reserve: The number of tokens of the window kept for the completion.
         """
         self.variables = variables
+        self.response_mode = response_mode
+        self.adaptation_context = adaptation_context
+        self.model = model
+        self.completion_reserve = completion_reserve
         self.builder = None
         self.task_prompt = None
         self.response_manager = PromptResponseManager({
             DRONE_KEY: list(self.RESPONSE_FORMAT_EXAMPLE.keys())
         }, include_response_instructions=False)
 
-    def build(self, flight_plan_num: int) -> str:
+    def build(self, flight_plan_num: int, n_context_tokens: int = 0) -> str:
         """
         Builds the prompt for the whichever flight plan is being generated.
+        Sections are degraded (see the priorities above) until the prompt, the context and the completion reserve fit the
+        window of the model.
         :param flight_plan_num: Which flight plan is being generated.
+        :param n_context_tokens: The number of tokens of the conversation sent along with the prompt.
         :return: The prompt to provide to generate the flight plan.
         """
-
-        if flight_plan_num == STARTING_FLIGHT_PLAN_NUM:
+        degradations = []
+        if self.adaptation_context is not None and self.variables.plan_adaptation:
+            delta_prompt = self._build_delta_prompt(flight_plan_num)
+            tasks = [delta_prompt]
+            if flight_plan_num == STARTING_FLIGHT_PLAN_NUM:
+                degradations.append((delta_prompt, COVERED_BOUNDS_PRIORITY,
+                                     self._build_delta_prompt(flight_plan_num, covered_as_bounds=True), "covered_bounds"))
+        elif flight_plan_num == STARTING_FLIGHT_PLAN_NUM:
             if self.variables.plan_adaptation:
                 self.task_prompt = self._build_adaption_prompt()
                 objective_prompt = None
             else:
                 self.task_prompt = self._build_task_prompt(flight_plan_num=flight_plan_num)
                 objective_prompt = self._build_objectives(self.variables.search_priorities)
+            search_area_prompt = self._build_search_area()
+            task_questionnaire = QuestionnairePrompt([self._build_reasoning(), self.task_prompt],
+                                                     instructions=PromptUtil.as_markdown_header("TASKS"))
             tasks = [
                 self._build_mission_description(), self._build_flight_stages_description(), self._build_search_rules(),
-                self._build_search_area(), self._build_drones(), QuestionnairePrompt([self._build_reasoning(), self.task_prompt],
-                                                                                     instructions=PromptUtil.as_markdown_header(
-                                                                                         "TASKS"))
+                search_area_prompt, self._build_drones(), task_questionnaire
             ]
+            degradations.extend([
+                (search_area_prompt, TERRAIN_RECTANGLES_PRIORITY, self._build_compressed_search_area(),
+                 "terrain_rectangles"),
+                (task_questionnaire, REASONING_PRIORITY, QuestionnairePrompt(
+                    [self.task_prompt], instructions=PromptUtil.as_markdown_header("TASKS")), "drop_reasoning"),
+                (search_area_prompt, TERRAIN_BOUNDS_PRIORITY, self._build_compressed_search_area(as_bounds=True),
+                 "terrain_bounds")])
             if objective_prompt:
                 tasks.insert(3, objective_prompt)
+                n_priorities = len(self.variables.search_priorities)
+                while n_priorities > 0:
+                    n_priorities //= 2
+                    degradations.append((objective_prompt, SEARCH_PRIORITIES_PRIORITY,
+                                         self._build_objectives(self.variables.search_priorities[:n_priorities]),
+                                         f"search_priorities_{n_priorities}"))
         else:
             tasks = [self.task_prompt]
         self.builder = PromptBuilder(tasks, title="Task")
+        for section, priority, degraded_section, name in degradations:
+            self.builder.add_degradation(section.id, priority, degraded_section, name=name)
         prompt = self.builder.build(DronePromptArgs,
                                     **vars(self.variables),
-                                    delimiter=NEW_LINE + NEW_LINE)
+                                    delimiter=NEW_LINE + NEW_LINE,
+                                    max_tokens=self._get_prompt_budget(n_context_tokens),
+                                    token_counter=lambda text: TokenCalculator.estimate_num_tokens(text, self.model))
         prompt_text = prompt["prompt"]
         return prompt_text
 
+    def build_adaptation_history(self, plans: Iterable[DronePlan], previous_adaptations: List[str] = None) -> List[Dict]:
+        """
+        Builds the conversation delta adaptations continue in place of the mission's full conversation: a compact
+        description of the mission (terrains as rectangles, no reasoning questions) and a summary of the current plan.
+        :param plans: The current plan of each drone.
+        :param previous_adaptations: The updates the current plan was already adapted to.
+        :return: The user and assistant messages.
+        """
+        task_prompt = self._get_task_prompt(instructions="Flights are planned one at a time. ")
+        tasks = [self._build_mission_description(), self._build_flight_stages_description(), self._build_search_rules(),
+                 self._build_objectives(self.variables.search_priorities), self._build_compressed_search_area(),
+                 self._build_drones(), task_prompt]
+        mission = PromptBuilder(tasks, title="Task").build(DronePromptArgs, **vars(self.variables),
+                                                           delimiter=NEW_LINE + NEW_LINE)["prompt"]
+        flights = []
+        for plan in plans:
+            rounds = [f"{r + 1}) {self._format_cells(plan.get_round(r))}" for r in range(plan.n_rounds)]
+            flights.append(f"- {plan.id}: {SPACE.join(rounds)}")
+        summary = NEW_LINE.join(["Current plan, cells of each flight:", *flights])
+        if previous_adaptations:
+            summary += NEW_LINE + "It was adapted to: " + SPACE.join(previous_adaptations)
+        return [{"role": "user", "content": mission}, {"role": "assistant", "content": summary}]
+
+    def get_completion_params(self) -> Dict:
+        """
+        Gets the additional parameters of the completion required by the response mode.
+        :return: The parameters (the plan function in json mode).
+        """
+        if self.response_mode == ResponseMode.JSON:
+            return {"functions": StructuredOutput.build_functions(self.RESPONSE_FORMAT_EXAMPLE)}
+        return {}
+
+    def _get_prompt_budget(self, n_context_tokens: int) -> int:
+        """
+        Gets the number of tokens left for the prompt in the window of the model.
+        :param n_context_tokens: The number of tokens of the conversation sent along with the prompt.
+        :return: The maximum number of tokens of the prompt.
+        """
+        budget = self.model.get_max_tokens() - MAX_TOKENS_BUFFER - self.completion_reserve - n_context_tokens
+        functions = self.get_completion_params().get("functions")
+        if functions:
+            budget -= TokenCalculator.estimate_num_tokens(json.dumps(functions), self.model)
+        return budget
+
     def parse(self, res: str) -> List[DronePlan]:
         """
         Parses the response from the model to create a flight plan.
         :param res: The response from the model.
         :return: A list of plans for each drone.
         """
+        if self.response_mode == ResponseMode.JSON:
+            return StructuredOutput.decode(res, alpha_format=self.variables.use_alphabetical)
         parsed_response = self.response_manager.parse_response(res)
         id2struct = {}
         for drone_plan in parsed_response[DRONE_KEY]:
@@ -189,6 +295,32 @@ class PromptFactory:
                                instructions="The location of woods, water bodies, the launch pad, "
                                             "and charging stations is provided in this xml file:")
 
+    def _build_compressed_search_area(self, as_bounds: bool = False) -> Prompt:
+        """
+        Builds a smaller form of the search area, listing the cells of each type of terrain as rectangles.
+        :param as_bounds: Whether each terrain is only described by its bounding rectangle (approximate).
+        :return: The prompt containing the search area info.
+        """
+        type2rectangles = {}
+        for terrain in self.variables.terrains:
+            cells = [self.variables.to_numeric_coordinate(block) for block in terrain["blocks"]]
+            if not cells:
+                continue
+            if as_bounds:
+                xs, ys = zip(*cells)
+                rectangles = [((min(xs), min(ys)), (max(xs), max(ys)))]
+            else:
+                rectangles = self._to_rectangles(cells)
+            type2rectangles.setdefault(terrain["type"], []).extend(rectangles)
+        terrains = [{"type": terrain_type, "blocks": self._format_rectangles(rectangles)}
+                    for terrain_type, rectangles in type2rectangles.items()]
+        search_area = MultiDictPrompt("terrain", title="Search Area",
+                                      instructions="The location of woods, water bodies, the launch pad, and charging "
+                                                   "stations is provided in this xml file as rectangles of cells "
+                                                   f"({self._get_rectangle_example()})"
+                                                   f"{', approximately' if as_bounds else ''}:")
+        return Prompt(search_area.build(terrains=terrains), allow_formatting=False)
+
     @staticmethod
     def _build_objectives(search_priorities_list: List[str]) -> Prompt:
         """
@@ -218,10 +350,11 @@ class PromptFactory:
             questions = ["Can drones search cells that have already been searched?",
                          "How could battery usage be optimized?", "What area should each drone search first and why? "
                                                                   "Note: it may be different for each drone."]
+        response_manager = PromptResponseManager(response_tag=REASONING_KEY) if self.response_mode == ResponseMode.XML else None
         return QuestionnairePrompt(
             [Prompt(q) for q in questions],
             instructions=f"First, please explain what you understand about the mission by answering {len(questions)} questions:",
-            response_manager=PromptResponseManager(response_tag="reasoning")
+            response_manager=response_manager
         )
 
     def _build_task_prompt(self, flight_plan_num: int) -> Prompt:
@@ -248,6 +381,100 @@ class PromptFactory:
                        f"Each drone must start at its current location. "
         return self._get_task_prompt(instructions=instructions)
 
+    def _build_delta_prompt(self, flight_plan_num: int, covered_as_bounds: bool = False) -> Prompt:
+        """
+        Builds the adaptation prompt containing only the event and the state of the mission, continuing its conversation.
+        :param flight_plan_num: The number of the flight being planned (relative to the adaptation).
+        :param covered_as_bounds: Whether the cells already searched are only described by their bounding rectangle.
+        :return: The prompt containing the update and the task.
+        """
+        n_drones = len(self.variables.drones)
+        response_instructions = f"Call {PLAN_FUNCTION_NAME} as before." if self.response_mode == ResponseMode.JSON \
+            else "Structure output as before."
+        if flight_plan_num != STARTING_FLIGHT_PLAN_NUM:
+            return Prompt(f"Next, plan the following flight of the {n_drones} drones from the Ending Cell ({END_KEY}) of "
+                          f"their last flight. {response_instructions}", allow_formatting=False)
+
+        remaining_battery = self.adaptation_context.remaining_battery or {}
+        drone_states = []
+        for drone in self.variables.drones:
+            state = f"- {drone[DRONE_ID_KEY]}: {drone.get('current_location', self.variables.launch_point)}"
+            if drone[DRONE_ID_KEY] in remaining_battery:
+                state += f", {remaining_battery[drone[DRONE_ID_KEY]]:.0%}"
+            drone_states.append(state)
+        lines = [self.variables.plan_adaptation,
+                 "Drones to re-plan (current cell, battery left):", *drone_states,
+                 f"Already searched ({self._get_rectangle_example()}){', approximately' if covered_as_bounds else ''}: "
+                 f"{self._format_covered_cells(covered_as_bounds)}.",
+                 f"Adapt the plan: the next flight of each of these {n_drones} drones starts at its current cell, searches "
+                 f"~{self.variables.cells_in_single_battery} unsearched adjacent cells and ends at the nearest charging "
+                 f"station. {response_instructions}"]
+        return Prompt(NEW_LINE.join(lines), title="Update", allow_formatting=False)
+
+    def _format_covered_cells(self, as_bounds: bool) -> str:
+        """
+        :param as_bounds: Whether the cells are only described by their bounding rectangle.
+        :return: The cells already searched.
+        """
+        cells = list(self.adaptation_context.covered_cells)
+        if not as_bounds or not cells:
+            return self._format_cells(cells)
+        xs, ys = zip(*cells)
+        return self._format_rectangles([((min(xs), min(ys)), (max(xs), max(ys)))])
+
+    def _format_cells(self, cells: Iterable[CoordinateType]) -> str:
+        """
+        Lists the cells compactly as rectangles.
+        :param cells: The numeric coordinates of the cells.
+        :return: The rectangles in the format of the mission or none if there are no cells.
+        """
+        return self._format_rectangles(self._to_rectangles(cells))
+
+    def _format_rectangles(self, rectangles: Iterable[Tuple[CoordinateType, CoordinateType]]) -> str:
+        """
+        Lists rectangles of cells by their top-left and bottom-right cells (single cells on their own).
+        :param rectangles: The top-left and bottom-right cell of each rectangle.
+        :return: The rectangles in the format of the mission or none if there are no rectangles.
+        """
+        translate = self.variables.translate_coordinate
+        formatted = [translate(first) if first == last else f"{translate(first)}-{translate(last)}"
+                     for first, last in rectangles]
+        return (COMMA + SPACE).join(formatted) if formatted else "none"
+
+    def _get_rectangle_example(self) -> str:
+        """
+        :return: Explains how rectangles of cells are written, in the format of the mission.
+        """
+        translate = self.variables.translate_coordinate
+        return f"e.g. {translate((3, 2))}-{translate((4, 3))} covers {translate((3, 2))}, {translate((3, 3))}, " \
+               f"{translate((4, 2))} and {translate((4, 3))}"
+
+    @staticmethod
+    def _to_rectangles(cells: Iterable[CoordinateType]) -> List[Tuple[CoordinateType, CoordinateType]]:
+        """
+        Covers the cells exactly with rectangles by merging the runs of adjacent cells in each column with the identical runs
+        of the previous column.
+        :param cells: The numeric coordinates of the cells.
+        :return: The top-left and bottom-right cell of each rectangle.
+        """
+        runs = []
+        for x, y in sorted(set(cells)):
+            if runs and runs[-1][0] == x and runs[-1][2] == y - 1:
+                runs[-1][2] = y
+            else:
+                runs.append([x, y, y])
+        rectangles = []
+        open_rectangles = {}
+        for x, first_y, last_y in runs:
+            rectangle = open_rectangles.get((first_y, last_y))
+            if rectangle is not None and rectangle[1] == x - 1:
+                rectangle[1] = x
+            else:
+                rectangle = [x, x, first_y, last_y]
+                open_rectangles[(first_y, last_y)] = rectangle
+                rectangles.append(rectangle)
+        return [((first_x, first_y), (last_x, last_y)) for first_x, last_x, first_y, last_y in rectangles]
+
     def _get_task_prompt(self, instructions: str, flight_plan_num: int = STARTING_FLIGHT_PLAN_NUM) -> Prompt:
         """
         Gets that task prompt for the model using the given instructions.
@@ -257,9 +484,13 @@ class PromptFactory:
         """
         if flight_plan_num == STARTING_FLIGHT_PLAN_NUM:
             instructions += "Each drone must cover approximately {cells_in_single_battery} cells, " \
-                            "and then return to a charging cell. Drones can only move to adjacent cells. " \
-                            "Structure output as follows:\n"
-            instructions += MultiDictPrompt(DRONE_KEY).build(drones=[self.RESPONSE_FORMAT_EXAMPLE])
+                            "and then return to a charging cell. Drones can only move to adjacent cells. "
+            if self.response_mode == ResponseMode.JSON:
+                instructions += f"Call {PLAN_FUNCTION_NAME} with your answers to the questions ({REASONING_KEY}) " \
+                                f"and the flight of each drone."
+            else:
+                instructions += "Structure output as follows:\n"
+                instructions += MultiDictPrompt(DRONE_KEY).build(drones=[self.RESPONSE_FORMAT_EXAMPLE])
         else:
             instructions += f"Each drone should start at the Ending Cell ({END_KEY}) of its last flight."
         flight_plan_questionnaire = Prompt(instructions, response_manager=self.response_manager)
@@ -1,6 +1,7 @@
+import logging
 import uuid
 from dataclasses import dataclass, field
-from typing import Any, Callable, Dict, List, Set, Tuple, Type, Union
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Type, Union
 
 import bs4
 
@@ -13,6 +14,60 @@ RESPONSE_FORMAT = "Enclose your answer inside of {}"
 REQUIRE_ALL_TAGS = str(uuid.uuid4())
 
 
+class ResponseError(NamedTuple):
+    """
+    :param tag_id: The id of the tag whose value could not be formatted.
+    :param value: The value that could not be formatted.
+    :param error: Why formatting failed.
+    """
+    tag_id: str
+    value: Any
+    error: Exception
+
+
+class _TagPipeline:
+    """
+    The conversion and validation of a tag's values, compiled once from the configuration of the response manager.
+    """
+    __slots__ = ("convert", "is_expected")
+
+    def __init__(self, expected_type: Optional[Callable], expected_responses: Any):
+        """
+        Compiles the pipeline of a tag.
+        :param expected_type: Converts each value to the expected type (None to keep values as is).
+        :param expected_responses: The accepted values (a range, a collection or None to accept any value).
+        """
+        self.convert = expected_type
+        self.is_expected = self._compile_expectation(expected_responses)
+
+    @staticmethod
+    def _compile_expectation(expected_responses: Any) -> Optional[Callable[[Any], bool]]:
+        """
+        Creates the check of whether a value is expected.
+        :param expected_responses: The accepted values.
+        :return: The check (None if any value is accepted).
+        """
+        if expected_responses is None:
+            return None
+        if isinstance(expected_responses, range):
+            if len(expected_responses) == 0:
+                return lambda v: False
+            low, high = min(expected_responses), max(expected_responses)
+            return lambda v: low <= v <= high
+        try:
+            expected_set = frozenset(expected_responses)
+        except TypeError:
+            return lambda v: v in expected_responses
+
+        def is_expected(v: Any) -> bool:
+            try:
+                return v in expected_set
+            except TypeError:
+                return v in expected_responses
+
+        return is_expected
+
+
 @dataclass
 class PromptResponseManager:
     """
@@ -66,6 +121,14 @@ class PromptResponseManager:
      p1, c1.1, .. c1.n, p2, c2.1, .. c2.n,... pn, cn.1, .. cn.n
     """
     _all_tag_ids: List[str] = field(init=False, default_factory=list)
+    """
+    The compiled conversion and validation of each tag's values
+    """
+    _pipelines: Dict[str, _TagPipeline] = field(init=False, default_factory=dict)
+    """
+    The values that could not be formatted while parsing the last response
+    """
+    errors: List[ResponseError] = field(init=False, default_factory=list)
 
     def __post_init__(self) -> None:
         """
@@ -80,6 +143,16 @@ class PromptResponseManager:
             self.required_tag_ids = set(self._all_tag_ids)
         elif not isinstance(self.required_tag_ids, set):
             self.required_tag_ids = {self.required_tag_ids}
+        self._compile_pipelines()
+
+    def _compile_pipelines(self) -> None:
+        """
+        Compiles the expected type and responses of each tag into a pipeline so they are not re-interpreted for every value.
+        :return: None
+        """
+        tag_ids = set(self.expected_response_type.keys()) | set(self.expected_responses.keys())
+        self._pipelines = {tag_id: _TagPipeline(self.expected_response_type.get(tag_id), self.expected_responses.get(tag_id))
+                           for tag_id in tag_ids}
 
     def _convert2dict(self, initial_val: Any) -> Dict:
         """
@@ -136,6 +209,7 @@ class PromptResponseManager:
         :param response: The model response
         :return: The formatted response
         """
+        self.errors = []
         if not self.response_tag:
             return {}
         output = {}
@@ -163,23 +237,20 @@ class PromptResponseManager:
         """
         formatted_tags = {}
         for tag, values in output.items():
-            values, _ = self._convert2list(values)
             formatted_values = []
-            for val in values:
-                formatted_val = val
+            for val in (values if isinstance(values, list) else (values,)):
                 if isinstance(val, dict):
                     formatted_val = self._format_response(val)
                     if self.entry_formatter:
                         formatted_val = self.entry_formatter(tag, formatted_val)
                     formatted_values.append(formatted_val)
-                else:
-                    try:
-                        formatted_val = self._format_value(tag, formatted_val)
-                    except (TypeError, AssertionError, ValueError) as e:
-                        print(e)
-                        formatted_val = self._format_on_failure(tag, formatted_val, e)
-                    if formatted_val is not None:
-                        formatted_values.append(formatted_val)
+                    continue
+                try:
+                    formatted_val = self._format_value(tag, val)
+                except (TypeError, AssertionError, ValueError) as e:
+                    formatted_val = self._format_on_failure(tag, val, e)
+                if formatted_val is not None:
+                    formatted_values.append(formatted_val)
             formatted_tags[tag] = formatted_values
         return formatted_tags
 
@@ -191,66 +262,57 @@ class PromptResponseManager:
         :return: The formatted value
         """
         assert orig_val is not None, f"{orig_val} is missing {tag}"
-        vals2format, orig_vals_is_list = self._convert2list(orig_val)
+        pipeline = self._pipelines.get(tag)
+        if not isinstance(orig_val, list):
+            return self._format_single_value(tag, pipeline, orig_val)
         formatted = []
-        for val in vals2format:
-            if isinstance(val, bs4.NavigableString):
-                val = str(val)
-            if self.value_formatter:
-                val = self.value_formatter(tag, val)
-            inner_vals, inner_vals_is_list = self._convert2list(val)
-            if tag in self.expected_response_type:
-                inner_vals = self._convert_to_expected_type(inner_vals, tag, inner_vals_is_list)
-            if tag in self.expected_responses:
-                inner_vals = self._assert_expected_response(inner_vals, tag, inner_vals_is_list)
-            val = inner_vals if inner_vals_is_list else inner_vals.pop()
+        for val in orig_val:
+            val = self._format_single_value(tag, pipeline, val)
             if val is not None:
                 formatted.append(val)
-        formatted_val = formatted if orig_vals_is_list else formatted.pop()
-        return formatted_val
+        return formatted
 
-    def _assert_expected_response(self, vals2check: List[Any], tag: str, is_list: bool) -> List[Any]:
+    def _format_single_value(self, tag: str, pipeline: Optional[_TagPipeline], val: Any) -> Any:
         """
-        Asserts that all values are expected
-        :param vals2check: The values to check
-        :param tag: The tag used to output values
-        :param is_list: True if the response is a list
-        :return: The checked values
+        Formats one of the values of a tag, which the value formatter may split into a list of values
+        :param tag: The tag to format the value for
+        :param pipeline: The compiled conversion and validation of the tag (None if there is none)
+        :param val: The value
+        :return: The formatted value (None if it was rejected)
         """
-        checked_values = []
-        for v in vals2check:
-            val = v
-            success = False
-            if isinstance(self.expected_responses[tag], range):
-                expected_range = sorted(list(self.expected_responses[tag]))
-                if expected_range[0] <= v <= expected_range[-1]:
-                    success = True
-            elif v in self.expected_responses[tag]:
-                success = True
-            if not success:
-                val = self._format_on_failure(tag, v, AssertionError(f"Unexpected value for {tag}"),
-                                              no_exception=is_list, return_none_on_fail=is_list)
-            if val is not None:
-                checked_values.append(val)
-        return checked_values
+        if isinstance(val, bs4.NavigableString):
+            val = str(val)
+        if self.value_formatter:
+            val = self.value_formatter(tag, val)
+        if pipeline is None:
+            return val
+        if not isinstance(val, list):
+            return self._run_pipeline(tag, pipeline, val, is_list=False)
+        checked = []
+        for v in val:
+            v = self._run_pipeline(tag, pipeline, v, is_list=True)
+            if v is not None:
+                checked.append(v)
+        return checked
 
-    def _convert_to_expected_type(self, vals2convert: List[Any], tag: str, is_list: bool) -> List[Any]:
+    def _run_pipeline(self, tag: str, pipeline: _TagPipeline, val: Any, is_list: bool) -> Any:
         """
-        Returns the list of values converted to the expected type
-        :param vals2convert: The list of values to convert
+        Converts the value to the expected type and checks that it is expected
         :param tag: The tag used to output values
-        :param is_list: If true no exception is thrown if formatting error occurs.
-        :return: The list of converted values
+        :param pipeline: The compiled conversion and validation of the tag
+        :param val: The value
+        :param is_list: If True the value is part of a list, so a failure rejects it instead of raising an exception
+        :return: The converted value (or the failure value if it could not be converted or was unexpected)
         """
-        converted = []
-        for v in vals2convert:
+        if pipeline.convert is not None:
             try:
-                val = self.expected_response_type[tag](v)
+                val = pipeline.convert(val)
             except (ValueError, TypeError) as e:
-                val = self._format_on_failure(tag, v, e, no_exception=is_list, return_none_on_fail=is_list)
-            if val is not None:
-                converted.append(val)
-        return converted
+                val = self._format_on_failure(tag, val, e, no_exception=is_list, return_none_on_fail=is_list)
+        if val is not None and pipeline.is_expected is not None and not pipeline.is_expected(val):
+            val = self._format_on_failure(tag, val, AssertionError(f"Unexpected value for {tag}"),
+                                          no_exception=is_list, return_none_on_fail=is_list)
+        return val
 
     def _format_on_failure(self, tag_id: str, val: Any, e: Union[Exception, str], no_exception: bool = False,
                            return_none_on_fail: bool = False) -> Any:
@@ -264,7 +326,8 @@ class PromptResponseManager:
         :return: Default value
         """
         assert no_exception or tag_id not in self.required_tag_ids, f"Missing expected tag {tag_id}"
-        print(f"Unexpected response for {tag_id}: {val} - {e}.")
+        self.errors.append(ResponseError(tag_id, val, e))
+        logging.debug("Unexpected response for %s: %s - %s.", tag_id, val, e)
         if self.default_factory:
             return self.default_factory(tag_id, val)
         return val if not return_none_on_fail else None
@@ -0,0 +1,116 @@
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+
+from core.drone_constants import DRONE_ID_KEY, END_KEY, SEARCH_KEY, STARTING_FLIGHT_PLAN_NUM, START_KEY
+from core.drone_plan import DronePlan
+from core.drone_variables import DroneVariables
+from prompts.prompt_factory import PromptFactory
+from prompts.structured_output import DRONES_KEY, REASONING_KEY, ResponseMode
+from test_data import test_drones, test_terrains
+
+"""
+Compares parsing the xml responses with decoding the json (function call) responses of the same plans:
+    python -m prompts.response_mode_benchmark --response ../examples/alpha_response.txt
+With --n-live, the first flight of the test mission is also generated by the model in each mode and the share of responses
+that fail to parse (or contain no plans) is reported. This makes real completions and requires OPEN_AI_ORG and OPEN_AI_KEY.
+"""
+
+DEFAULT_RESPONSE_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "examples", "alpha_response.txt")
+
+
+def run_benchmark(response_path: str = DEFAULT_RESPONSE_PATH, n_parses: int = 200) -> Dict[str, float]:
+    """
+    Measures the parse throughput of both response modes on the plans of an xml response.
+    :param response_path: The path to an xml response of the model (alphabetical cells).
+    :param n_parses: The number of times each response is parsed.
+    :return: Maps the response mode to its parses per second.
+    """
+    variables = _create_variables()
+    with open(response_path) as f:
+        xml_response = f.read()
+    factories = {mode: PromptFactory(variables, response_mode=mode) for mode in ResponseMode}
+    reference_plans = factories[ResponseMode.XML].parse(xml_response)
+    responses = {ResponseMode.XML: xml_response, ResponseMode.JSON: _to_json_response(reference_plans, variables)}
+    assert _to_cells(factories[ResponseMode.JSON].parse(responses[ResponseMode.JSON])) == _to_cells(reference_plans)
+
+    results = {}
+    for mode, factory in factories.items():
+        start = time.perf_counter()
+        for _ in range(n_parses):
+            factory.parse(responses[mode])
+        results[mode.value] = n_parses / (time.perf_counter() - start)
+    return results
+
+
+def measure_failure_rates(n_generations: int = 10) -> Dict[str, float]:
+    """
+    Generates the first flight of the test mission with the model in each response mode and counts the responses that cannot
+    be used.
+    :param n_generations: The number of generations per mode.
+    :return: Maps the response mode to the share of responses that failed to parse or contained no plans.
+    """
+    from llms.llm_manager import LLMManager  # requires the api keys
+
+    results = {}
+    for mode in ResponseMode:
+        n_failures = 0
+        for _ in range(n_generations):
+            factory = PromptFactory(_create_variables(test_terrains), response_mode=mode)
+            prompt = factory.build(flight_plan_num=STARTING_FLIGHT_PLAN_NUM)
+            history = LLMManager.make_completion(prompt, temperature=1, **factory.get_completion_params())
+            try:
+                n_failures += len(factory.parse(history[-1]["content"])) == 0
+            except Exception:
+                n_failures += 1
+        results[mode.value] = n_failures / n_generations
+    return results
+
+
+def _create_variables(terrains: List = None) -> DroneVariables:
+    """
+    :param terrains: The terrains of the mission (copied since they are translated in place).
+    :return: The variables of the test mission.
+    """
+    terrains = [{**t, "blocks": list(t["blocks"])} for t in terrains or []]
+    return DroneVariables(drones=test_drones, terrains=terrains, drone_max_distance=8, n_width_blocks=28,
+                          n_height_blocks=16, launch_point=(1, 1), battery_time=30, cells_in_single_battery=8,
+                          battery_changing_stations=[(1, 1), (1, 14), (8, 14), (8, 1)], weather_status="sunny",
+                          search_priorities=["Search bodies of water first.", "Search woods next."])
+
+
+def _to_json_response(plans: List[DronePlan], variables: DroneVariables) -> str:
+    """
+    Creates the function call arguments containing the same flights as the plans.
+    :param plans: The plan of each drone.
+    :param variables: Translates the cells.
+    :return: The json arguments.
+    """
+    flights = []
+    for plan in plans:
+        cells = [variables.translate_coordinate(c) for c in plan]
+        flights.append({DRONE_ID_KEY: plan.id, START_KEY: cells[0], SEARCH_KEY: cells[1:-1], END_KEY: cells[-1]})
+    return json.dumps({REASONING_KEY: "", DRONES_KEY: flights})
+
+
+def _to_cells(plans: List[DronePlan]) -> Dict[str, List]:
+    """
+    :param plans: The plan of each drone.
+    :return: Maps each drone to its cells.
+    """
+    return {plan.id: plan.coordinates for plan in plans}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the xml and json response modes.")
+    parser.add_argument("--response", default=DEFAULT_RESPONSE_PATH)
+    parser.add_argument("--n-parses", type=int, default=200)
+    parser.add_argument("--n-live", type=int, default=0, help="Number of live generations per mode (0 to skip).")
+    args = parser.parse_args()
+    for mode_name, parses_per_second in run_benchmark(args.response, args.n_parses).items():
+        print(f"{mode_name}: {parses_per_second:.0f} parses/s")
+    if args.n_live:
+        for mode_name, failure_rate in measure_failure_rates(args.n_live).items():
+            print(f"{mode_name}: {failure_rate:.1%} of live responses failed to parse")
@@ -0,0 +1,90 @@
+import json
+import re
+import string
+from enum import Enum
+from typing import Dict, Iterable, List, Tuple
+
+from core.drone_constants import DRONE_ID_KEY, END_KEY, L_BRACKET, R_BRACKET, SEARCH_KEY, START_KEY
+from core.drone_plan import DronePlan
+
+PLAN_FUNCTION_NAME = "submit_flight_plans"
+REASONING_KEY = "reasoning"
+DRONES_KEY = "drones"
+LIST_KEYS = {SEARCH_KEY}
+ALPHA_CELL_PATTERN = re.compile(r"([A-Z])\s*(\d+)")
+NUMERIC_CELL_PATTERN = re.compile(r"(\d+)\s*,\s*(\d+)")
+
+
+class ResponseMode(Enum):
+    """
+    The format the model is asked to respond in.
+    """
+    XML = "xml"  # plans enclosed in xml tags within the text of the response
+    JSON = "json"  # plans passed as arguments to a function matching a json schema
+
+
+class StructuredOutput:
+    """
+    Creates the json schema of the flight plans and decodes responses that follow it.
+    """
+
+    @staticmethod
+    def build_schema(response_format_example: Dict[str, str]) -> Dict:
+        """
+        Creates the json schema of the response from the example of the response format.
+        :param response_format_example: Maps each field of a drone's flight to its description (e.g. [Starting Cell]).
+        :return: The json schema.
+        """
+        drone_properties = {}
+        for key, example in response_format_example.items():
+            description = example.strip(L_BRACKET + R_BRACKET)
+            drone_properties[key] = {"type": "array", "items": {"type": "string"}, "description": description} \
+                if key in LIST_KEYS else {"type": "string", "description": description}
+        return {
+            "type": "object",
+            "properties": {
+                REASONING_KEY: {"type": "string", "description": "Your answers to the questions about the mission."},
+                DRONES_KEY: {"type": "array", "items": {"type": "object", "properties": drone_properties,
+                                                        "required": list(drone_properties.keys())}}
+            },
+            "required": [REASONING_KEY, DRONES_KEY]
+        }
+
+    @staticmethod
+    def build_functions(response_format_example: Dict[str, str]) -> List[Dict]:
+        """
+        Creates the function the model is asked to call with its plans.
+        :param response_format_example: Maps each field of a drone's flight to its description.
+        :return: The function definitions passed with the request.
+        """
+        return [{"name": PLAN_FUNCTION_NAME,
+                 "description": "Submits the next flight of each drone.",
+                 "parameters": StructuredOutput.build_schema(response_format_example)}]
+
+    @staticmethod
+    def decode(arguments: str, alpha_format: bool) -> List[DronePlan]:
+        """
+        Decodes the arguments of the function call directly into plans. Flights of the same drone are combined.
+        :param arguments: The json arguments given by the model.
+        :param alpha_format: Whether cells are alphabetical (e.g. K10) or numeric (e.g. (10, 11)).
+        :return: A plan for each drone.
+        """
+        id2cells: Dict[str, List[Tuple[int, int]]] = {}
+        for flight in json.loads(arguments)[DRONES_KEY]:
+            cells = id2cells.setdefault(flight[DRONE_ID_KEY], [])
+            search = flight[SEARCH_KEY]
+            for value in (flight[START_KEY], *([search] if isinstance(search, str) else search), flight[END_KEY]):
+                cells.extend(StructuredOutput._parse_cells(value, alpha_format))
+        return [DronePlan(drone_id, cells) for drone_id, cells in id2cells.items()]
+
+    @staticmethod
+    def _parse_cells(value: str, alpha_format: bool) -> Iterable[Tuple[int, int]]:
+        """
+        Parses the cells in a field (usually a single cell, but lists of cells are accepted).
+        :param value: The value of the field.
+        :param alpha_format: Whether cells are alphabetical or numeric.
+        :return: The numeric coordinates of the cells.
+        """
+        if alpha_format:
+            return [(int(x), string.ascii_uppercase.index(y) + 1) for y, x in ALPHA_CELL_PATTERN.findall(value)]
+        return [(int(x), int(y)) for x, y in NUMERIC_CELL_PATTERN.findall(value)]
@@ -1,14 +1,18 @@
+import argparse
 import logging
-import random
 from typing import Any, List
 
 from core.drone_constants import EMPTY_STRING
 from core.drone_variables import DroneVariables
+from core.flight_simulator import FlightSimulator, SECONDS_IN_MINUTE
+from core.plan_exporter import GridTransform, PlanWriter
 from src.core.drone_plan import DronePlan
 from src.core.plan_generator import PlanGenerator
 from test_data import test_drones, test_terrains
+from utils.profiler import DEFAULT_SAMPLE_HZ, Profiler
 
 MOCK_DEFAULT = False
+ADAPTATION_MINUTES_DEFAULT = 45
 ALPHA_DEFAULT = True
 test_responses = {
     False: "../examples/numeric_response.txt",
@@ -30,22 +34,27 @@ drone_variables = DroneVariables(
 )
 
 
-def run_initial_plan_generation(should_mock: bool = MOCK_DEFAULT):
+def run_initial_plan_generation(should_mock: bool = MOCK_DEFAULT, plan_generator: PlanGenerator = None):
     logging.info("Running initial plan generation")
     mock_response = test_responses[ALPHA_DEFAULT] if should_mock else None
-    plan_generator = PlanGenerator(drone_variables)
+    plan_generator = PlanGenerator(drone_variables) if plan_generator is None else plan_generator
     initial_plan = plan_generator.generate_initial(mock_response=mock_response)
     return initial_plan
 
 
-def run_adaption_plan_generation(adapted_plan: List[DronePlan], current_index_of_drones: int, plan_adaptation: str,
-                                 should_mock: bool = MOCK_DEFAULT):
+def run_adaption_plan_generation(adapted_plan: List[DronePlan], elapsed_minutes: float, plan_adaptation: str,
+                                 should_mock: bool = MOCK_DEFAULT, plan_generator: PlanGenerator = None):
     logging.info("Running plan adaption")
     mock_response = test_responses[ALPHA_DEFAULT] if should_mock else None
-    plan_generator = PlanGenerator(drone_variables)
-    drone_locations = {drone_plan.id: drone_plan.coordinates[current_index_of_drones] for drone_plan in adapted_plan}
+    plan_generator = PlanGenerator(drone_variables) if plan_generator is None else plan_generator
+    simulator = FlightSimulator(adapted_plan, drone_variables)
+    elapsed_seconds = elapsed_minutes * SECONDS_IN_MINUTE
+    drone_locations = simulator.get_current_locations(elapsed_seconds)
     adapted_plan = plan_generator.generate_adaption(plan_adaptation=plan_adaptation,
                                                     current_location_of_drones=drone_locations,
+                                                    current_round=simulator.get_current_round(elapsed_seconds),
+                                                    remaining_battery=simulator.get_remaining_battery(elapsed_seconds),
+                                                    covered_cells=simulator.get_covered_cells(elapsed_seconds),
                                                     mock_response=mock_response)
     return adapted_plan
 
@@ -61,13 +70,32 @@ def prompt_tf(prompt: str, default_value: Any = None) -> bool:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates the initial and adapted plans of the test mission.")
+    parser.add_argument("--profile", help="Directory to write the collapsed stacks (and allocations) of the run to.")
+    parser.add_argument("--profile-hz", type=float, default=DEFAULT_SAMPLE_HZ, help="Stack samples per second.")
+    parser.add_argument("--profile-allocations", action="store_true", help="Record tracemalloc snapshots each round.")
+    parser.add_argument("--export", help="Path to write the initial and adapted plans to (.csv, .npz or .geojson).")
+    parser.add_argument("--geo-bounds", type=float, nargs=4, metavar=("WEST", "SOUTH", "EAST", "NORTH"),
+                        help="Geographic bounds of the search area for GeoJSON exports (grid units if omitted).")
+    args = parser.parse_args()
+    if args.profile:
+        Profiler.set_default(Profiler(args.profile, sample_hz=args.profile_hz,
+                                      trace_allocations=args.profile_allocations))
     logging.basicConfig()
     logging.root.setLevel(logging.INFO)
     logging.info("Starting prompt runner...")
-    initial = run_initial_plan_generation(should_mock=MOCK_DEFAULT)
+    mission_plan_generator = PlanGenerator(drone_variables)
+    initial = run_initial_plan_generation(should_mock=MOCK_DEFAULT, plan_generator=mission_plan_generator)
     adaption = run_adaption_plan_generation(plan_adaptation="The missing person has been found at location K10.",
                                             adapted_plan=initial,
-                                            current_index_of_drones=random.randint(0, len(initial[0].coordinates))-1,
-                                            should_mock=MOCK_DEFAULT)
+                                            elapsed_minutes=ADAPTATION_MINUTES_DEFAULT,
+                                            should_mock=MOCK_DEFAULT,
+                                            plan_generator=mission_plan_generator)
     for drone in initial:
         print(drone.id, ":", drone.coordinates)
+    if args.export:
+        transform = GridTransform.from_bounds(*args.geo_bounds, drone_variables.n_width_blocks,
+                                              drone_variables.n_height_blocks) if args.geo_bounds else None
+        with PlanWriter.for_path(args.export, transform) as writer:
+            writer.write_all([("initial", initial), ("adaptation", adaption)])
+        logging.info(f"Exported {writer.n_rows} cells to {args.export}")
@@ -7,6 +7,7 @@ from bs4.element import NavigableString
 
 from core.drone_constants import EMPTY_STRING, NEW_LINE
 from prompts.prompt_util import PromptUtil
+from utils.metrics import METRICS, PARSE_FAILURES
 
 
 class LLMResponseUtil:
@@ -39,6 +40,7 @@ class LLMResponseUtil:
             assert len(content) > 0, f"Found no tags ({tag_name}) in:\n{res}"
         except Exception as e:
             error = f"{NEW_LINE}Unable to parse {tag_name}"
+            METRICS.increment(PARSE_FAILURES, tag=tag_name)
             print(error)
             print(e)
             if raise_exception:
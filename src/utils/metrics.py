@@ -0,0 +1,252 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from core.drone_constants import COMMA, EMPTY_STRING, NEW_LINE
+
+METRICS_ENABLED_ENV = "DRONE_METRICS"
+METRICS_FILE_ENV = "DRONE_METRICS_FILE"
+STAGE_SECONDS = "plan_stage_seconds"
+PROMPT_TOKENS = "llm_prompt_tokens"
+COMPLETION_TOKENS = "llm_completion_tokens"
+PARSE_FAILURES = "llm_parse_failures_total"
+CACHE_HITS = "cache_hits_total"
+CACHE_MISSES = "cache_misses_total"
+RETRIES = "llm_retries_total"
+HEDGES = "llm_hedged_requests_total"
+SHARED_REQUESTS = "llm_shared_requests_total"
+PROMPT_DEGRADATIONS = "prompt_degradations_total"
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class _NullSpan:
+    """
+    Span used when metrics are disabled so timing a stage costs a single attribute lookup.
+    """
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *args) -> None:
+        return None
+
+
+class _Span:
+    """
+    Times a single stage and records its duration into the stage histogram on exit.
+    """
+    __slots__ = ("registry", "labels", "start")
+
+    def __init__(self, registry: "MetricsRegistry", labels: LabelKey):
+        """
+        Creates a span for a stage.
+        :param registry: The registry to record the duration in.
+        :param labels: The labels identifying the stage.
+        """
+        self.registry = registry
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.registry._observe(STAGE_SECONDS, self.labels, time.perf_counter() - self.start, SECONDS_BUCKETS)
+
+
+class _Histogram:
+    """
+    Cumulative histogram with fixed bucket upper bounds (prometheus semantics).
+    """
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        """
+        Creates an empty histogram.
+        :param bounds: The sorted upper bounds of each bucket.
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Adds a value to the histogram.
+        :param value: The observed value.
+        :return: None
+        """
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    In-process registry of counters and histograms that can be exported in the prometheus text format.
+    When disabled, all recording calls return immediately.
+    """
+    _NULL_SPAN = _NullSpan()
+
+    def __init__(self, enabled: bool = False, export_path: str = None):
+        """
+        Creates the registry.
+        :param enabled: Whether to record metrics.
+        :param export_path: If provided, flush writes the prometheus text to this file.
+        """
+        self.enabled = enabled
+        self.export_path = export_path
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def span(self, stage: str, **labels):
+        """
+        Creates a context manager timing the given stage.
+        :param stage: The name of the stage (e.g. api_call).
+        :param labels: Any additional labels to attach to the measurement.
+        :return: The context manager.
+        """
+        if not self.enabled:
+            return self._NULL_SPAN
+        return _Span(self, self._to_key(stage=stage, **labels))
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Increments a counter.
+        :param name: The name of the counter.
+        :param value: The amount to increment by.
+        :param labels: The labels identifying the series.
+        :return: None
+        """
+        if not self.enabled:
+            return
+        key = self._to_key(**labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = SECONDS_BUCKETS, **labels) -> None:
+        """
+        Records a value in a histogram.
+        :param name: The name of the histogram.
+        :param value: The observed value.
+        :param buckets: The bucket upper bounds used if the histogram does not exist yet.
+        :param labels: The labels identifying the series.
+        :return: None
+        """
+        if not self.enabled:
+            return
+        self._observe(name, self._to_key(**labels), value, buckets)
+
+    def get_counter(self, name: str, **labels) -> float:
+        """
+        Gets the current value of a counter.
+        :param name: The name of the counter.
+        :param labels: The labels identifying the series.
+        :return: The value of the counter (0 if never incremented).
+        """
+        return self._counters.get(name, {}).get(self._to_key(**labels), 0)
+
+    def get_histogram(self, name: str, **labels) -> Optional[Tuple[int, float]]:
+        """
+        Gets the count and sum of a histogram.
+        :param name: The name of the histogram.
+        :param labels: The labels identifying the series.
+        :return: The count and sum of observed values or None if nothing was observed.
+        """
+        histogram = self._histograms.get(name, {}).get(self._to_key(**labels))
+        return (histogram.count, histogram.sum) if histogram else None
+
+    def reset(self) -> None:
+        """
+        Removes all recorded metrics.
+        :return: None
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_prometheus_text(self) -> str:
+        """
+        Exports all metrics in the prometheus text exposition format.
+        :return: The exported metrics.
+        """
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{self._format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else str(bound)
+                        lines.append(f"{name}_bucket{self._format_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{self._format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{self._format_labels(key)} {histogram.count}")
+        return NEW_LINE.join(lines) + NEW_LINE if lines else EMPTY_STRING
+
+    def flush(self, path: str = None) -> None:
+        """
+        Writes the prometheus text to the export path (atomically replacing the previous export).
+        :param path: Overrides the export path of the registry.
+        :return: None
+        """
+        path = path if path else self.export_path
+        if not self.enabled or not path:
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as file:
+            file.write(self.to_prometheus_text())
+        os.replace(tmp_path, path)
+
+    def _observe(self, name: str, key: LabelKey, value: float, buckets: Tuple[float, ...]) -> None:
+        """
+        Records a value in a histogram using an already constructed label key.
+        :param name: The name of the histogram.
+        :param key: The label key of the series.
+        :param value: The observed value.
+        :param buckets: The bucket upper bounds used if the histogram does not exist yet.
+        :return: None
+        """
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    @staticmethod
+    def _to_key(**labels) -> LabelKey:
+        """
+        Converts the labels to a hashable key.
+        :param labels: The labels identifying a series.
+        :return: The key.
+        """
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    @staticmethod
+    def _format_labels(key: LabelKey) -> str:
+        """
+        Formats the labels in the prometheus format.
+        :param key: The label key of a series.
+        :return: The formatted labels (e.g. {stage="parse"}).
+        """
+        if not key:
+            return EMPTY_STRING
+        labels: List[str] = [f'{k}="{v}"' for k, v in key]
+        return "{" + COMMA.join(labels) + "}"
+
+
+METRICS = MetricsRegistry(enabled=os.environ.get(METRICS_ENABLED_ENV, EMPTY_STRING).lower() in ("1", "true"),
+                          export_path=os.environ.get(METRICS_FILE_ENV))
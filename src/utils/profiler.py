@@ -0,0 +1,207 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from core.drone_constants import EMPTY_STRING, NEW_LINE
+
+PROFILE_DIR_ENV = "DRONE_PROFILE_DIR"
+PROFILE_HZ_ENV = "DRONE_PROFILE_HZ"
+PROFILE_ALLOCATIONS_ENV = "DRONE_PROFILE_ALLOCATIONS"
+COLLAPSED_STACKS_FILE = "collapsed_stacks.txt"
+ALLOCATIONS_FILE = "allocations.txt"
+DEFAULT_SAMPLE_HZ = 100
+DEFAULT_MAX_OVERHEAD = 0.01
+MAX_STACK_DEPTH = 64
+N_TOP_ALLOCATIONS = 25
+
+
+class Profiler:
+    """
+    Samples the stacks of all threads at a fixed rate and, optionally, records tracemalloc snapshots after each round.
+    On stop, writes the samples as collapsed stacks (one "frame;frame;frame count" line per stack, the input of flamegraph
+    tools) and the top allocations of each round.
+    The sampler lowers its rate whenever sampling would use more than max_overhead of a core. Tracing allocations slows
+    every allocation in the process and is therefore enabled separately.
+    """
+    _default: "Profiler" = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, output_dir: str, sample_hz: float = DEFAULT_SAMPLE_HZ, trace_allocations: bool = False,
+                 max_overhead: float = DEFAULT_MAX_OVERHEAD, n_top_allocations: int = N_TOP_ALLOCATIONS):
+        """
+        Creates the profiler.
+        :param output_dir: The directory the collapsed stacks and allocation report are written to.
+        :param sample_hz: The number of stack samples taken per second.
+        :param trace_allocations: Whether to record tracemalloc snapshots after each round.
+        :param max_overhead: The maximum share of a core spent sampling.
+        :param n_top_allocations: The number of allocation sites reported per round.
+        """
+        self.output_dir = output_dir
+        self.sample_interval = 1 / sample_hz
+        self.trace_allocations = trace_allocations
+        self.max_overhead = max_overhead
+        self.n_top_allocations = n_top_allocations
+        self.stacks = Counter()
+        self.n_samples = 0
+        self.sampling_seconds = 0.0
+        self.profiled_seconds = 0.0
+        self._start_time = None
+        self.allocation_reports: List[Tuple[str, List[str]]] = []
+        self._previous_snapshot: Optional[tracemalloc.Snapshot] = None
+        self._started_tracemalloc = False
+        self._n_sessions = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def get_default() -> Optional["Profiler"]:
+        """
+        Gets the profiler shared by all plan generators that are not given one (created from the environment on first use).
+        :return: The profiler or None if profiling is disabled.
+        """
+        with Profiler._default_lock:
+            if Profiler._default is None:
+                Profiler._default = Profiler.from_env()
+            return Profiler._default or None
+
+    @staticmethod
+    def set_default(profiler: Optional["Profiler"]) -> None:
+        """
+        Sets the profiler shared by all plan generators that are not given one.
+        :param profiler: The profiler (None to disable).
+        :return: None
+        """
+        with Profiler._default_lock:
+            Profiler._default = profiler if profiler is not None else False
+
+    @staticmethod
+    def from_env() -> Optional["Profiler"]:
+        """
+        Creates the profiler configured by the environment (DRONE_PROFILE_DIR enables it).
+        :return: The profiler or False if profiling is disabled.
+        """
+        output_dir = os.environ.get(PROFILE_DIR_ENV)
+        if not output_dir:
+            return False
+        return Profiler(output_dir, sample_hz=float(os.environ.get(PROFILE_HZ_ENV, DEFAULT_SAMPLE_HZ)),
+                        trace_allocations=os.environ.get(PROFILE_ALLOCATIONS_ENV, EMPTY_STRING).lower() in ("1", "true"))
+
+    def start(self) -> None:
+        """
+        Starts profiling. Sessions may overlap (e.g. concurrent generators); profiling stops when the last one stops.
+        :return: None
+        """
+        with self._lock:
+            self._n_sessions += 1
+            if self._n_sessions > 1:
+                return
+            if self.trace_allocations and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            self._stopped.clear()
+            self._start_time = time.perf_counter()
+            self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self._thread.start()
+
+    def snapshot(self, label: str) -> None:
+        """
+        Records the allocations that grew the most since the previous snapshot.
+        :param label: The label of the snapshot (e.g. the round).
+        :return: None
+        """
+        if not self.trace_allocations or not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        with self._lock:
+            previous, self._previous_snapshot = self._previous_snapshot, snapshot
+        stats = snapshot.compare_to(previous, "lineno") if previous else snapshot.statistics("lineno")
+        self.allocation_reports.append((label, [str(stat) for stat in stats[:self.n_top_allocations]]))
+
+    def stop(self) -> None:
+        """
+        Ends a session; the last session stops sampling and writes the reports.
+        :return: None
+        """
+        with self._lock:
+            self._n_sessions -= 1
+            if self._n_sessions > 0:
+                return
+            thread = self._thread
+            self._thread = None
+        self._stopped.set()
+        if thread is not None:
+            thread.join()
+            self.profiled_seconds += time.perf_counter() - self._start_time
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+            self._previous_snapshot = None
+        self.write()
+
+    def write(self) -> None:
+        """
+        Writes the collapsed stacks and the allocation report to the output directory.
+        :return: None
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(os.path.join(self.output_dir, COLLAPSED_STACKS_FILE), "w") as file:
+            file.writelines(f"{stack} {count}{NEW_LINE}" for stack, count in self.stacks.most_common())
+        if self.allocation_reports:
+            with open(os.path.join(self.output_dir, ALLOCATIONS_FILE), "w") as file:
+                for label, lines in self.allocation_reports:
+                    file.write(f"# {label}{NEW_LINE}")
+                    file.writelines(f"{line}{NEW_LINE}" for line in lines)
+
+    def get_overhead(self) -> float:
+        """
+        :return: The share of the profiled (wall) time that was spent taking samples.
+        """
+        return self.sampling_seconds / self.profiled_seconds if self.profiled_seconds else 0.0
+
+    def __enter__(self) -> "Profiler":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def _sample_loop(self) -> None:
+        """
+        Takes samples until stopped, waiting longer between samples if they are too expensive for the overhead budget.
+        :return: None
+        """
+        own_thread_id = threading.get_ident()
+        thread_names = {}
+        interval = self.sample_interval
+        while not self._stopped.wait(interval):
+            start = time.perf_counter()
+            if len(thread_names) != threading.active_count():
+                thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_thread_id:
+                    self.stacks[self._collapse(thread_names.get(thread_id, str(thread_id)), frame)] += 1
+            elapsed = time.perf_counter() - start
+            self.n_samples += 1
+            self.sampling_seconds += elapsed
+            interval = max(self.sample_interval, elapsed / self.max_overhead)
+
+    @staticmethod
+    def _collapse(thread_name: str, frame) -> str:
+        """
+        Converts a stack to its collapsed form (root first).
+        :param thread_name: The name of the sampled thread (the root of its stacks).
+        :param frame: The innermost frame of the thread.
+        :return: The collapsed stack.
+        """
+        frames = []
+        while frame is not None and len(frames) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        frames.append(thread_name)
+        return ";".join(reversed(frames))
@@ -0,0 +1,9 @@
+from runner import drone_variables
+from src.core.distance_field import StationDistanceField
+
+
+def test_flights_without_search_cells_have_no_transit():
+    distance_field = StationDistanceField.for_variables(drone_variables)
+
+    assert distance_field.estimate_transit([]) == 0
+    assert distance_field.is_feasible([], drone_variables.cells_in_single_battery)
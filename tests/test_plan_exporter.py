@@ -0,0 +1,13 @@
+from core.drone_plan import DronePlan
+from core.plan_exporter import PlanWriter
+
+
+def test_stages_mark_the_start_of_flights_that_do_not_share_it():
+    plan = DronePlan("Red", [(1, 1), (2, 1), (3, 1), (1, 1)])
+    plan.add_to_plan([(5, 5), (6, 5), (1, 1)])
+    plan.add_to_plan([(1, 1), (1, 2), (2, 2)])
+
+    rows = PlanWriter.to_array("mission", [plan])
+
+    assert rows["round"].tolist() == [0, 0, 0, 0, 1, 1, 1, 2, 2]
+    assert "".join(rows["stage"].tolist()) == "abbcabcbc"
@@ -0,0 +1,60 @@
+from typing import List
+
+from core.drone_plan import DronePlan
+from core.plan_reconciler import PlanReconciler
+
+
+def get_search_cells(plan: DronePlan) -> List:
+    return [cell for r in range(plan.n_rounds) for cell in plan.get_flight(r)[1:-1]]
+
+
+def assert_contiguous(plan: DronePlan) -> None:
+    for r in range(plan.n_rounds):
+        flight = plan.get_flight(r)
+        for cell, next_cell in zip(flight, flight[1:]):
+            assert abs(cell[0] - next_cell[0]) + abs(cell[1] - next_cell[1]) == 1, (plan.id, r, cell, next_cell)
+
+
+def test_overlapping_drones_search_each_cell_once():
+    row = DronePlan("Red", [(x, 3) for x in range(1, 9)])
+    column = DronePlan("Blue", [(4, y) for y in range(1, 5)])
+    turn = DronePlan("Green", [(6, 5), (6, 4), (6, 3), (7, 3), (7, 2), (7, 1)])
+
+    plans = PlanReconciler.reconcile([row, column, turn])
+
+    search_cells = [cell for plan in plans for cell in get_search_cells(plan)]
+    assert len(search_cells) == len(set(search_cells))
+    for plan, original in zip(plans, [row, column, turn]):
+        assert_contiguous(plan)
+        assert (plan.get_cell(0), plan.get_cell(-1)) == (original.get_cell(0), original.get_cell(-1))
+    red, blue, green = plans
+    assert (4, 3) in get_search_cells(blue) and (4, 3) not in get_search_cells(red)
+    assert (6, 3) in get_search_cells(green) and (6, 3) not in get_search_cells(red)
+
+
+def test_later_round_does_not_search_cells_again():
+    plan = DronePlan("Red", [(5, 5), (5, 6), (6, 6), (6, 5), (5, 5)])
+    plan.add_to_plan([(5, 5), (5, 6), (4, 6), (4, 7), (5, 7), (6, 7), (7, 7), (7, 6), (7, 5), (7, 4), (6, 4), (5, 4),
+                      (5, 5)])
+    assert plan.get_round(1)[0] == (5, 6)
+
+    reconciled, = PlanReconciler.reconcile([plan])
+
+    assert reconciled.n_rounds == 2 and reconciled.is_start_shared(1)
+    assert reconciled.get_flight(1)[:3] == [(5, 5), (4, 5), (4, 6)]
+    search_cells = get_search_cells(reconciled)
+    assert len(search_cells) == len(set(search_cells))
+    assert_contiguous(reconciled)
+
+
+def test_flight_starting_away_from_previous_end_keeps_its_start():
+    plan = DronePlan("Red", [(1, 1), (2, 1), (3, 1), (3, 2)])
+    plan.add_to_plan([(2, 1), (2, 2), (3, 2)])
+    other = DronePlan("Blue", [(1, 4), (2, 4), (2, 3), (2, 2), (1, 2)])
+
+    red, blue = PlanReconciler.reconcile([plan, other])
+
+    assert not red.is_start_shared(1)
+    assert red.get_flight(1)[0] == (2, 1)
+    assert (2, 2) not in get_search_cells(red) and (2, 2) in get_search_cells(blue)
+    assert_contiguous(red)
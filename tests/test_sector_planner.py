@@ -0,0 +1,14 @@
+from runner import drone_variables
+from src.core.drone_constants import N_DRONE_FLIGHTS
+from src.core.sector_planner import SectorPlanner
+
+
+def test_sectors_grow_until_every_sector_is_assigned():
+    planner = SectorPlanner(drone_variables, max_cells_per_sector=1)
+
+    sectors = planner.split_sectors()
+    sector2drones = planner.assign_sectors(sectors)
+
+    assert 1 < len(sectors) <= len(drone_variables.drones) * N_DRONE_FLIGHTS
+    assert sorted(sector2drones) == list(range(len(sectors)))
+    assert sum(sector.weight for sector in sectors) == len(planner._get_terrain_cells())
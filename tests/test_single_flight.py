@@ -0,0 +1,31 @@
+import asyncio
+import threading
+
+import pytest
+
+from llms.single_flight import SingleFlight
+
+
+def test_joiners_stop_waiting_at_their_timeout():
+    single_flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def call():
+        started.set()
+        release.wait()
+        return 42
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(single_flight.do("key", call)))
+    leader.start()
+    started.wait()
+
+    with pytest.raises(TimeoutError):
+        single_flight.do("key", call, timeout=0.01)
+    with pytest.raises(TimeoutError):
+        asyncio.run(single_flight.do_async("key", call, timeout=0.01))
+
+    release.set()
+    leader.join()
+    assert results == [(42, False)]
+    assert single_flight.in_flight() == 0
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from core.raster_terrain_loader import BATTERY_CHARGING_TERRAIN, LAUNCH_PAD_TERRAIN
+from core.tiled_terrain_store import TiledTerrainStore
+
+TERRAIN_TYPES = ["Woodland", LAUNCH_PAD_TERRAIN, BATTERY_CHARGING_TERRAIN, "Lake"]
+TILE_SIZE = 4
+N_WIDTH_BLOCKS, N_HEIGHT_BLOCKS = 10, 7  # partial edge tiles in both directions
+
+
+@pytest.fixture
+def grid() -> np.ndarray:
+    return np.random.default_rng(0).integers(0, len(TERRAIN_TYPES) + 1, size=(N_HEIGHT_BLOCKS, N_WIDTH_BLOCKS),
+                                             dtype=np.uint8)
+
+
+@pytest.fixture
+def store_path(tmp_path, grid) -> str:
+    path = str(tmp_path / "terrain.tiles")
+    with TiledTerrainStore.create(path, N_WIDTH_BLOCKS, N_HEIGHT_BLOCKS, TERRAIN_TYPES, tile_size=TILE_SIZE) as store:
+        for min_y in range(1, N_HEIGHT_BLOCKS + 1, 3):
+            for min_x in range(1, N_WIDTH_BLOCKS + 1, 3):
+                store.write_window((min_x, min_y), grid[min_y - 1:min_y + 2, min_x - 1:min_x + 2])
+    return path
+
+
+def test_create_sorts_terrain_types(store_path):
+    with TiledTerrainStore.open(store_path) as store:
+        assert store.terrain_types == sorted(TERRAIN_TYPES)
+        assert store.tiles.shape == (2, 3, TILE_SIZE, TILE_SIZE)
+
+
+@pytest.mark.parametrize("window", [((1, 1), (N_WIDTH_BLOCKS, N_HEIGHT_BLOCKS)), ((3, 2), (6, 5)), ((4, 4), (5, 5)),
+                                    ((9, 5), (10, 7)), ((10, 7), (10, 7))])
+def test_read_window_round_trips_across_tiles(store_path, grid, window):
+    (min_x, min_y), (max_x, max_y) = window
+    with TiledTerrainStore.open(store_path) as store:
+        np.testing.assert_array_equal(store.read_window(window), grid[min_y - 1:max_y, min_x - 1:max_x])
+
+
+def test_write_window_keeps_surrounding_cells(store_path, grid):
+    labels = np.full((3, 4), len(TERRAIN_TYPES), dtype=np.uint8)
+    with TiledTerrainStore.open(store_path, writable=True) as store:
+        store.write_window((7, 5), labels)
+    grid[4:7, 6:10] = labels
+    with TiledTerrainStore.open(store_path) as store:
+        np.testing.assert_array_equal(store.read_window(((1, 1), (N_WIDTH_BLOCKS, N_HEIGHT_BLOCKS))), grid)
+
+
+def test_window_outside_of_grid_is_rejected(store_path):
+    with TiledTerrainStore.open(store_path) as store:
+        with pytest.raises(AssertionError):
+            store.read_window(((9, 5), (11, 7)))
+
+
+def test_load_terrains_of_window_spanning_tiles(tmp_path):
+    path = str(tmp_path / "large.tiles")
+    label_ids = {t: i for i, t in enumerate(sorted(TERRAIN_TYPES), start=1)}
+    with TiledTerrainStore.create(path, 30, 20, TERRAIN_TYPES, tile_size=8) as store:
+        store.write_window((1, 1), np.full((20, 30), label_ids["Woodland"], dtype=np.uint8))
+        store.write_window((8, 7), np.array([[label_ids[LAUNCH_PAD_TERRAIN], label_ids[BATTERY_CHARGING_TERRAIN]]],
+                                            dtype=np.uint8))
+        store.write_window((17, 9), np.full((2, 2), label_ids["Lake"], dtype=np.uint8))
+
+    with TiledTerrainStore.open(path) as store:
+        terrains, stations, launch_point = store.load_terrains(((7, 6), (18, 10)))
+        variables = store.create_drone_variables(((7, 6), (18, 10)), drones=[], drone_max_distance=8, battery_time=30,
+                                                 cells_in_single_battery=8,
+                                                 search_priorities=[], weather_status="clear")
+
+    blocks = {terrain["type"]: terrain["blocks"] for terrain in terrains}
+    assert launch_point == (2, 2)
+    assert stations == [(3, 2)]
+    assert sorted(blocks["Lake"]) == [(11, 4), (11, 5), (12, 4), (12, 5)]
+    assert len(blocks["Woodland"]) == 12 * 5 - 6
+    assert (variables.n_width_blocks, variables.n_height_blocks) == (12, 5)